@@ -6,7 +6,7 @@ from clingo.script import enable_python
 
 from viasp import Control
 from viasp.server import startup
-from viasp.shared.defaults import DEFAULT_BACKEND_HOST, DEFAULT_BACKEND_PORT, DEFAULT_FRONTEND_PORT, DEFAULT_BACKEND_PROTOCOL
+from viasp.shared.defaults import DEFAULT_BACKEND_HOST, DEFAULT_BACKEND_PORT, DEFAULT_FRONTEND_PORT, DEFAULT_BACKEND_PROTOCOL, DEFAULT_PATH_WORKERS
 
 try:
     VERSION = importlib.metadata.version("viasp")
@@ -31,6 +31,7 @@ def _get_parser():
     parser.add_argument('--host', type=str, help='The host for the backend and frontend', default=DEFAULT_BACKEND_HOST)
     parser.add_argument('-p', '--port', type=int, help='The port for the backend', default=DEFAULT_BACKEND_PORT)
     parser.add_argument('-f', '--frontend-port', type=int, help='The port for the frontend', default=DEFAULT_FRONTEND_PORT)
+    parser.add_argument('-w', '--workers', type=int, help='The number of processes used to build the graph', default=DEFAULT_PATH_WORKERS)
     parser.add_argument('--version','-v', action='version', version=f'%(prog)s {VERSION}')
 
     clingraph_group = parser.add_argument_group('Clingraph', 'If included, a clingraph visualization will be made.')
@@ -53,10 +54,11 @@ def backend():
     parser = argparse.ArgumentParser(description='viasp backend')
     parser.add_argument('--host', type=str, help='The host for the backend', default=DEFAULT_BACKEND_HOST)
     parser.add_argument('-p', '--port', type=int, help='The port for the backend', default=DEFAULT_BACKEND_PORT)
-    app = create_app()
+    parser.add_argument('-w', '--workers', type=int, help='The number of processes used to build the graph', default=DEFAULT_PATH_WORKERS)
     use_reloader = False
     debug = False
     args = parser.parse_args()
+    app = create_app(workers=args.workers)
     host = args.host
     port = args.port
     print(f"Starting viASP backend at {host}:{port}")
@@ -79,8 +81,9 @@ def start():
     graphviz_type = args.graphviz_type
     head_name = args.head_name
     no_collect_variables = args.no_collect_variables
+    workers = args.workers
 
-    app = startup.run(host=DEFAULT_BACKEND_HOST, port=DEFAULT_BACKEND_PORT)
+    app = startup.run(host=DEFAULT_BACKEND_HOST, port=DEFAULT_BACKEND_PORT, workers=workers)
     
     options = [str(models)]
 
@@ -1,26 +1,46 @@
 """This module is concerned with finding reasons for why a stable model is found."""
 from collections import defaultdict
-from typing import List, Collection, Dict, Iterable, Union, cast
+import multiprocessing
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import replace
+from functools import lru_cache
+from threading import Lock
+from weakref import WeakSet
+from uuid import UUID
+from typing import Callable, List, Tuple, Collection, Dict, Iterable, Optional, Set, Union, cast
 
 import networkx as nx
 
-from clingo import Control, Symbol, Model, ast
+from clingo import Control, Symbol, Model, ast, parse_term
 
-from clingo.ast import AST
+from clingo.ast import AST, parse_string
 from networkx import DiGraph
 
 from .reify import ProgramAnalyzer, has_an_interval
 from .recursion import RecursionReasoner
-from .utils import insert_atoms_into_nodes, identify_reasons, harmonize_uuids, calculate_spacing_factor
+from .utils import insert_atoms_into_nodes, identify_reasons, harmonize_uuids, calculate_spacing_factor, \
+    add_to_control, make_external
+from ..shared.defaults import DEFAULT_PATH_WORKERS
 from ..shared.model import Node, Transformation, SymbolIdentifier
 from ..shared.simple_logging import info, warn
-from ..shared.util import pairwise, get_leafs_from_graph
+from ..shared.util import pairwise, get_leafs_from_graph, DefaultMappingProxyType
 
 
 def stringify_fact(fact: Symbol) -> str:
     return f"{str(fact)}."
 
 
+@lru_cache(maxsize=None)
+def get_new_atoms_rule(h: str) -> List[AST]:
+    """
+    Returns the rule that derives the first h atom of every symbol as _h atom.
+    """
+    rules: List[AST] = []
+    parse_string(f"_{h}(I, H, G) :- {h}(I, H, G), not {h}(II,H,_) : II<I, {h}(II,_,_).",
+                 rules.append)
+    return rules[1:]
+
+
 def get_h_symbols_from_model(wrapped_stable_model: Iterable[str],
                              transformed_prg: Collection[Union[str, AST]],
                              facts: List[Symbol],
@@ -29,14 +49,12 @@ def get_h_symbols_from_model(wrapped_stable_model: Iterable[str],
                              h_showTerm="h_showTerm") -> List[Symbol]:
     rules_that_are_reasons_why = []
     ctl = Control()
-    stringified = "".join(map(str, transformed_prg))
     new_head = f"_{h}"
-    get_new_atoms_rule = f"{new_head}(I, H, G) :- {h}(I, H, G), not {h}(II,H,_) : II<I, {h}(II,_,_)."
-    ctl.add("base", [], "".join(map(str, constants)))
-    ctl.add("base", [], "".join(map(stringify_fact, facts)))
-    ctl.add("base", [], stringified)
-    ctl.add("base", [], "".join(map(str, wrapped_stable_model)))
-    ctl.add("base", [], get_new_atoms_rule)
+    add_to_control(ctl, constants)
+    add_to_control(ctl, facts)
+    add_to_control(ctl, transformed_prg)
+    add_to_control(ctl, map(str, wrapped_stable_model))
+    add_to_control(ctl, get_new_atoms_rule(h))
     ctl.ground([("base", [])])
     for x in ctl.symbolic_atoms.by_signature(new_head, 3):
         if x.symbol.arguments[1] in facts:
@@ -47,12 +65,64 @@ def get_h_symbols_from_model(wrapped_stable_model: Iterable[str],
     return rules_that_are_reasons_why
 
 
+def get_h_symbols_from_models(wrapped_stable_models: Iterable[Iterable[str]],
+                              transformed_prg: Collection[Union[str, AST]],
+                              facts: List[Symbol],
+                              constants: Collection[Union[str, AST]],
+                              h="h",
+                              h_showTerm="h_showTerm",
+                              on_model: Optional[Callable[[], None]] = None) -> List[List[Symbol]]:
+    """
+    Returns the symbols of get_h_symbols_from_model for every model, while
+    grounding the transformed program only once. The atoms of all models are
+    declared as externals, which are switched on for one model at a time.
+    They are declared in a fixed order, which fixes the order of the ground
+    atoms and so which reason of a symbol is found, independent of the hash
+    seed of the process.
+    on_model is called after each model is solved.
+    """
+    models = [[parse_term(part.rstrip().rstrip(".")) for part in model]
+              for model in wrapped_stable_models]
+    ctl = Control()
+    new_head = f"_{h}"
+    add_to_control(ctl, constants)
+    add_to_control(ctl, facts)
+    add_to_control(ctl, transformed_prg)
+    add_to_control(ctl, map(make_external, sorted(set().union(*map(set, models)))))
+    add_to_control(ctl, get_new_atoms_rule(h))
+    ctl.ground([("base", [])])
+    new_atoms = [x.symbol for x in ctl.symbolic_atoms.by_signature(new_head, 3)
+                 if x.symbol.arguments[1] not in facts]
+    show_atoms = [x.symbol for x in ctl.symbolic_atoms.by_signature(h_showTerm, 3)]
+
+    result: List[List[Symbol]] = []
+    assigned: Set[Symbol] = set()
+    for model in models:
+        atoms = set(model)
+        for atom in assigned - atoms:
+            ctl.assign_external(atom, False)
+        for atom in atoms - assigned:
+            ctl.assign_external(atom, True)
+        assigned = atoms
+        found: List[List[Symbol]] = []
+        with ctl.solve(yield_=True) as handle:  # type: ignore
+            for m in handle:
+                found.append([symbol for symbol in new_atoms + show_atoms
+                              if m.contains(symbol)])
+        if len(found) != 1:
+            warn(f"Expected one model of the transformed program for the stable model, "
+                 f"found {len(found)}.")
+        result.append(found[0] if len(found) > 0 else [])
+        if on_model is not None:
+            on_model()
+    return result
+
+
 def get_facts(original_program) -> Collection[Symbol]:
     ctl = Control()
     facts = set()
-    as_string = "".join(map(str, original_program))
-    ctl.add("__facts", [], as_string)
-    ctl.ground([("__facts", [])])
+    add_to_control(ctl, original_program)
+    ctl.ground([("base", [])])
     for atom in ctl.symbolic_atoms:
         if atom.is_fact:
             facts.add(atom.symbol)
@@ -148,8 +218,301 @@ def append_noops(result_graph: DiGraph, analyzer: ProgramAnalyzer):
     for leaf in leaves:
         noop_node = Node(frozenset(), next_transformation_id, leaf.atoms)
         result_graph.add_edge(leaf, noop_node,
-                              transformation=Transformation(next_transformation_id,
-                                                            tuple(analyzer.pass_through)))
+                              transformation=analyzer.make_transformation(next_transformation_id,
+                                                                          tuple(analyzer.pass_through)))
+
+
+def make_fact_node(analyzer: ProgramAnalyzer) -> Node:
+    identifiable_facts = list(map(SymbolIdentifier, analyzer.get_facts()))
+    return Node(frozenset(identifiable_facts), -1,
+                frozenset(identifiable_facts))
+
+
+def build_path(wrapped_stable_model: List[str],
+               h_symbols: List[Symbol],
+               mapping: Dict[int, Transformation],
+               fact_node: Node,
+               analyzer: ProgramAnalyzer,
+               recursion_transformations: set) -> nx.DiGraph:
+    """
+    Builds the path from the facts to a single stable model.
+    The path is not yet merged with the paths of other models, so its nodes
+    still carry the reasons as plain symbols.
+    """
+    return make_reason_path_from_facts_to_stable_model(
+        wrapped_stable_model, mapping, fact_node, h_symbols,
+        recursion_transformations, analyzer.get_conflict_free_h(), analyzer)
+
+
+class PathPool(ProcessPoolExecutor):
+    """
+    A pool of processes that cancels the work which has not started yet when
+    it is shut down, as the cancel_futures argument of shutdown needs
+    Python 3.9.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._submitted: "WeakSet[Future]" = WeakSet()
+        self._submitted_lock = Lock()
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = super().submit(fn, *args, **kwargs)
+        with self._submitted_lock:
+            self._submitted.add(future)
+        return future
+
+    def shutdown(self, wait: bool = True, **kwargs):
+        with self._submitted_lock:
+            for future in list(self._submitted):
+                future.cancel()
+        super().shutdown(wait=wait, **kwargs)
+
+
+def make_path_pool(workers: int) -> PathPool:
+    """
+    Returns a pool of processes for build_paths. The server runs threads, so
+    the processes are started by a forkserver where available and spawned
+    otherwise, but never forked from the server.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return PathPool(max_workers=workers, mp_context=context)
+
+
+DetachedNode = Tuple[int, UUID, List[Tuple[str, UUID]], Dict[str, List[str]], Union[bool, list]]
+
+
+def detach_node(node: Node) -> DetachedNode:
+    """
+    Returns the parts of a node of a path that another process needs to
+    restore it. Symbols are passed as strings, as clingo's symbols can only be
+    used in the process that made them. The atoms are dropped, as they follow
+    from the diffs of the path, and a recursive subgraph is replaced by the
+    list of its nodes.
+    """
+    recursive = [detach_node(n) for n in nx.topological_sort(node.recursive)] \
+        if isinstance(node.recursive, nx.DiGraph) else node.recursive
+    return (node.rule_nr, node.uuid,
+            [(str(s.symbol), s.uuid) for s in node.diff],
+            {key: list(map(str, reasons)) for key, reasons in node.reason.items()},
+            recursive)
+
+
+def attach_node(detached: DetachedNode,
+                identifiers: Dict[UUID, SymbolIdentifier],
+                symbols: Dict[str, Symbol]) -> Node:
+    """
+    Restores a node returned by detach_node, without its atoms. Symbols with
+    the same uuid are restored as the same SymbolIdentifier, like the ones a
+    recursive node shares with its subgraph. Parsed symbols are kept in
+    symbols, so every string is only parsed once.
+    """
+    rule_nr, uuid, diff, reason, recursive = detached
+
+    def parse(text: str) -> Symbol:
+        if text not in symbols:
+            symbols[text] = parse_term(text)
+        return symbols[text]
+
+    def identify(text: str, uuid: UUID) -> SymbolIdentifier:
+        if uuid not in identifiers:
+            identifiers[uuid] = SymbolIdentifier(parse(text), uuid=uuid)
+        return identifiers[uuid]
+
+    return Node(frozenset(identify(text, uuid) for text, uuid in diff), rule_nr,
+                reason={key: list(map(parse, reasons)) for key, reasons in reason.items()}
+                if len(reason) else DefaultMappingProxyType(),
+                recursive=[attach_node(n, identifiers, symbols) for n in recursive]
+                if isinstance(recursive, list) else recursive,
+                uuid=uuid)
+
+
+def attach_path(detached: List[DetachedNode], mapping: Dict[int, Transformation],
+                fact_node: Node, symbols: Dict[str, Symbol]) -> nx.DiGraph:
+    """
+    Builds the path of the nodes returned by detach_node, which follow the
+    fact node. Their atoms are restored from the diffs, which gives every
+    symbol the same uuid as on a path built in this process.
+    """
+    path = [fact_node]
+    identifiers: Dict[UUID, SymbolIdentifier] = {}
+    path.extend(attach_node(node, identifiers, symbols) for node in detached)
+    insert_atoms_into_nodes(path)
+    g = nx.DiGraph()
+    for a, b in pairwise(path):
+        if isinstance(b.recursive, list):
+            insert_atoms_into_nodes([Node(frozenset(a.atoms), -1)] + b.recursive)
+            subgraph = nx.DiGraph()
+            subgraph.add_edges_from(pairwise(b.recursive))
+            b.recursive = subgraph
+        g.add_edge(a, b, transformation=mapping[b.rule_nr])
+    return g
+
+
+def build_paths_in_worker(wrapped_stable_models: List[List[str]],
+                          transformed_prg: str,
+                          facts: List[str],
+                          constants: List[str],
+                          names: Set[str],
+                          fact_node: DetachedNode,
+                          rule_numbers: List[int],
+                          recursive_rules: Dict[int, List[str]]) -> List[List[DetachedNode]]:
+    """
+    Builds the paths of some models in a process of the pool of build_paths,
+    grounding the transformed program once. The recursive transformations
+    are passed as the text of their rules and the constants as the text of
+    their definitions, every path is returned as the nodes following the
+    fact node, see detach_node.
+    """
+    analyzer = ProgramAnalyzer.from_names(names)
+    mapping: Dict[int, Transformation] = {}
+    for rule_nr in rule_numbers:
+        rules: List[AST] = []
+        for rule in recursive_rules.get(rule_nr, []):
+            parse_string(rule, lambda statement: rules.append(statement)
+                         if statement.ast_type != ast.ASTType.Program else None)
+        # the hash is not needed here, it would be computed in an app context
+        mapping[rule_nr] = Transformation(rule_nr, frozenset(rules), hash=str(rule_nr))  # type: ignore
+    recursion_transformations = {mapping[rule_nr].rules for rule_nr in recursive_rules}
+    symbols: Dict[str, Symbol] = {}
+    fact = attach_node(fact_node, {}, symbols)
+    h_symbols = get_h_symbols_from_models(wrapped_stable_models, [transformed_prg],
+                                          [parse_term(f) for f in facts],
+                                          constants,
+                                          analyzer.get_conflict_free_h(),
+                                          analyzer.get_conflict_free_h_showTerm())
+    paths = []
+    for model, model_symbols in zip(wrapped_stable_models, h_symbols):
+        path = build_path(model, model_symbols, mapping, fact, analyzer,
+                          recursion_transformations)
+        nodes = list(nx.topological_sort(path))
+        paths.append([detach_node(node) for node in nodes[1:]])
+    return paths
+
+
+def build_paths_in_parallel(wrapped_stable_models: List[List[str]],
+                            transformed_prg: Collection[AST],
+                            mapping: Dict[int, Transformation],
+                            fact_node: Node,
+                            analyzer: ProgramAnalyzer,
+                            recursion_transformations: set,
+                            executor: Executor,
+                            workers: int,
+                            progress: Callable[[str], None]) -> List[nx.DiGraph]:
+    """
+    Builds the paths of build_paths in the processes of the executor. The
+    models are split into one chunk per worker, so every worker grounds the
+    transformed program once.
+    """
+    chunks = [wrapped_stable_models[i::workers] for i in range(workers)]
+    chunks = [chunk for chunk in chunks if len(chunk) > 0]
+    recursive_rules = {rule_nr: [str(rule) for rule in t.rules]
+                       for rule_nr, t in mapping.items()
+                       if t.rules in recursion_transformations}
+    arguments = ("".join(map(str, transformed_prg)),
+                 list(map(str, analyzer.get_facts())),
+                 list(map(str, analyzer.get_constants())),
+                 set(analyzer.names), detach_node(fact_node),
+                 list(mapping.keys()), recursive_rules)
+    futures = [executor.submit(build_paths_in_worker, chunk, *arguments)
+               for chunk in chunks]
+    paths: List[nx.DiGraph] = [nx.DiGraph() for _ in wrapped_stable_models]
+    symbols: Dict[str, Symbol] = {}
+    for i, future in enumerate(futures):
+        for j, nodes in enumerate(future.result()):
+            progress("grounding")
+            paths[i + j * len(chunks)] = attach_path(nodes, mapping, fact_node, symbols)
+            progress("paths")
+    return paths
+
+
+def build_paths(wrapped_stable_models: List[List[str]],
+                transformed_prg: Collection[AST],
+                mapping: Dict[int, Transformation],
+                fact_node: Node,
+                analyzer: ProgramAnalyzer,
+                recursion_transformations: set,
+                workers: int = DEFAULT_PATH_WORKERS,
+                progress: Optional[Callable[[str], None]] = None,
+                executor: Optional[Executor] = None) -> List[nx.DiGraph]:
+    """
+    Builds the paths of all models, grounding the transformed program once.
+    With more than one worker, the paths are built in the processes of the
+    executor, see make_path_pool. Without an executor, a pool is started for
+    this call only.
+    progress is called with "grounding" for every solved model and with
+    "paths" for every built path.
+    The analyzer is only read, so that paths of several sorts can be built
+    at the same time; subgraphs of recursive transformations take their
+    names from a copy.
+    """
+    if progress is None:
+        progress = lambda stage: None
+    if workers > 1 and len(wrapped_stable_models) > 1:
+        arguments = (wrapped_stable_models, transformed_prg, mapping, fact_node,
+                     analyzer, recursion_transformations)
+        if executor is not None:
+            return build_paths_in_parallel(*arguments, executor, workers, progress)
+        with make_path_pool(workers) as pool:
+            return build_paths_in_parallel(*arguments, pool, workers, progress)
+    h_symbols = get_h_symbols_from_models(
+        wrapped_stable_models, transformed_prg, analyzer.get_facts(),
+        analyzer.get_constants(), analyzer.get_conflict_free_h(),
+        analyzer.get_conflict_free_h_showTerm(),
+        on_model=lambda: progress("grounding"))
+    recursion_analyzer = ProgramAnalyzer.from_names(analyzer.names)
+    paths = []
+    for model, symbols in zip(wrapped_stable_models, h_symbols):
+        paths.append(build_path(model, symbols, mapping, fact_node, recursion_analyzer,
+                                recursion_transformations))
+        progress("paths")
+    return paths
+
+
+def copy_node(node: Node) -> Node:
+    """
+    Copies the parts of a node that are changed when it is merged into a graph.
+    The uuid is kept, so the copy identifies the same node.
+    """
+    reason = {key: list(value) for key, value in node.reason.items()} \
+        if isinstance(node.reason, dict) else node.reason
+    recursive = copy_path(node.recursive) \
+        if isinstance(node.recursive, nx.DiGraph) else node.recursive
+    return replace(node, reason=reason, recursive=recursive,
+                   space_multiplier=1.0)
+
+
+def copy_path(path: nx.DiGraph) -> nx.DiGraph:
+    """
+    Copies a path, so that it can be merged into graphs several times.
+    """
+    copies = {id(node): copy_node(node) for node in path.nodes}
+    copied = nx.DiGraph()
+    copied.add_nodes_from(copies[id(node)] for node in path.nodes)
+    copied.add_edges_from((copies[id(u)], copies[id(v)], d)
+                          for u, v, d in path.edges(data=True))
+    return copied
+
+
+def assemble_graph(paths: Collection[nx.DiGraph],
+                   analyzer: ProgramAnalyzer,
+                   pattern_nodes: Optional[Dict[Node, Node]] = None) -> nx.DiGraph:
+    """
+    Merges the paths of the stable models into one graph and identifies the
+    reasons of all symbols in it. The paths themselves are modified.
+    If pattern_nodes is given, nodes that are equal to one of them take over
+    its uuid, see harmonize_uuids.
+    """
+    result_graph = nx.DiGraph()
+    result_graph.update(join_paths_with_facts(paths))
+    if analyzer.pass_through:
+        append_noops(result_graph, analyzer)
+    calculate_spacing_factor(result_graph)
+    if pattern_nodes is not None:
+        harmonize_uuids(result_graph, pattern_nodes)
+    identify_reasons(result_graph)
+    return result_graph
 
 
 def build_graph(wrapped_stable_models: List[List[str]],
@@ -157,36 +520,16 @@ def build_graph(wrapped_stable_models: List[List[str]],
                 sorted_program: List[Transformation],
                 analyzer: ProgramAnalyzer,
                 recursion_transformations: set) -> nx.DiGraph:
-    paths: List[nx.DiGraph] = []
-    facts = analyzer.get_facts()
-    conflict_free_h = analyzer.get_conflict_free_h()
-    conflict_free_h_showTerm = analyzer.get_conflict_free_h_showTerm()
-    identifiable_facts = list(map(SymbolIdentifier, facts))
     mapping = make_transformation_mapping(sorted_program)
-    fact_node = Node(frozenset(identifiable_facts), -1,
-                     frozenset(identifiable_facts))
+    fact_node = make_fact_node(analyzer)
     if not len(mapping):
         info(f"Program only contains facts. {fact_node}")
         single_node_graph = nx.DiGraph()
         single_node_graph.add_node(fact_node)
         return single_node_graph
-    for model in wrapped_stable_models:
-        h_symbols = get_h_symbols_from_model(model, transformed_prg, facts,
-                                             analyzer.get_constants(),
-                                             conflict_free_h,
-                                             conflict_free_h_showTerm)
-        new_path = make_reason_path_from_facts_to_stable_model(
-            model, mapping, fact_node, h_symbols, recursion_transformations,
-            conflict_free_h, analyzer)
-        paths.append(new_path)
-
-    result_graph = nx.DiGraph()
-    result_graph.update(join_paths_with_facts(paths))
-    if analyzer.pass_through:
-        append_noops(result_graph, analyzer)
-    calculate_spacing_factor(result_graph)
-    identify_reasons(result_graph)
-    return result_graph
+    paths = build_paths(wrapped_stable_models, transformed_prg, mapping,
+                        fact_node, analyzer, recursion_transformations)
+    return assemble_graph(paths, analyzer)
 
 
 def save_model(model: Model) -> Collection[str]:
@@ -11,16 +11,18 @@ from clingo.ast import (
     AST,
 )
 
-from .utils import is_constraint, merge_constraints, rank_topological_sorts
-from ..asp.utils import merge_cycles, remove_loops
+from .utils import add_to_control, is_constraint, condense_dependencies, topological_sorts, get_rule_positions
 from viasp.asp.ast_types import (
     SUPPORTED_TYPES,
     ARITH_TYPES,
     UNSUPPORTED_TYPES,
     UNKNOWN_TYPES,
 )
+from ..shared.defaults import DEFAULT_MAX_SORTS, REIFY_CACHE_SIZE
+from ..shared.io import get_rules_from_input_program
 from ..shared.model import Transformation, TransformationError, FailedReason
 from ..shared.simple_logging import warn, error
+from ..shared.util import LRUCache
 
 
 def is_fact(rule, dependencies):
@@ -174,8 +176,9 @@ class ProgramAnalyzer(DependencyCollector, FilteredTransformer):
     Receives a ASP program and finds it's dependencies within, can sort a program by it's dependencies.
     """
 
-    def __init__(self):
+    def __init__(self, max_sorts: int = DEFAULT_MAX_SORTS):
         super().__init__()
+        self.max_sorts = max_sorts
         # TODO: self.dependencies can go?
         self.dependencies = nx.DiGraph()
         self.dependants: Dict[Tuple[str, int], Set[AST]] = defaultdict(set)
@@ -186,11 +189,25 @@ class ProgramAnalyzer(DependencyCollector, FilteredTransformer):
         self.rule2signatures = defaultdict(set)
         self.facts: Set[Symbol] = set()
         self.constants: Set[Symbol] = set()
+        self._facts_cache: Tuple[Tuple[int, int], List[Symbol]] = ((0, 0), [])
         self.constraints: Set[Rule] = set()  # type: ignore
         self.pass_through: Set[AST] = set()
         self.rules: List[ast.Rule] = []  # type: ignore
+        self._rule_positions: Dict[AST, int] = {}
+        self._rule_positions_of = 0
         self.names: Set[str] = set()
 
+    @classmethod
+    def from_names(cls, names: Iterable[str]) -> "ProgramAnalyzer":
+        """
+        Returns an analyzer that only knows the given names. It finds the same
+        conflict free names as the analyzer the names are taken from, without
+        changing the names of that analyzer.
+        """
+        analyzer = cls()
+        analyzer.names = set(names)
+        return analyzer
+
     def _get_conflict_free_version_of_name(self, name: str) -> str:
         candidates = self.names
         current_best = name
@@ -356,7 +373,11 @@ class ProgramAnalyzer(DependencyCollector, FilteredTransformer):
             **self.visit_children(theory_guard_definition, **kwargs))
 
     def get_facts(self):
-        return extract_symbols(self.facts, self.constants)
+        # facts and constants are only ever added, so their sizes identify them
+        key = (len(self.facts), len(self.constants))
+        if key != self._facts_cache[0]:
+            self._facts_cache = (key, extract_symbols(self.facts, self.constants))
+        return self._facts_cache[1]
 
     def get_constants(self):
         return list(self.constants)
@@ -486,64 +507,46 @@ class ProgramAnalyzer(DependencyCollector, FilteredTransformer):
         parse_string(program, lambda rule: self.visit(rule) and None)
         sorted_programs = self.sort_program_by_dependencies()
         return [
-            Transformation(i, prg) for i, prg in enumerate(sorted_programs[0])
+            self.make_transformation(i, prg) for i, prg in enumerate(next(sorted_programs))
         ]
 
     def get_sorted_program(
             self) -> Generator[List[Transformation], None, None]:
         sorted_programs = self.sort_program_by_dependencies()
         for program in sorted_programs:
-            yield [Transformation(i, (prg)) for i, prg in enumerate(program)]
+            yield [self.make_transformation(i, prg) for i, prg in enumerate(program)]
 
-    def make_dependency_graph(
-        self,
-        head_dependencies: Dict[Tuple[str, int], Set[AST]],
-        body_dependencies: Dict[Tuple[str, int], Set[AST]],
-    ) -> nx.DiGraph:
+    def make_transformation(self, id: int, rules) -> Transformation:
         """
-        We draw a dependency graph based on which rule head contains which literals.
-        That way we know, that in order to have a rule r with a body containing literal l, all rules that have l in their
-        heads must come before r.
-        :param head_dependencies: Mapping from a signature to all rules containing them in the head
-        :param body_dependencies: mapping from a signature to all rules containing them in the body
-        :return:
+        Makes the transformation and looks up the text of its rules, so that
+        encoding it does not need the program anymore.
         """
-        g = nx.DiGraph()
-
-        for deps in head_dependencies.values():
-            for dep in deps:
-                g.add_node(frozenset([dep]))
-        for deps in body_dependencies.values():
-            for dep in deps:
-                g.add_node(frozenset([dep]))
-
-        for head_signature, rules_with_head in head_dependencies.items():
-            dependent_rules = body_dependencies.get(head_signature, [])
-            for parent_rule in rules_with_head:
-                for dependent_rule in dependent_rules:
-                    g.add_edge(frozenset([parent_rule]),
-                               frozenset([dependent_rule]))
-
-        return g
+        transformation = Transformation(id, rules)
+        transformation.source = tuple(get_rules_from_input_program(transformation.rules))
+        return transformation
 
     def sort_program_by_dependencies(self):
-        deps = self.make_dependency_graph(self.dependants, self.conditions)
-        deps = merge_constraints(deps)
-        deps, _ = merge_cycles(deps)
-        deps, _ = remove_loops(deps)
-        programs = rank_topological_sorts(nx.all_topological_sorts(deps),
-                                          self.rules)
+        deps, _ = condense_dependencies(self.dependants, self.conditions)
+        programs = topological_sorts(deps, self.rules, self.max_sorts,
+                                     self.get_rule_positions())
         return programs
 
+    def get_rule_positions(self) -> Dict[AST, int]:
+        """
+        Returns the position of every rule in the program. The positions are
+        only computed again, if rules were added since.
+        """
+        if self._rule_positions_of != len(self.rules):
+            self._rule_positions = get_rule_positions(self.rules)
+            self._rule_positions_of = len(self.rules)
+        return self._rule_positions
+
     def check_positive_recursion(self):
-        deps1 = self.make_dependency_graph(self.dependants,
-                                           self.positive_conditions)
-        deps1 = merge_constraints(deps1)
-        deps2, where1 = merge_cycles(deps1)
-        _, where2 = remove_loops(deps2)
+        _, recursive_sets = condense_dependencies(self.dependants,
+                                                  self.positive_conditions)
         return {
             recursive_set
-            for recursive_set in where1.union(where2)
+            for recursive_set in recursive_sets
             if self.should_include_recursive_set(recursive_set)
         }
 
@@ -560,6 +563,17 @@ class ProgramAnalyzer(DependencyCollector, FilteredTransformer):
         return False
 
 
+def as_term(element: AST) -> AST:
+    """
+    Returns the term of a literal or symbolic atom, or the element itself.
+    """
+    if element.ast_type == ASTType.Literal and element.sign == ast.Sign.NoSign:
+        element = element.atom
+    if element.ast_type == ASTType.SymbolicAtom:
+        return element.symbol
+    return element
+
+
 class ProgramReifier(DependencyCollector):
 
     def __init__(self,
@@ -588,22 +602,25 @@ class ProgramReifier(DependencyCollector):
         In: H :- B.
         Out: h(0, H, pos_atoms(B)),
         where pos_atoms(B) is a tuple of all positive Symbolic Atoms in B.
+        The head is a well-formed AST, so that it can be grounded without
+        printing and parsing it again.
         """
-        loc_fun = ast.Function(loc, str(self.rule_nr), [], False)
-        loc_atm = ast.SymbolicAtom(loc_fun)
-        loc_lit = ast.Literal(loc, ast.Sign.NoSign, loc_atm)
+        loc_term = ast.SymbolicTerm(loc, clingo.Number(self.rule_nr))
         for literal in conditions:
             if literal.atom.ast_type == ASTType.SymbolicAtom:
                 reasons.append(literal.atom)
         reasons.reverse()
         reasons = [r for i, r in enumerate(reasons) if r not in reasons[:i]]
-        reason_fun = ast.Function(loc, "", reasons, 0)
-        reason_lit = ast.Literal(loc, ast.Sign.NoSign, reason_fun)
+        reason_fun = ast.Function(loc, "", [as_term(r) for r in reasons], 0)
 
         h_attribute = self.h_showTerm if use_h_showTerm else self.h
 
         return [
-            ast.Function(loc, h_attribute, [loc_lit, dependant, reason_lit], 0)
+            ast.Literal(
+                loc, ast.Sign.NoSign,
+                ast.SymbolicAtom(
+                    ast.Function(loc, h_attribute,
+                                 [loc_term, as_term(dependant), reason_fun], 0)))
         ]
 
     def visit_Rule(self, rule: ast.Rule) -> List[AST]: # type: ignore
@@ -703,8 +720,9 @@ class ProgramReifier(DependencyCollector):
             0,
             ast.Literal(
                 loc, ast.Sign.NoSign,
-                ast.Function(loc, self.conflict_free_showTerm, [showTerm.term],
-                             0)))
+                ast.SymbolicAtom(
+                    ast.Function(loc, self.conflict_free_showTerm,
+                                 [as_term(showTerm.term)], 0))))
         # Remove duplicates but preserve order
         new_body_literals = [
             x for i, x in enumerate(new_body_literals)
@@ -741,11 +759,48 @@ def transform(program: str, visitor=None, **kwargs):
     return rulez
 
 
+# The settings of ProgramReifier that change the reified rules, apart from the rule number.
+REIFIER_SETTINGS = ("h", "h_showTerm", "model", "conflict_free_showTerm")
+# Reified rules by transformation hash and reifier settings, with the rule
+# number they were reified with.
+reify_cache: LRUCache[Tuple[Any, ...], Tuple[int, List[AST]]] = LRUCache(REIFY_CACHE_SIZE)
+
+
+def renumber_reified_rule(rule: AST, rule_nr: int, heads: Collection[str]) -> AST:
+    """
+    Replaces the rule number in the head of a reified rule.
+    Rules that were not reified, like facts and constraints, are returned as they are.
+
+    :param heads: The names of the h and h_showTerm predicates
+    """
+    head = getattr(rule, "head", None)
+    if head is None or head.ast_type != ASTType.Literal \
+            or head.atom.ast_type != ASTType.SymbolicAtom:
+        return rule
+    function = head.atom.symbol
+    if function.ast_type != ASTType.Function or function.name not in heads:
+        return rule
+    loc_term, *arguments = function.arguments
+    loc_term = ast.SymbolicTerm(loc_term.location, clingo.Number(rule_nr))
+    return rule.update(head=head.update(atom=head.atom.update(
+        symbol=function.update(arguments=[loc_term, *arguments]))))
+
+
 def reify(transformation: Transformation, **kwargs):
+    key = (transformation.hash,
+           *(kwargs.get(setting) for setting in REIFIER_SETTINGS))
+    cached = reify_cache.get(key)
+    if cached is not None:
+        rule_nr, reified = cached
+        if rule_nr == transformation.id:
+            return list(reified)
+        heads = (kwargs.get("h", "h"), kwargs.get("h_showTerm", "h_showTerm"))
+        return [renumber_reified_rule(rule, transformation.id, heads) for rule in reified]
     visitor = ProgramReifier(transformation.id, **kwargs)
     result: List[AST] = []
     for rule in transformation.rules:
         result.extend(cast(Iterable[AST], visitor.visit(rule)))
+    reify_cache.put(key, (transformation.id, list(result)))
     return result
 
 
@@ -761,9 +816,9 @@ def extract_symbols(facts, constants=None):
     if constants is None:
         constants = set()
     ctl = clingo.Control()
-    ctl.add("INTERNAL", [], "".join(f"{str(f)}." for f in facts))
-    ctl.add("INTERNAL", [], "".join(f"{str(c)}" for c in constants))
-    ctl.ground([("INTERNAL", [])])
+    add_to_control(ctl, [ast.Rule(f.location, f, []) for f in facts])
+    add_to_control(ctl, constants)
+    ctl.ground([("base", [])])
     result = []
     for fact in ctl.symbolic_atoms:
         result.append(fact.symbol)
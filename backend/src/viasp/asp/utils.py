@@ -1,95 +1,278 @@
 """Mostly graph utility functions."""
+import heapq
+from itertools import islice
+
 import networkx as nx
-from clingo import Symbol
-from clingo.ast import ASTType, AST
-from typing import List, Sequence, Tuple, Dict, Set, FrozenSet, Optional
+import numpy as np
+from clingo import Control, Symbol, Function
+from clingo.ast import ASTType, AST, Location, Position, ProgramBuilder, Rule, Literal, Sign, \
+    SymbolicAtom, SymbolicTerm, External
+from typing import List, Sequence, Tuple, Dict, Set, FrozenSet, Optional, Iterator, Iterable, Union
+from ..shared.defaults import DEFAULT_MAX_SORTS
 from ..shared.simple_logging import warn
-from ..shared.model import Node, SymbolIdentifier
+from ..shared.model import Node, SymbolIdentifier, ChainedAtoms
 from ..shared.util import pairwise, get_root_node_from_graph
-from ..server.blueprints.dag_api import get_database
+
+
+FACT_LOCATION = Location(Position("<facts>", 1, 1), Position("<facts>", 1, 1))
+
+
+def make_fact(symbol: Symbol) -> AST:
+    """
+    Returns the fact of a symbol as an AST, without printing and parsing it.
+    """
+    return Rule(FACT_LOCATION,
+                Literal(FACT_LOCATION, Sign.NoSign,
+                        SymbolicAtom(SymbolicTerm(FACT_LOCATION, symbol))), [])
+
+
+def make_external(symbol: Symbol) -> AST:
+    """
+    Returns the declaration of a symbol as an external atom as an AST.
+    """
+    return External(FACT_LOCATION, SymbolicAtom(SymbolicTerm(FACT_LOCATION, symbol)), [],
+                    SymbolicTerm(FACT_LOCATION, Function("false")))
+
+
+def add_to_control(ctl: Control, program: Iterable[Union[str, AST, Symbol]]) -> None:
+    """
+    Adds a program to the base part of the control.
+
+    ASTs are passed to the control with a ProgramBuilder, symbols are added as
+    facts and strings are parsed. ASTs that the builder rejects raise a
+    RuntimeError.
+    """
+    as_text: List[str] = []
+    with ProgramBuilder(ctl) as builder:
+        for part in program:
+            if isinstance(part, str):
+                as_text.append(part)
+                continue
+            if isinstance(part, Symbol):
+                part = make_fact(part)
+            builder.add(part)
+    if as_text:
+        ctl.add("base", [], "".join(as_text))
 
 
 def is_constraint(rule: AST) -> bool:
     return rule.ast_type == ASTType.Rule and "atom" in rule.head.child_keys and rule.head.atom.ast_type == ASTType.BooleanConstant  # type: ignore
 
 
-def merge_constraints(g: nx.Graph) -> nx.Graph:
-    mapping = {}
-    constraints = frozenset([
-        ruleset for ruleset in g.nodes for rule in ruleset
-        if is_constraint(rule)
-    ])
-    if constraints:
-        merge_node = merge_nodes(constraints)
-        mapping = {c: merge_node for c in constraints}
-    return nx.relabel_nodes(g, mapping)
-
-
-def merge_cycles(g: nx.Graph) -> Tuple[nx.Graph, FrozenSet[AST]]:
-    mapping: Dict[AST, AST] = {}
-    merge_node: FrozenSet[AST] = frozenset()
-    where_recursion_happens = set()
-    for cycle in nx.algorithms.components.strongly_connected_components(g):
-        merge_node = merge_nodes(cycle)
-        mapping.update({old_node: merge_node for old_node in cycle})
-    # which nodes were merged
-    for k, v in mapping.items():
-        if k != v:
-            where_recursion_happens.add(merge_node)
-    return nx.relabel_nodes(g, mapping), frozenset(where_recursion_happens)
-
-
-def merge_nodes(nodes: frozenset) -> FrozenSet[AST]:
-    old = set()
-    for x in nodes:
-        old.update(x)
-    return frozenset(old)
-
-
-def remove_loops(g: nx.Graph) -> Tuple[nx.Graph, FrozenSet[AST]]:
-    remove_edges: List[Tuple[AST, AST]] = []
-    where_recursion_happens: Set[AST] = set()
-    for edge in g.edges:
-        u, v = edge
-        if u == v:
-            remove_edges.append(edge)
-            # info on which node's loop is removed
-            where_recursion_happens.add(u)
-
-    for edge in remove_edges:
-        g.remove_edge(*edge)
-    return g, frozenset(where_recursion_happens)
-
-
-def rank_topological_sorts(all_sorts: List, rules: Sequence[AST]) -> List:
+def condense_dependencies(
+    head_dependencies: Dict[Tuple[str, int], Set[AST]],
+    body_dependencies: Dict[Tuple[str, int], Set[AST]],
+) -> Tuple[nx.DiGraph, FrozenSet[FrozenSet[AST]]]:
+    """
+    Builds the dependency graph of the rules with all constraints merged into
+    one node and every strongly connected component merged into one node.
+    The rules are numbered and the components are found in a single pass over
+    the integer graph, so only the condensed graph is built with networkx.
+
+    :param head_dependencies: Mapping from a signature to all rules containing them in the head
+    :param body_dependencies: Mapping from a signature to all rules containing them in the body
+    :return: The condensed graph and the nodes that depend on themselves
+    """
+    ids: Dict[AST, int] = {}
+    rules: List[AST] = []
+    for dependencies in (head_dependencies, body_dependencies):
+        for deps in dependencies.values():
+            for dep in deps:
+                if dep not in ids:
+                    ids[dep] = len(rules)
+                    rules.append(dep)
+
+    # all constraints form one group, every other rule its own
+    group = list(range(len(rules)))
+    constraints = [i for i, rule in enumerate(rules) if is_constraint(rule)]
+    for i in constraints:
+        group[i] = constraints[0]
+
+    # successors as ordered sets, in the order the edges were first added
+    successors: List[Dict[int, None]] = [{} for _ in rules]
+    for head_signature, rules_with_head in head_dependencies.items():
+        dependent_groups = [group[ids[rule]]
+                            for rule in body_dependencies.get(head_signature, [])]
+        for parent_rule in rules_with_head:
+            parent_successors = successors[group[ids[parent_rule]]]
+            for dependent_group in dependent_groups:
+                parent_successors[dependent_group] = None
+    groups = [i for i in range(len(rules)) if group[i] == i]
+
+    component = strongly_connected_components(groups, successors)
+
+    members: Dict[int, Set[AST]] = {}
+    for i, rule in enumerate(rules):
+        members.setdefault(component[group[i]], set()).add(rule)
+    nodes = {c: frozenset(component_rules) for c, component_rules in members.items()}
+
+    g = nx.DiGraph()
+    g.add_nodes_from(nodes[component[i]] for i in groups)
+    recursive: Set[FrozenSet[AST]] = set()
+    for u in groups:
+        for v in successors[u]:
+            if component[u] == component[v]:
+                recursive.add(nodes[component[u]])
+            else:
+                g.add_edge(nodes[component[u]], nodes[component[v]])
+    return g, frozenset(recursive)
+
+
+def strongly_connected_components(nodes: Sequence[int],
+                                  successors: Sequence[Iterable[int]]) -> Dict[int, int]:
+    """
+    Returns the component of every node, using an iterative version of
+    Tarjan's algorithm.
+
+    :param nodes: The nodes of the graph
+    :param successors: The successors of every node, indexed by node
+    """
+    index: Dict[int, int] = {}
+    low: Dict[int, int] = {}
+    component: Dict[int, int] = {}
+    stack: List[int] = []
+    on_stack: Set[int] = set()
+    for root in nodes:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(successors[root]))]
+        while work:
+            v, children = work[-1]
+            for w in children:
+                if w not in index:
+                    index[w] = low[w] = len(index)
+                    stack.append(w)
+                    on_stack.add(w)
+                    work.append((w, iter(successors[w])))
+                    break
+                if w in on_stack:
+                    low[v] = min(low[v], index[w])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[v])
+                if low[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack.discard(w)
+                        component[w] = v
+                        if w == v:
+                            break
+    return component
+
+
+def get_rule_positions(rules: Sequence[AST]) -> Dict[AST, int]:
+    """
+    Returns the position of the first occurrence of every rule in the rules list.
+    """
+    positions: Dict[AST, int] = {}
+    for i, rule in enumerate(rules):
+        positions.setdefault(rule, i)
+    return positions
+
+
+def rank_topological_sorts(all_sorts: Iterable, rules: Sequence[AST],
+                           positions: Optional[Dict[AST, int]] = None) -> List:
     """ 
     Ranks all topological sorts by the number of rules that are in the same order as in the rules list.
     The highest rank is the first element in the list.
 
     :param all_sorts: List of all topological sorts
     :param rules: List of rules
+    :param positions: The positions of the rules, as given by get_rule_positions
+    """
+    all_sorts = list(all_sorts)
+    if len(all_sorts) == 0:
+        return []
+    if positions is None:
+        positions = get_rule_positions(rules)
+    sort_positions = [[positions[rule] + 1 for frznst in sort for rule in frznst]
+                      for sort in all_sorts]
+    length = max(map(len, sort_positions))
+    matrix = np.zeros((len(all_sorts), length), dtype=np.int64)
+    for i, row in enumerate(sort_positions):
+        matrix[i, :len(row)] = row
+    ranks = -(matrix @ np.arange(1, length + 1, dtype=np.int64))
+    return [all_sorts[i] for i in np.argsort(ranks, kind="stable")]
+
+
+def greedy_topological_sort(g: nx.DiGraph, rules: Sequence[AST],
+                            positions: Optional[Dict[AST, int]] = None) -> List:
+    """
+    Returns a topological sort that, whenever there is a choice, takes the node
+    whose rules come first in the rules list.
+
+    :param g: The dependency graph
+    :param rules: List of rules
+    :param positions: The positions of the rules, as given by get_rule_positions
     """
-    ranked_sorts = []
-    for sort in all_sorts:
-        rank = 0
-        sort_rules = [rule for frznst in sort for rule in frznst]
-        for i in range(len(sort_rules)):
-            rank -= (rules.index(sort_rules[i]) + 1) * (i + 1)
-        ranked_sorts.append((sort, rank))
-    ranked_sorts.sort(key=lambda x: x[1])
-    return [x[0] for x in ranked_sorts]
+    position = get_rule_positions(rules) if positions is None else positions
+
+    def key(node) -> int:
+        return min((position.get(rule, len(rules)) for rule in node),
+                   default=len(rules))
+
+    in_degree = {v: d for v, d in g.in_degree()}
+    order = {v: i for i, v in enumerate(g.nodes)}
+    ready = [(key(v), order[v], v) for v, d in in_degree.items() if d == 0]
+    heapq.heapify(ready)
+    sort = []
+    while ready:
+        _, _, v = heapq.heappop(ready)
+        sort.append(v)
+        for w in g.successors(v):
+            in_degree[w] -= 1
+            if in_degree[w] == 0:
+                heapq.heappush(ready, (key(w), order[w], w))
+    return sort
+
+
+def topological_sorts(g: nx.DiGraph, rules: Sequence[AST],
+                      max_sorts: int = DEFAULT_MAX_SORTS,
+                      positions: Optional[Dict[AST, int]] = None) -> Iterator[List]:
+    """
+    Lazily yields at most max_sorts topological sorts of g.
+    If g has no more than max_sorts sorts, all of them are ranked by
+    rank_topological_sorts. Otherwise, the greedy sort comes first, followed
+    by the first max_sorts + 1 sorts in the order networkx enumerates them,
+    ranked among themselves. These are not the best ranked of all sorts of g,
+    as the sorts after them are never looked at.
+
+    :param g: The dependency graph
+    :param rules: List of rules
+    :param max_sorts: The maximal number of sorts
+    :param positions: The positions of the rules, as given by get_rule_positions
+    """
+    if positions is None:
+        positions = get_rule_positions(rules)
+    window = list(islice(nx.all_topological_sorts(g), max_sorts + 1))
+    if len(window) <= max_sorts:
+        yield from rank_topological_sorts(window, rules, positions)
+        return
+    best = greedy_topological_sort(g, rules, positions)
+    yield best
+    alternatives = (sort for sort in rank_topological_sorts(window, rules, positions)
+                    if sort != best)
+    yield from islice(alternatives, max_sorts - 1)
 
 
 def insert_atoms_into_nodes(path: List[Node]) -> None:
+    """
+    Sets the atoms of every node on the path to the atoms of its predecessor
+    and the symbols it adds. The atoms are chained, so every node only stores
+    the symbols that are new on the path.
+    """
     facts = path[0]
-    state = set(facts.diff)
-    facts.atoms = frozenset(state)
-    state = set(map(SymbolIdentifier, (s.symbol for s in state)))
+    seen = {s.symbol for s in facts.diff}
+    facts.atoms = ChainedAtoms(frozenset(facts.diff), facts.uuid)
     for u, v in pairwise(path):
-        state.update(v.diff)
-        state.update(u.diff)
-        v.atoms = frozenset(state)
-        state = set(map(SymbolIdentifier, (s.symbol for s in state)))
+        added = frozenset(s for s in v.diff if s.symbol not in seen)
+        seen.update(s.symbol for s in added)
+        v.atoms = ChainedAtoms(added, v.uuid, u.atoms)
 
 
 def identify_reasons(g: nx.DiGraph) -> None:
@@ -98,93 +281,138 @@ def identify_reasons(g: nx.DiGraph) -> None:
     Takes the Symbol from node.reason and overwrites the values of the Dict node.reason
     with the SymbolIdentifier of the corresponding symbol.
 
+    The graph is walked depth first from the root node, keeping an index from
+    every symbol to the SymbolIdentifier of the node on the current path that
+    derived it. Entries are added when a node is entered and undone when it is
+    left, so every reason is found with a single lookup.
+
     :param g: The graph to identify the reasons for.
     """
-    # get fact node:
     root_node = get_root_node_from_graph(g)
+    provenance: Dict[Symbol, SymbolIdentifier] = {}
+    visited = {root_node}
+    undo_stack = [enter_node(provenance, root_node)]
+    identify_node_reasons(provenance, root_node)
+    node_stack = [iter(g.successors(root_node))]
+    while node_stack:
+        v = next(node_stack[-1], None)
+        if v is None:
+            node_stack.pop()
+            leave_node(provenance, undo_stack.pop())
+            continue
+        if v in visited:
+            continue
+        visited.add(v)
+        undo_stack.append(enter_node(provenance, v))
+        identify_node_reasons(provenance, v)
+        node_stack.append(iter(g.successors(v)))
+
+
+def enter_node(provenance: Dict[Symbol, SymbolIdentifier],
+               v: Node) -> List[Tuple[Symbol, Optional[SymbolIdentifier]]]:
+    """
+    Adds the symbols derived in the node to the provenance index.
+    Returns the previous entries, to be restored by leave_node.
+    """
+    undo = []
+    for s in v.diff:
+        undo.append((s.symbol, provenance.get(s.symbol)))
+        provenance[s.symbol] = s
+    return undo
 
-    # go through entire graph, starting at root_node and traveling down the graph via successors
-    children_next = set()
-    searched_nodes = set()
-    children_current = [root_node]
-    while len(children_current) != 0:
-        for v in children_current:
-            for new, rr in v.reason.items():
-                tmp_reason = []
-                for r in rr:
-                    tmp_reason.append(get_identifiable_reason(g, v, r))
-                v.reason[str(new)] = tmp_reason
-            if v.recursive:
-                for node in v.recursive.nodes:
-                    for new, rr in node.reason.items():
-                        tmp_reason = []
-                        for r in rr:
-                            tmp_reason.append(
-                                get_identifiable_reason(v.recursive,
-                                                        node,
-                                                        r,
-                                                        super_graph=g,
-                                                        super_node=v))
-                        node.reason[str(new)] = tmp_reason
-            for s in v.diff:
-                if str(s.symbol) in v.reason.keys() and len(v.reason[str(
-                        s.symbol)]) > 0:
-                    s.has_reason = True
-            searched_nodes.add(v)
-            for w in g.successors(v):
-                children_next.add(w)
-            children_next = children_next.difference(searched_nodes)
-        children_current = list(children_next)
 
+def leave_node(provenance: Dict[Symbol, SymbolIdentifier],
+               undo: List[Tuple[Symbol, Optional[SymbolIdentifier]]]) -> None:
+    for symbol, previous in reversed(undo):
+        if previous is None:
+            del provenance[symbol]
+        else:
+            provenance[symbol] = previous
 
-def get_identifiable_reason(g: nx.DiGraph,
-                            v: Node,
-                            r: Symbol,
-                            super_graph=None,
-                            super_node=None) -> Optional[SymbolIdentifier]:
+
+def identify_node_reasons(provenance: Dict[Symbol, SymbolIdentifier], v: Node) -> None:
+    """
+    Identifies the reasons of a node, and of the nodes of its recursive
+    subgraph, whose reasons may also be derived in the super node's path.
+    """
+    for new, rr in v.reason.items():
+        v.reason[str(new)] = [get_identifiable_reason(provenance, r) for r in rr]
+    if v.recursive:
+        undo_stack = []
+        for node in nx.topological_sort(v.recursive):
+            undo_stack.append(enter_node(provenance, node))
+            for new, rr in node.reason.items():
+                node.reason[str(new)] = [get_identifiable_reason(provenance, r) for r in rr]
+        for undo in reversed(undo_stack):
+            leave_node(provenance, undo)
+    for s in v.diff:
+        if str(s.symbol) in v.reason.keys() and len(v.reason[str(
+                s.symbol)]) > 0:
+            s.has_reason = True
+
+
+def get_identifiable_reason(provenance: Dict[Symbol, SymbolIdentifier],
+                            r: Symbol) -> Optional[SymbolIdentifier]:
     """
     Returns the SymbolIdentifier that is the reason for the given Symbol r.
-    If the reason is not in the node, it returns recursively calls itself with the predecessor.
-    
-    
-    :param g: The graph that contains the nodes
-    :param v: The node that contains the symbol r
+
+    :param provenance: The SymbolIdentifiers of the symbols derived on the current path
     :param r: The symbol that is the reason
     """
-    if (r in v.diff): return next(s for s in v.atoms if s == r)
-    if (g.in_degree(v) != 0):
-        for u in g.predecessors(v):
-            return get_identifiable_reason(g,
-                                           u,
-                                           r,
-                                           super_graph=super_graph,
-                                           super_node=super_node)
-    if (super_graph != None and super_node != None):
-        return get_identifiable_reason(super_graph, super_node, r)
-
-    # stop criterion: v is the root node and there is no super_graph
-    warn(f"An explanation could not be made")
-    return None
+    reason = provenance.get(r)
+    if reason is None:
+        warn(f"An explanation could not be made")
+    return reason
 
 
-def harmonize_uuids(g: nx.DiGraph) -> None:
+def index_nodes(g: nx.DiGraph) -> Dict[Node, Node]:
     """
-    Harmonizes the uuids of the nodes in the graph with those of existing graphs of different sortings.
+    Returns an index of the nodes of a graph, that finds the node equal to a given
+    one by its hash, which is built from the atoms, the rule number and the diff.
     """
-    database = get_database()
+    return {node: node for node in g.nodes}
 
-    if database.get_current_graph() != "":
-        pattern_g = database.load()
 
-        pattern_nodes = set(pattern_g.nodes())
-        incoming_nodes = set(g.nodes())
+def harmonize_uuids(g: nx.DiGraph, pattern_nodes: Dict[Node, Node]) -> None:
+    """
+    Harmonizes the uuids of the nodes in the graph with those of existing graphs of different sortings.
+    Equal nodes also get copies of the atoms and diff of the node they are equal to, so that
+    their symbols have the same uuids. The pattern nodes are only read, so that graphs of
+    several sortings can be harmonized with them at the same time.
+    Should be called before the reasons are identified, which then refer to the copied symbols.
 
-        for incoming in incoming_nodes:
-            for pattern in pattern_nodes:
-                if incoming == pattern:
-                    incoming.uuid = pattern.uuid
-                    incoming.atoms = pattern.atoms
-                    incoming.diff = pattern.diff
+    :param g: The graph whose nodes are harmonized.
+    :param pattern_nodes: The index of the nodes to harmonize with, see index_nodes.
+    """
+    # copies by the id of the copied object, so that shared symbols stay shared
+    identifiers: Dict[int, SymbolIdentifier] = {}
+    chains: Dict[int, ChainedAtoms] = {}
+
+    def copy_identifier(s: SymbolIdentifier) -> SymbolIdentifier:
+        if id(s) not in identifiers:
+            identifiers[id(s)] = SymbolIdentifier(s.symbol, uuid=s.uuid)
+        return identifiers[id(s)]
+
+    def copy_atoms(atoms):
+        if not isinstance(atoms, ChainedAtoms):
+            return frozenset(map(copy_identifier, atoms))
+        pending: List[ChainedAtoms] = []
+        link: Optional[ChainedAtoms] = atoms
+        while link is not None and id(link) not in chains:
+            pending.append(link)
+            link = link.parent
+        parent = chains[id(link)] if link is not None else None
+        for link in reversed(pending):
+            parent = ChainedAtoms(frozenset(map(copy_identifier, link.added)), link.owner, parent)
+            chains[id(link)] = parent
+        return chains[id(atoms)]
+
+    for incoming in g.nodes:
+        pattern = pattern_nodes.get(incoming)
+        if pattern is not None:
+            incoming.uuid = pattern.uuid
+            incoming.atoms = copy_atoms(pattern.atoms)
+            incoming.diff = frozenset(map(copy_identifier, pattern.diff))
 
 
 def calculate_spacing_factor(g: nx.DiGraph) -> None:
@@ -59,9 +59,10 @@ class ClingoClient(ViaspClient):
 
     def show(self):
         self._reconstruct()
-        r = requests.post(f"{self.backend_url}/control/show")
+        r = requests.post(f"{self.backend_url}/control/show",
+                          params={"async": "true"})
         if r.ok:
-            log(f"Drawing in progress.")
+            log(f"Drawing in progress (job {r.json()['job']}).")
         else:
             error(f"Drawing failed [{r.status_code}] ({r.reason})")
 
@@ -1,21 +1,29 @@
-from typing import Tuple, Any, Dict, Iterable, Collection, Optional, List
+from hashlib import sha1
+from threading import Condition, Thread
+from typing import Tuple, Any, Dict, Iterable, Collection, Optional, List, Iterator
 
-from flask import request, Blueprint, jsonify, abort, Response, current_app
+from flask import request, Blueprint, jsonify, abort, Response, current_app, Flask, stream_with_context
 from uuid import uuid4
 
+import networkx as nx
 from clingo import Control
 from clingraph.orm import Factbase
 from clingo.ast import AST
 from clingraph.graphviz import compute_graphs, render
-from ...shared.defaults import CLINGRAPH_PATH
+from ...shared.defaults import CLINGRAPH_PATH, DEFAULT_PATH_WORKERS, DEFAULT_SORT_WORKERS, \
+    SHOW_EVENT_KEEPALIVE, PATH_POOL_EXTENSION
 
-from .dag_api import save_graph, save_clingraph, clear_clingraph, load_clingraph_names
+from .dag_api import save_graph, save_clingraph, clear_clingraph, load_clingraph_names, \
+    set_pending_sorts, ensure_current_graph_is_ready, stop_background_sorts
 from ..database import CallCenter, ProgramDatabase
-from ...asp.justify import build_graph
+from ..sorts import background_sorts
+from ...asp.justify import build_paths, assemble_graph, copy_node, copy_path, make_fact_node, make_transformation_mapping
 from ...asp.reify import ProgramAnalyzer, reify_list
+from ...asp.utils import index_nodes
 from ...asp.relax import ProgramRelaxer, relax_constraints
-from ...shared.model import ClingoMethodCall, StableModel
-from ...shared.util import hash_from_sorted_transformations
+from ...shared.model import ClingoMethodCall, StableModel, Transformation, Node
+from ...shared.simple_logging import error
+from ...shared.util import hash_from_sorted_transformations, LRUCache
 from ...asp.replayer import apply_multiple
 
 bp = Blueprint("api", __name__, template_folder='../templates/')
@@ -151,34 +159,330 @@ def set_warnings():
     return "ok"
 
 
+class SortedProgram:
+    def __init__(self, transformations: List[Transformation], fact_node: Node):
+        self.transformations = transformations
+        self.hash = hash_from_sorted_transformations(transformations)
+        self.reified: Optional[Collection[AST]] = None
+        self.mapping = make_transformation_mapping(transformations)
+        self.fact_node = fact_node
+        self.paths: Dict[Tuple[str, ...], nx.DiGraph] = {}
+
+
+SHOW_STAGES = ("analysis", "sorting", "reification", "grounding", "paths", "reasons", "save")
+
+
+class ShowJob:
+    """
+    The progress of one call to show. The stages count how many of their
+    steps are done, the sorts tell which graphs can already be loaded.
+    Every change increases the version, which listeners can wait for.
+    """
+
+    def __init__(self):
+        self.id = uuid4().hex
+        self.status = "running"
+        self.errors: List[str] = []
+        self.stages: Dict[str, Dict[str, int]] = {
+            stage: {"done": 0, "total": 0} for stage in SHOW_STAGES}
+        self.sorts: Dict[str, bool] = {}
+        self.version = 0
+        self.changed = Condition()
+
+    def _notify(self) -> None:
+        self.version += 1
+        self.changed.notify_all()
+
+    def add_steps(self, stage: str, steps: int = 1) -> None:
+        with self.changed:
+            self.stages[stage]["total"] += steps
+            self._notify()
+
+    def advance(self, stage: str) -> None:
+        with self.changed:
+            self.stages[stage]["done"] += 1
+            self._notify()
+
+    def set_sorts(self, hashes: List[str]) -> None:
+        with self.changed:
+            self.sorts = {h: False for h in hashes}
+            if len(hashes) == 0:
+                self.status = "done"
+            self._notify()
+
+    def sort_finished(self, hash: str, failure: Optional[str] = None) -> None:
+        with self.changed:
+            if failure is None:
+                self.sorts[hash] = True
+            else:
+                self.sorts.pop(hash, None)
+                self.errors.append(failure)
+            if self.status == "running" and all(self.sorts.values()):
+                self.status = "done"
+            self._notify()
+
+    def cancel(self) -> None:
+        with self.changed:
+            if self.status == "running":
+                self.status = "cancelled"
+                self._notify()
+
+    def fail(self, failure: str) -> None:
+        with self.changed:
+            self.errors.append(failure)
+            self.status = "failed"
+            self._notify()
+
+    def wait_for_change(self, version: int, timeout: float) -> int:
+        """
+        Waits until the version is newer than the given one, or the timeout passes.
+        Returns the current version.
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.changed:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "errors": list(self.errors),
+                "stages": {stage: dict(steps) for stage, steps in self.stages.items()},
+                "sorts": [{"hash": h, "ready": ready} for h, ready in self.sorts.items()],
+            }
+
+
+show_jobs: LRUCache[str, ShowJob] = LRUCache(16)
+
+
+class ShowCache:
+    """
+    Keeps the analysis of the program and the paths of the marked models
+    between calls to show, so that only newly marked models are solved.
+    All but the first sort are built in the background, see background_sorts.
+    """
+
+    def __init__(self):
+        self.key: Optional[str] = None
+        self.analyzer = ProgramAnalyzer()
+        self.recursion_rules: set = set()
+        self.sorted_programs: List[SortedProgram] = []
+        self.node_index: Optional[Dict[Node, Node]] = None
+
+    def update(self, program: str, transformer: Any,
+               job: Optional[ShowJob] = None,
+               program_hash: Optional[str] = None) -> ProgramAnalyzer:
+        job = job if job is not None else ShowJob()
+        job.add_steps("analysis")
+        job.add_steps("sorting")
+        if program_hash is None:
+            program_hash = sha1(program.encode()).hexdigest()
+        key = sha1(f"{program_hash}{current_app.json.dumps(transformer)}".encode()).hexdigest()
+        if key != self.key:
+            self.key = key
+            self.analyzer = ProgramAnalyzer()
+            self.analyzer.add_program(program, transformer)
+            job.advance("analysis")
+            self.sorted_programs = []
+            if self.analyzer.will_work():
+                self.recursion_rules = self.analyzer.check_positive_recursion()
+                self.sorted_programs = [
+                    SortedProgram(sorted_program, make_fact_node(self.analyzer))
+                    for sorted_program in self.analyzer.get_sorted_program()
+                ]
+        else:
+            job.advance("analysis")
+        job.advance("sorting")
+        return self.analyzer
+
+    def reify(self, sorted_program: SortedProgram,
+              job: Optional[ShowJob] = None) -> Collection[AST]:
+        """
+        Reifies the sorted program once. This adds names to the analyzer, so
+        it must not run while other sorts are built.
+        """
+        if sorted_program.reified is None:
+            if job is not None:
+                job.add_steps("reification")
+            sorted_program.reified = reify_list(
+                sorted_program.transformations,
+                h=self.analyzer.get_conflict_free_h(),
+                h_showTerm=self.analyzer.get_conflict_free_h_showTerm(),
+                model=self.analyzer.get_conflict_free_model(),
+                get_conflict_free_variable=self.analyzer.get_conflict_free_variable,
+                conflict_free_showTerm=self.analyzer.get_conflict_free_showTerm())
+            if job is not None:
+                job.advance("reification")
+        return sorted_program.reified
+
+    def build_graph(self, sorted_program: SortedProgram,
+                    marked_models: List[List[str]],
+                    job: Optional[ShowJob] = None) -> nx.DiGraph:
+        """
+        Builds the graph of the marked models, reusing the paths of models
+        that were marked before. Paths of models that are no longer marked
+        are dropped.
+        """
+        if not len(sorted_program.mapping):
+            single_node_graph = nx.DiGraph()
+            single_node_graph.add_node(copy_node(sorted_program.fact_node))
+            return single_node_graph
+        new_models = [model for model in marked_models
+                      if tuple(model) not in sorted_program.paths]
+        if job is not None:
+            job.add_steps("grounding", len(new_models))
+            job.add_steps("paths", len(new_models))
+            job.add_steps("reasons")
+        new_paths = build_paths(new_models, self.reify(sorted_program, job),
+                                sorted_program.mapping,
+                                sorted_program.fact_node, self.analyzer,
+                                self.recursion_rules,
+                                current_app.config.get("PATH_WORKERS", DEFAULT_PATH_WORKERS),
+                                job.advance if job is not None else None,
+                                current_app.extensions.get(PATH_POOL_EXTENSION)) if new_models else []
+        sorted_program.paths.update(
+            (tuple(model), path) for model, path in zip(new_models, new_paths))
+        paths = {tuple(model): sorted_program.paths[tuple(model)]
+                 for model in marked_models}
+        sorted_program.paths = paths
+        g = assemble_graph([copy_path(path) for path in paths.values()],
+                           self.analyzer, self.node_index)
+        if job is not None:
+            job.advance("reasons")
+        return g
+
+    def save(self, sorted_program: SortedProgram,
+             marked_models: List[List[str]],
+             job: Optional[ShowJob] = None) -> nx.DiGraph:
+        g = self.build_graph(sorted_program, marked_models, job)
+        save_graph(g, sorted_program.hash,
+                   current_app.json.dumps(sorted_program.transformations))
+        if job is not None:
+            job.advance("save")
+            job.sort_finished(sorted_program.hash)
+        return g
+
+    def save_in_background(self, app: Flask, sorted_program: SortedProgram,
+                           marked_models: List[List[str]], job: ShowJob) -> None:
+        with app.app_context():
+            try:
+                self.save(sorted_program, marked_models, job)
+            except Exception as e:
+                failure = f"Could not build the graph of sort {sorted_program.hash}: {e}"
+                error(failure)
+                job.sort_finished(sorted_program.hash, failure)
+
+    def show(self, marked_models: List[List[str]],
+             job: Optional[ShowJob] = None) -> None:
+        job = job if job is not None else ShowJob()
+        job.set_sorts([p.hash for p in self.sorted_programs])
+        if len(self.sorted_programs) == 0:
+            return
+        job.add_steps("save", len(self.sorted_programs))
+        set_pending_sorts([p.hash for p in self.sorted_programs])
+        first, *rest = self.sorted_programs
+        # the nodes of the other sorts take over the uuids of equal nodes of the first
+        self.node_index = None
+        self.node_index = index_nodes(self.save(first, marked_models, job))
+        ensure_current_graph_is_ready(first.hash)
+        workers = current_app.config.get("SORT_WORKERS", DEFAULT_SORT_WORKERS)
+        if workers > 0 and len(rest) > 0:
+            # the background threads only read the analyzer
+            for sorted_program in rest:
+                self.reify(sorted_program, job)
+            background_sorts.start(workers, job.cancel)
+            app = current_app._get_current_object()  # type: ignore
+            for sorted_program in rest:
+                background_sorts.submit(sorted_program.hash, self.save_in_background,
+                                        app, sorted_program, marked_models, job)
+        else:
+            for sorted_program in rest:
+                self.save(sorted_program, marked_models, job)
+
+
+show_cache = ShowCache()
+
+
+def run_show(job: ShowJob, program: str, transformer: Any,
+             models: List[StableModel], program_hash: Optional[str] = None) -> None:
+    with background_sorts.lock:
+        stop_background_sorts()
+        analyzer = show_cache.update(program, transformer, job, program_hash)
+        _set_warnings(analyzer.get_filtered())
+
+        marked_models = wrap_marked_models(models,
+                                           analyzer.get_conflict_free_showTerm())
+        show_cache.show(marked_models, job)
+
+
+def run_show_in_background(app: Flask, job: ShowJob, program: str,
+                           transformer: Any, models: List[StableModel],
+                           program_hash: Optional[str] = None) -> None:
+    with app.app_context():
+        try:
+            run_show(job, program, transformer, models, program_hash)
+        except Exception as e:
+            failure = f"Could not show the marked models: {e}"
+            error(failure)
+            job.fail(failure)
+
+
 @bp.route("/control/show", methods=["POST"])
 def show_selected_models():
-    db = ProgramDatabase()
-    analyzer = ProgramAnalyzer()
-    analyzer.add_program(db.get_program(), dc.transformer)
-    _set_warnings(analyzer.get_filtered())
-
-    marked_models = dc.models
-    marked_models = wrap_marked_models(marked_models,
-                                       analyzer.get_conflict_free_showTerm())
-    if analyzer.will_work():
-        recursion_rules = analyzer.check_positive_recursion()
-        for sorted_program in analyzer.get_sorted_program():
-            reified: Collection[AST] = reify_list(
-                sorted_program,
-                h=analyzer.get_conflict_free_h(),
-                h_showTerm=analyzer.get_conflict_free_h_showTerm(),
-                model=analyzer.get_conflict_free_model(),
-                get_conflict_free_variable=analyzer.get_conflict_free_variable,
-                conflict_free_showTerm=analyzer.get_conflict_free_showTerm())
-            g = build_graph(marked_models, reified, sorted_program, analyzer,
-                            recursion_rules)
-            save_graph(g, hash_from_sorted_transformations(sorted_program),
-                       current_app.json.dumps(sorted_program))
-
+    """
+    Builds the graphs of the marked models. With the query parameter async=true,
+    the graphs are built in the background and the id of the job is returned,
+    whose progress is available at /control/show/<job_id>.
+    """
+    program, program_hash = ProgramDatabase().get_program_and_hash()
+    job = ShowJob()
+    show_jobs.put(job.id, job)
+    if request.args.get("async", "false").lower() == "true":
+        app = current_app._get_current_object()  # type: ignore
+        Thread(target=run_show_in_background,
+               args=(app, job, program, dc.transformer, list(dc.models), program_hash),
+               daemon=True).start()
+        return jsonify({"job": job.id}), 202
+    run_show(job, program, dc.transformer, dc.models, program_hash)
     return "ok", 200
 
 
+@bp.route("/control/show/<job_id>", methods=["GET"])
+def get_show_progress(job_id: str):
+    job = show_jobs.get(job_id)
+    if job is None:
+        return "Unknown job", 404
+    return jsonify(job.to_dict())
+
+
+@bp.route("/control/show/<job_id>/events", methods=["GET"])
+def stream_show_progress(job_id: str):
+    """
+    Sends the progress of a job as server-sent events, one event per change,
+    until the job is done or has failed.
+    """
+    job = show_jobs.get(job_id)
+    if job is None:
+        return "Unknown job", 404
+
+    def events() -> Iterator[str]:
+        seen = -1
+        while True:
+            version = job.wait_for_change(seen, SHOW_EVENT_KEEPALIVE)
+            if version == seen:
+                yield ": keepalive\n\n"
+                continue
+            seen = version
+            progress = job.to_dict()
+            yield f"data: {current_app.json.dumps(progress)}\n\n"
+            if progress["status"] != "running":
+                return
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+
 @bp.route("/control/relax", methods=["POST"])
 def transform_relax():
     db = ProgramDatabase()
@@ -1,65 +1,615 @@
 import os
 from collections import defaultdict
-from typing import Union, Collection, Dict, List
+from queue import Queue, Empty
+from threading import Lock
+from typing import Union, Collection, Dict, List, Optional, Tuple, Iterable, Iterator
+from uuid import UUID
 
 import igraph
 import networkx as nx
+from clingo import Symbol, SymbolType, parse_term
 import sqlite3
-import numpy as np
-from flask import Blueprint, request, jsonify, abort, Response, send_file, current_app, g
+from flask import Blueprint, request, jsonify, abort, Response, send_file, current_app, g, stream_with_context
 from networkx import DiGraph
 
-from ...shared.defaults import GRAPH_PATH, STATIC_PATH
-from ...shared.model import Transformation, Node, Signature
-from ...shared.util import get_start_node_from_graph, is_recursive
+from ...shared.io import get_transformation_source, dumps_interned
+from ...shared.defaults import GRAPH_PATH, STATIC_PATH, GRAPH_CACHE_SIZE, GRAPH_POOL_SIZE, GRAPH_POOL_CACHE_KIB, \
+    DEFAULT_GRAPH_FORMAT, WIRE_FORMAT_HEADER
+from ...shared.graph_codec import encode_graph, decode_graph, UnsupportedGraphError
+from ...shared.model import Transformation, Node, Signature, SymbolIdentifier
+from ...shared.util import get_start_node_from_graph, LRUCache
+from ...shared.simple_logging import warn
+from ..sorts import background_sorts
 
 bp = Blueprint("dag_api", __name__, template_folder='../templates', static_folder='../static/',
                static_url_path='/static')
 
 
+def uuid_key(uuid: Union[UUID, str]) -> str:
+    return uuid.hex if isinstance(uuid, UUID) else str(uuid)
+
+
+class GraphIndex:
+    """
+    Secondary indexes over a decoded graph, so that lookups by uuid or
+    transformation id do not have to scan the graph.
+    """
+
+    def __init__(self, graph: nx.DiGraph):
+        self.nodes: Dict[str, Node] = {}
+        self.recursive_nodes: Dict[str, Node] = {}
+        self.super_nodes: Dict[str, Node] = {}
+        self.diff_symbols: Dict[Tuple[str, str], SymbolIdentifier] = {}
+        self.transformations_by_id: Dict[str, Transformation] = {}
+        self.transformations_by_hash: Dict[str, Transformation] = {}
+
+        for node in graph.nodes():
+            self.nodes[uuid_key(node.uuid)] = node
+            self._index_diff(node)
+            if node.recursive is not False:
+                for inner in node.recursive.nodes():
+                    inner_key = uuid_key(inner.uuid)
+                    self.recursive_nodes.setdefault(inner_key, inner)
+                    self.super_nodes.setdefault(inner_key, node)
+                    self._index_diff(inner)
+        for _, _, d in graph.edges(data=True):
+            transformation: Transformation = d['transformation']
+            self.transformations_by_id.setdefault(str(transformation.id),
+                                                  transformation)
+            self.transformations_by_hash.setdefault(str(transformation.hash),
+                                                    transformation)
+
+    def _index_diff(self, node: Node):
+        node_key = uuid_key(node.uuid)
+        for symbol in node.diff:
+            self.diff_symbols.setdefault((node_key, uuid_key(symbol.uuid)),
+                                         symbol)
+
+    def find_node(self, uuid: str) -> Optional[Node]:
+        node = self.nodes.get(uuid)
+        if node is None:
+            node = self.recursive_nodes.get(uuid)
+        return node
+
+
+NORMALIZED_TABLES = [
+    "nodes", "edges", "children", "recursive_edges", "transformations",
+    "rules", "symbols", "reasons"
+]
+SQLITE_MAX_PARAMETERS = 900
+
+
+def signature_of(symbol: Symbol) -> Tuple[str, int]:
+    if symbol.type == SymbolType.Function:
+        return symbol.name, len(symbol.arguments)
+    return str(symbol), 0
+
+
+def is_normalizable(graph: nx.Graph) -> bool:
+    """
+    Only graphs of decoded nodes over clingo symbols can be split into tables.
+    """
+    for node in graph.nodes():
+        if not isinstance(node, Node):
+            return False
+        if not all(isinstance(s.symbol, Symbol) for s in node.atoms):
+            return False
+        if node.recursive is not False and not is_normalizable(node.recursive):
+            return False
+    return True
+
+
+# Decoded graphs of the most recently used sorts together with their
+# indexes, keyed by the graph hash. Every mutation of the graphs table must
+# go through GraphAccessor, which keeps this cache consistent.
+graph_cache: LRUCache[str, Tuple[nx.DiGraph, GraphIndex]] = LRUCache(GRAPH_CACHE_SIZE)
+# Horizontal node positions by uuid, used to order the children of a row.
+layout_cache: LRUCache[str, Dict[str, float]] = LRUCache(GRAPH_CACHE_SIZE)
+
+
+def migrate(connection: sqlite3.Connection):
+    """
+    Creates the tables of the graph storage. Runs once for every database file.
+    """
+    cursor = connection.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS graphs (
+            hash TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            sort BLOB NOT NULL,
+            format TEXT NOT NULL DEFAULT 'json'
+        )
+    """)
+    # graphs stored before the binary format was added are JSON
+    columns = [column[1] for column in cursor.execute("PRAGMA table_info(graphs)")]
+    if "format" not in columns:
+        cursor.execute("ALTER TABLE graphs ADD COLUMN format TEXT NOT NULL DEFAULT 'json'")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS current_graph (
+            hash TEXT PRIMARY KEY,
+            FOREIGN KEY(hash) REFERENCES graphs(hash)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS clingraph (
+            filename TEXT PRIMARY KEY
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sort_status (
+            hash TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            ready INTEGER NOT NULL
+        )
+    """)
+    create_normalized_tables(cursor)
+    connection.commit()
+
+
+def create_normalized_tables(cursor: sqlite3.Cursor):
+    """
+    Tables holding the graphs split into their parts, so that single nodes,
+    symbols and transformations can be queried without decoding the
+    entire graph. Nodes of recursive subgraphs reference their super node.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS nodes (
+            graph_hash TEXT NOT NULL,
+            uuid TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            rule_nr INTEGER NOT NULL,
+            super_uuid TEXT,
+            data TEXT NOT NULL,
+            PRIMARY KEY (graph_hash, uuid)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS edges (
+            graph_hash TEXT NOT NULL,
+            source_uuid TEXT NOT NULL,
+            target_uuid TEXT NOT NULL,
+            transformation_id INTEGER NOT NULL,
+            transformation_hash TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS children (
+            graph_hash TEXT NOT NULL,
+            transformation_hash TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            node_uuid TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS recursive_edges (
+            graph_hash TEXT NOT NULL,
+            super_uuid TEXT NOT NULL,
+            source_uuid TEXT NOT NULL,
+            target_uuid TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS transformations (
+            graph_hash TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (graph_hash, id)
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rules (
+            graph_hash TEXT NOT NULL,
+            transformation_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            rule TEXT NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS symbols (
+            graph_hash TEXT NOT NULL,
+            node_uuid TEXT NOT NULL,
+            uuid TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            name TEXT NOT NULL,
+            arity INTEGER NOT NULL,
+            in_diff INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS reasons (
+            graph_hash TEXT NOT NULL,
+            node_uuid TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            reason_uuid TEXT
+        )
+    """)
+    for statement in [
+            "CREATE INDEX IF NOT EXISTS edges_by_transformation ON edges (graph_hash, transformation_hash)",
+            "CREATE INDEX IF NOT EXISTS edges_by_source ON edges (graph_hash, source_uuid)",
+            "CREATE INDEX IF NOT EXISTS edges_by_target ON edges (graph_hash, target_uuid)",
+            "CREATE INDEX IF NOT EXISTS children_by_transformation ON children (graph_hash, transformation_hash, position)",
+            "CREATE INDEX IF NOT EXISTS recursive_edges_by_super_node ON recursive_edges (graph_hash, super_uuid)",
+            "CREATE INDEX IF NOT EXISTS transformations_by_hash ON transformations (graph_hash, hash)",
+            "CREATE INDEX IF NOT EXISTS rules_by_transformation ON rules (graph_hash, transformation_id)",
+            "CREATE INDEX IF NOT EXISTS symbols_by_node ON symbols (graph_hash, node_uuid)",
+            "CREATE INDEX IF NOT EXISTS symbols_by_uuid ON symbols (graph_hash, uuid)",
+            "CREATE INDEX IF NOT EXISTS symbols_by_signature ON symbols (graph_hash, name, arity)",
+            "CREATE INDEX IF NOT EXISTS reasons_by_node ON reasons (graph_hash, node_uuid, symbol)",
+    ]:
+        cursor.execute(statement)
+
+
+class ConnectionPool:
+    """
+    Long-lived SQLite connections to the graph storage, shared by all threads.
+    The database is put into WAL mode, so that readers do not block the writer,
+    and the schema is migrated once when the pool is created.
+    Keeps at most `size` idle connections; if all are in use, a new one is opened.
+    """
+
+    def __init__(self, path: str, size: int = GRAPH_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle: "Queue[sqlite3.Connection]" = Queue()
+        connection = self._connect()
+        migrate(connection)
+        self._idle.put(connection)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA cache_size=-{GRAPH_POOL_CACHE_KIB}")
+        return connection
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            return self._connect()
+
+    def release(self, connection: sqlite3.Connection):
+        connection.rollback()
+        if self._idle.qsize() < self.size:
+            self._idle.put(connection)
+        else:
+            connection.close()
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = Lock()
+
+
+def get_pool(path: str = str(GRAPH_PATH)) -> ConnectionPool:
+    with _pools_lock:
+        if path not in _pools:
+            _pools[path] = ConnectionPool(path)
+        return _pools[path]
+
+
 class GraphAccessor:
 
-    def __init__(self):
-        self.dbpath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                   GRAPH_PATH)
-        self.conn = sqlite3.connect(self.dbpath)
+    def __init__(self, pool: Optional[ConnectionPool] = None):
+        self.pool = get_pool() if pool is None else pool
+        self.conn = self.pool.acquire()
         self.cursor = self.conn.cursor()
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS graphs (
-                hash TEXT PRIMARY KEY,
-                data TEXT NOT NULL,
-                sort BLOB NOT NULL
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS current_graph (
-                hash TEXT PRIMARY KEY,
-                FOREIGN KEY(hash) REFERENCES graphs(hash)
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS clingraph (
-                filename TEXT PRIMARY KEY
-            )
-        """)
-        self.conn.commit()
+
+    def close(self):
+        self.cursor.close()
+        self.pool.release(self.conn)
 
     def save(self, graph: Union[nx.Graph, dict], hash: str, sort: str = ""):
         if isinstance(graph, nx.Graph):
             serializable_graph = nx.node_link_data(graph)
         else:
             serializable_graph = graph
+            graph = nx.node_link_graph(graph) if len(graph) > 0 else nx.DiGraph()
 
+        data, format = self.encode(graph, serializable_graph)
         self.cursor.execute(
             """
-            INSERT OR REPLACE INTO graphs (hash, data, sort) VALUES (?, ?, ?)
-        """, (hash, current_app.json.dumps(serializable_graph), sort))
+            INSERT OR REPLACE INTO graphs (hash, data, sort, format) VALUES (?, ?, ?, ?)
+        """, (hash, data, sort, format))
+        positions = self.save_normalized(graph, hash)
+        graph_cache.invalidate(hash)
+        if positions is None:
+            layout_cache.invalidate(hash)
+        else:
+            layout_cache.put(hash, positions)
 
+        self.cursor.execute("UPDATE sort_status SET ready = 1 WHERE hash = ?",
+                            (hash, ))
         if self.cursor.execute(
                 "SELECT COUNT(*) FROM current_graph").fetchone()[0] == 0:
             self.set_current_graph(hash)
         self.conn.commit()
 
+    def encode(self, graph: nx.Graph, serializable_graph: dict) -> Tuple[Union[str, bytes], str]:
+        """
+        Encodes the graph in the format of the GRAPH_FORMAT setting.
+        Graphs that the binary codec cannot represent are stored as JSON.
+        """
+        if current_app.config.get("GRAPH_FORMAT", DEFAULT_GRAPH_FORMAT) == "binary":
+            try:
+                return encode_graph(graph), "binary"
+            except UnsupportedGraphError as e:
+                warn(f"Storing the graph as JSON, as it cannot be encoded in binary: {e}")
+        return current_app.json.dumps(serializable_graph), "json"
+
+    def set_pending_sorts(self, hashes: List[str]):
+        """
+        Marks the graphs of the given sorts as being computed. Until they are
+        saved again, they are not offered as sorts.
+        """
+        self.cursor.execute("DELETE FROM sort_status")
+        self.cursor.executemany(
+            "INSERT OR IGNORE INTO sort_status (hash, position, ready) VALUES (?, ?, 0)",
+            ((hash, i) for i, hash in enumerate(hashes)))
+        self.conn.commit()
+
+    def drop_pending_sorts(self, hashes: List[str]):
+        """
+        Removes the given sorts from the sorts being computed, as their graphs
+        will not be saved.
+        """
+        self.cursor.executemany("DELETE FROM sort_status WHERE hash = ? AND ready = 0",
+                                ((hash, ) for hash in hashes))
+        self.conn.commit()
+
+    def load_sort_status(self) -> List[Tuple[str, bool]]:
+        self.cursor.execute(
+            "SELECT hash, ready FROM sort_status ORDER BY position")
+        return [(hash, bool(ready)) for hash, ready in self.cursor.fetchall()]
+
+    def is_ready(self, hash: str) -> bool:
+        self.cursor.execute("SELECT ready FROM sort_status WHERE hash = ?",
+                            (hash, ))
+        result = self.cursor.fetchall()
+        return len(result) == 0 or bool(result[0][0])
+
+    def delete_normalized(self, hash: Optional[str] = None):
+        for table in NORMALIZED_TABLES:
+            if hash is None:
+                self.cursor.execute(f"DELETE FROM {table}")
+            else:
+                self.cursor.execute(
+                    f"DELETE FROM {table} WHERE graph_hash = ?", (hash, ))
+
+    def save_normalized(self, graph: nx.Graph, hash: str) -> Optional[Dict[str, float]]:
+        """
+        Stores the nodes, edges, symbols, reasons and recursive subgraphs of
+        the graph in their own tables. Graphs that do not consist of decoded
+        nodes are only kept as JSON.
+        The children of every transformation are stored in the order of
+        the graph layout, whose horizontal node positions are returned.
+        """
+        self.delete_normalized(hash)
+        if not is_normalizable(graph):
+            return None
+        nodes, symbols, reasons, recursive_edges = [], [], [], []
+
+        def add_node(node: Node, position: int, super_uuid: Optional[str]):
+            node_uuid = uuid_key(node.uuid)
+            nodes.append((hash, node_uuid, position, node.rule_nr, super_uuid,
+                          current_app.json.dumps(node)))
+            for symbol in node.atoms:
+                symbols.append(
+                    (hash, node_uuid, uuid_key(symbol.uuid), str(symbol.symbol),
+                     *signature_of(symbol.symbol), symbol in node.diff))
+            for symbol, symbol_reasons in node.reason.items():
+                for i, r in enumerate(symbol_reasons):
+                    reason_uuid = getattr(r, "uuid", None)
+                    reasons.append((hash, node_uuid, str(symbol), i,
+                                    None if reason_uuid is None else uuid_key(reason_uuid)))
+
+        for position, node in enumerate(graph.nodes()):
+            add_node(node, position, None)
+            if node.recursive is not False:
+                super_uuid = uuid_key(node.uuid)
+                for inner_position, inner in enumerate(node.recursive.nodes()):
+                    add_node(inner, inner_position, super_uuid)
+                for u, v in node.recursive.edges():
+                    recursive_edges.append((hash, super_uuid, uuid_key(u.uuid),
+                                            uuid_key(v.uuid)))
+
+        edges, transformations, rules = [], {}, []
+        children: Dict[str, List[str]] = defaultdict(list)
+        for u, v, d in graph.edges(data=True):
+            transformation: Transformation = d['transformation']
+            edges.append((hash, uuid_key(u.uuid), uuid_key(v.uuid),
+                          transformation.id, str(transformation.hash)))
+            children[str(transformation.hash)].append(uuid_key(v.uuid))
+            if transformation.id not in transformations:
+                transformations[transformation.id] = (
+                    hash, transformation.id, str(transformation.hash),
+                    current_app.json.dumps(transformation))
+                # the rules as they are decoded from the stored graph
+                rules.extend((hash, transformation.id, i, rule) for i, rule in
+                             enumerate(get_transformation_source(transformation)))
+
+        self.cursor.executemany(
+            "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?)", nodes)
+        self.cursor.executemany(
+            "INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?, ?)", symbols)
+        self.cursor.executemany(
+            "INSERT INTO reasons VALUES (?, ?, ?, ?, ?)", reasons)
+        self.cursor.executemany(
+            "INSERT INTO recursive_edges VALUES (?, ?, ?, ?)", recursive_edges)
+        self.cursor.executemany(
+            "INSERT INTO edges VALUES (?, ?, ?, ?, ?)", edges)
+        self.cursor.executemany(
+            "INSERT OR REPLACE INTO transformations VALUES (?, ?, ?, ?)",
+            transformations.values())
+        self.cursor.executemany(
+            "INSERT INTO rules VALUES (?, ?, ?, ?)", rules)
+
+        positions = {
+            uuid: pos[0]
+            for uuid, pos in get_sort(topology_of(graph)).items()
+        } if graph.number_of_nodes() > 0 else {}
+        self.cursor.executemany(
+            "INSERT INTO children VALUES (?, ?, ?, ?)",
+            ((hash, transformation_hash, i, uuid)
+             for transformation_hash, uuids in children.items()
+             for i, uuid in enumerate(sorted(uuids, key=positions.__getitem__))))
+        return positions
+
+    def has_normalized(self, hash: str) -> bool:
+        self.cursor.execute(
+            "SELECT 1 FROM nodes WHERE graph_hash = ? LIMIT 1", (hash, ))
+        return len(self.cursor.fetchall()) > 0
+
+    def load_topology(self, hash: str) -> nx.DiGraph:
+        """
+        Returns the structure of the graph with node uuids as nodes,
+        in the order in which the nodes were stored.
+        """
+        topology = nx.DiGraph()
+        self.cursor.execute(
+            """
+            SELECT uuid FROM nodes WHERE graph_hash = ? AND super_uuid IS NULL
+            ORDER BY position
+        """, (hash, ))
+        topology.add_nodes_from(r[0] for r in self.cursor.fetchall())
+        self.cursor.execute(
+            "SELECT source_uuid, target_uuid FROM edges WHERE graph_hash = ?",
+            (hash, ))
+        topology.add_edges_from(self.cursor.fetchall())
+        return topology
+
+    def load_edges(self, hash: str) -> List[Tuple[str, str]]:
+        """
+        Returns the source and target uuids of all edges in stored order.
+        """
+        self.cursor.execute(
+            """
+            SELECT source_uuid, target_uuid FROM edges WHERE graph_hash = ?
+            ORDER BY rowid
+        """, (hash, ))
+        return self.cursor.fetchall()
+
+    def load_children_uuids(self, hash: str, transformation_hash: str) -> List[str]:
+        """
+        Returns the uuids of the nodes of a transformation in layout order.
+        """
+        self.cursor.execute(
+            """
+            SELECT node_uuid FROM children
+            WHERE graph_hash = ? AND transformation_hash = ?
+            ORDER BY position
+        """, (hash, transformation_hash))
+        return [r[0] for r in self.cursor.fetchall()]
+
+    def load_node_data(self, hash: str, uuids: Collection[str]) -> Dict[str, str]:
+        """
+        Returns the JSON encoding of the nodes with the given uuids.
+        """
+        result: Dict[str, str] = {}
+        uuids = list(uuids)
+        for i in range(0, len(uuids), SQLITE_MAX_PARAMETERS):
+            chunk = uuids[i:i + SQLITE_MAX_PARAMETERS]
+            self.cursor.execute(
+                f"""
+                SELECT uuid, data FROM nodes
+                WHERE graph_hash = ? AND uuid IN ({", ".join("?" * len(chunk))})
+            """, (hash, *chunk))
+            result.update(self.cursor.fetchall())
+        return result
+
+    def load_node_kind(self, hash: str, uuid: str) -> Optional[str]:
+        self.cursor.execute(
+            "SELECT super_uuid FROM nodes WHERE graph_hash = ? AND uuid = ?",
+            (hash, uuid))
+        result = self.cursor.fetchall()
+        if len(result) == 0:
+            return None
+        if result[0][0] is not None:
+            return "Model"
+        self.cursor.execute(
+            "SELECT 1 FROM edges WHERE graph_hash = ? AND source_uuid = ? LIMIT 1",
+            (hash, uuid))
+        if len(self.cursor.fetchall()) == 0:
+            return "Stable Model"
+        self.cursor.execute(
+            "SELECT 1 FROM edges WHERE graph_hash = ? AND target_uuid = ? LIMIT 1",
+            (hash, uuid))
+        if len(self.cursor.fetchall()) == 0:
+            return "Facts"
+        return "Model"
+
+    def load_node_symbols(self, hash: str, uuid: str) -> List[Tuple[str, int, str]]:
+        self.cursor.execute(
+            """
+            SELECT name, arity, symbol FROM symbols
+            WHERE graph_hash = ? AND node_uuid = ?
+            ORDER BY rowid
+        """, (hash, uuid))
+        return self.cursor.fetchall()
+
+    def load_reason_uuids(self, hash: str, node_uuid: str, symbol_uuid: str) -> Optional[List[str]]:
+        self.cursor.execute(
+            """
+            SELECT symbol FROM symbols
+            WHERE graph_hash = ? AND node_uuid = ? AND uuid = ? AND in_diff
+        """, (hash, node_uuid, symbol_uuid))
+        result = self.cursor.fetchall()
+        if len(result) == 0:
+            return None
+        self.cursor.execute(
+            """
+            SELECT reason_uuid FROM reasons
+            WHERE graph_hash = ? AND node_uuid = ? AND symbol = ?
+            ORDER BY position
+        """, (hash, node_uuid, result[0][0]))
+        return [r[0] if r[0] is not None else "" for r in self.cursor.fetchall()]
+
+    def search_signatures(self, hash: str) -> List[Signature]:
+        self.cursor.execute(
+            """
+            SELECT DISTINCT s.name, s.arity FROM symbols s
+            JOIN nodes n ON n.graph_hash = s.graph_hash AND n.uuid = s.node_uuid
+            WHERE s.graph_hash = ? AND s.in_diff AND n.super_uuid IS NULL
+        """, (hash, ))
+        return [Signature(name, arity) for name, arity in self.cursor.fetchall()]
+
+    def search_nodes(self, hash: str, query: str, limit: int) -> List[str]:
+        """
+        Returns the JSON encoding of the nodes containing an atom that contains the query.
+        """
+        self.cursor.execute(
+            """
+            SELECT n.data FROM nodes n
+            WHERE n.graph_hash = ? AND n.super_uuid IS NULL AND EXISTS (
+                SELECT 1 FROM symbols s
+                WHERE s.graph_hash = n.graph_hash AND s.node_uuid = n.uuid
+                    AND instr(s.symbol, ?) > 0)
+            ORDER BY n.position
+            LIMIT ?
+        """, (hash, query, limit))
+        return [r[0] for r in self.cursor.fetchall()]
+
+    def search_transformations(self, hash: str, query: str, limit: int) -> List[str]:
+        """
+        Returns the JSON encoding of the transformations containing a rule that contains the query.
+        """
+        self.cursor.execute(
+            """
+            SELECT t.data FROM transformations t
+            WHERE t.graph_hash = ? AND EXISTS (
+                SELECT 1 FROM rules r
+                WHERE r.graph_hash = t.graph_hash AND r.transformation_id = t.id
+                    AND instr(r.rule, ?) > 0)
+            ORDER BY t.id
+            LIMIT ?
+        """, (hash, query, limit))
+        return [r[0] for r in self.cursor.fetchall()]
+
     def save_clingraph(self, filename: str):
         self.cursor.execute(
             """
@@ -74,7 +624,11 @@ class GraphAccessor:
         self.cursor.execute("""
             DELETE FROM current_graph
         """)
+        self.cursor.execute("DELETE FROM sort_status")
+        self.delete_normalized()
         self.conn.commit()
+        graph_cache.clear()
+        layout_cache.clear()
 
     def clear_clingraph(self):
         self.cursor.execute("""
@@ -95,23 +649,52 @@ class GraphAccessor:
                             (hash, ))
         self.conn.commit()
 
-    def load_json(self) -> dict:
-        hash = self.get_current_graph()
-
+    def load_data(self, hash: str) -> Optional[Tuple[Union[str, bytes], str]]:
         self.cursor.execute(
             """
-            SELECT data FROM graphs WHERE hash = ?
+            SELECT data, format FROM graphs WHERE hash = ?
         """, (hash, ))
-        result = self.cursor.fetchone()
-
-        return current_app.json.loads(
-            result[0]) if result is not None else dict()
+        return self.cursor.fetchone()
+
+    def load_json(self, hash: Optional[str] = None) -> dict:
+        if hash is None:
+            hash = self.get_current_graph()
+
+        result = self.load_data(hash)
+        if result is None:
+            return dict()
+        data, format = result
+        if format == "binary":
+            return nx.node_link_data(decode_graph(data))
+        return current_app.json.loads(data)
+
+    def load_with_index(self) -> Tuple[nx.DiGraph, GraphIndex]:
+        """
+        Returns the graph of the current sort and its indexes.
+        The decoded graph is shared between requests and must not be mutated.
+        """
+        hash = self.get_current_graph()
+        cached = graph_cache.get(hash)
+        if cached is not None:
+            return cached
+        result = self.load_data(hash)
+        if result is not None and result[1] == "binary":
+            loaded_graph = decode_graph(result[0])
+        else:
+            graph_json = current_app.json.loads(result[0]) if result is not None else dict()
+            if len(graph_json) == 0:
+                empty = nx.DiGraph()
+                return empty, GraphIndex(empty)
+            loaded_graph = nx.node_link_graph(graph_json)
+        loaded = (loaded_graph, GraphIndex(loaded_graph))
+        graph_cache.put(hash, loaded)
+        return loaded
 
     def load(self) -> nx.DiGraph:
-        graph_json = self.load_json()
-        loaded_graph = nx.node_link_graph(graph_json) if len(
-            graph_json) > 0 else nx.DiGraph()
-        return loaded_graph
+        return self.load_with_index()[0]
+
+    def load_index(self) -> GraphIndex:
+        return self.load_with_index()[1]
 
     def get_current_sort(self) -> str:
         hash = self.get_current_graph()
@@ -125,11 +708,14 @@ class GraphAccessor:
     def load_all_sorts(self) -> List[str]:
         self.cursor.execute("""
             SELECT hash FROM graphs
+            WHERE hash NOT IN (SELECT hash FROM sort_status WHERE ready = 0)
         """)
         result: List[str] = self.cursor.fetchall()
         loaded_sorts: List[str] = [r[0] for r in result]
-        index_of_current_sort: int = loaded_sorts.index(
-            self.get_current_graph())
+        current_graph = self.get_current_graph()
+        if current_graph not in loaded_sorts:
+            return loaded_sorts
+        index_of_current_sort: int = loaded_sorts.index(current_graph)
         loaded_sorts = loaded_sorts[
             index_of_current_sort:] + loaded_sorts[:index_of_current_sort]
         return loaded_sorts
@@ -148,9 +734,23 @@ def get_database():
     return g.graph_accessor
 
 
+def release_database(exception=None):
+    graph_accessor = g.pop('graph_accessor', None)
+    if graph_accessor is not None:
+        graph_accessor.close()
+
+
+@bp.record_once
+def register_database_teardown(state):
+    state.app.teardown_appcontext(release_database)
+
+
 def get_graph() -> DiGraph:
     return get_database().load()
 
+def get_graph_index() -> GraphIndex:
+    return get_database().load_index()
+
 def get_graph_json() -> dict:
     return get_database().load_json()
 
@@ -163,11 +763,27 @@ def set_current_graph(hash: str):
         return
     db.set_current_graph(hash)
 
+def stop_background_sorts():
+    """
+    Waits for the graphs that show builds in the background, so that none of
+    them is written after the graphs were changed. The sorts that had not
+    started yet are no longer pending.
+    """
+    with background_sorts.lock:
+        cancelled = background_sorts.stop()
+        if len(cancelled) > 0:
+            get_database().drop_pending_sorts(cancelled)
+
+
 def clear_graph():
+    stop_background_sorts()
     get_database().clear()
 
 def nx_to_igraph(nx_graph: DiGraph):
-    return igraph.Graph.Adjacency((np.array(nx.to_numpy_array(nx_graph)) > 0).tolist())
+    index = {node: i for i, node in enumerate(nx_graph.nodes())}
+    return igraph.Graph(n=len(index),
+                        edges=[(index[u], index[v]) for u, v in nx_graph.edges()],
+                        directed=True)
 
 
 def igraph_to_networkx_layout(i_layout, nx_map):
@@ -191,15 +807,82 @@ def get_sort(nx_graph: DiGraph):
     return pos
 
 
-def handle_request_for_children(transformation_hash: str, ids_only: bool) -> Collection[Union[Node, int]]:
-    graph: nx.DiGraph = get_graph()
+def topology_of(graph: DiGraph) -> DiGraph:
+    topology = nx.DiGraph()
+    topology.add_nodes_from(uuid_key(node.uuid) for node in graph.nodes())
+    topology.add_edges_from(
+        (uuid_key(u.uuid), uuid_key(v.uuid)) for u, v in graph.edges())
+    return topology
+
+
+def get_horizontal_positions(database: GraphAccessor, hash: str) -> Dict[str, float]:
+    """
+    Returns the horizontal position of every node of the graph by uuid.
+    The layout is computed once per graph hash.
+    """
+    positions = layout_cache.get(hash)
+    if positions is None:
+        if database.has_normalized(hash):
+            topology = database.load_topology(hash)
+        else:
+            topology = topology_of(database.load())
+        positions = {uuid: pos[0] for uuid, pos in get_sort(topology).items()}
+        layout_cache.put(hash, positions)
+    return positions
+
+
+def json_list_response(encoded: Iterable[str]) -> Response:
+    """
+    Returns a JSON list response from already encoded elements.
+    """
+    return current_app.response_class(f"[{', '.join(encoded)}]",
+                                      mimetype="application/json")
+
+
+def wants_interned() -> bool:
+    return request.headers.get(WIRE_FORMAT_HEADER) == "interned"
+
+
+def negotiated_response(obj) -> Response:
+    """
+    Returns obj in the format asked for by the wire format header. Interned
+    responses carry the distinct symbols once, and refer to them by index.
+    """
+    if wants_interned():
+        response = current_app.response_class(dumps_interned(obj), mimetype="application/json")
+        response.headers[WIRE_FORMAT_HEADER] = "interned"
+    else:
+        response = jsonify(obj)
+    response.vary.add(WIRE_FORMAT_HEADER)
+    return response
+
+
+def handle_request_for_children(transformation_hash: str, ids_only: bool) -> Response:
+    database = get_database()
+    hash = database.get_current_graph()
+    if not database.has_normalized(hash):
+        return negotiated_response(handle_request_for_children_from_graph(transformation_hash, ids_only))
+    ordered_children = database.load_children_uuids(hash, transformation_hash)
+    if ids_only:
+        return negotiated_response(ordered_children)
+    node_data = database.load_node_data(hash, ordered_children)
+    if wants_interned():
+        # only the stored children are decoded, to intern their symbols
+        loads = current_app.json.loads
+        return negotiated_response([loads(node_data[uuid]) for uuid in ordered_children])
+    return json_list_response(node_data[uuid] for uuid in ordered_children)
+
+
+def handle_request_for_children_from_graph(transformation_hash: str, ids_only: bool) -> Collection[Union[Node, int]]:
+    database = get_database()
+    graph: nx.DiGraph = database.load()
     children = list()
     for u, v, d in graph.edges(data=True):
         edge: Transformation = d['transformation']
         if str(edge.hash) == transformation_hash:
             children.append(v)
-    pos: Dict[Node, List[float]] = get_sort(graph)
-    ordered_children = sorted(children, key=lambda node: pos[node][0])
+    pos = get_horizontal_positions(database, database.get_current_graph())
+    ordered_children = sorted(children, key=lambda node: pos[uuid_key(node.uuid)])
     if ids_only:
         ordered_children = [node.uuid for node in ordered_children]
     return ordered_children
@@ -211,15 +894,64 @@ def clear_all():
     return "ok", 200
 
 
+@bp.route("/graph/cache", methods=["GET"])
+def get_graph_cache_info():
+    return jsonify({"graphs": graph_cache.info(), "layouts": layout_cache.info()})
+
+
 @bp.route("/graph/children/<transformation_hash>", methods=["GET"])
 def get_children(transformation_hash):
     if request.method == "GET":
         ids_only = request.args.get("ids_only", default=False, type=bool)
-        to_be_returned = handle_request_for_children(transformation_hash, ids_only)
-        return jsonify(to_be_returned)
+        return handle_request_for_children(transformation_hash, ids_only)
     raise NotImplementedError
 
 
+def iter_snapshot(start: int, stop: Optional[int]) -> Iterator[str]:
+    """
+    Yields the JSON encoding of the rows ``start`` to ``stop`` of the current
+    sort piece by piece: their transformations, the ordered children of every
+    row, the facts and the edges leading into the rows.
+    """
+    database = get_database()
+    hash = database.get_current_graph()
+    dumps = current_app.json.dumps
+    transformations = (database.get_current_sort() or [])[start:stop]
+    yield f'{{"transformations": {dumps(transformations)}, "children": ['
+    if database.has_normalized(hash):
+        targets = set()
+        for i, transformation in enumerate(transformations):
+            uuids = database.load_children_uuids(hash, str(transformation.hash))
+            node_data = database.load_node_data(hash, uuids)
+            targets.update(uuids)
+            yield (", " if i else "") + f"[{', '.join(node_data[uuid] for uuid in uuids)}]"
+        topology = database.load_topology(hash)
+        facts = next((u for u, d in topology.in_degree() if d == 0), None)
+        facts_data = database.load_node_data(hash, [facts]).get(facts, "null") if facts is not None else "null"
+        edges = [{"src": source, "tgt": target, "style": "solid"}
+                 for source, target in database.load_edges(hash)
+                 if target in targets]
+    else:
+        targets = set()
+        for i, transformation in enumerate(transformations):
+            children = handle_request_for_children_from_graph(str(transformation.hash), False)
+            targets.update(uuid_key(node.uuid) for node in children)
+            yield (", " if i else "") + dumps(children)
+        graph = database.load()
+        facts_data = dumps(get_start_node_from_graph(graph)) if graph.number_of_nodes() > 0 else "null"
+        edges = [edge for edge in get_src_tgt_mapping_from_graph()
+                 if uuid_key(edge["tgt"]) in targets]
+    yield f'], "facts": {facts_data}, "edges": {dumps(edges)}}}'
+
+
+@bp.route("/graph/snapshot", methods=["GET"])
+def get_snapshot():
+    start = request.args.get("start", default=0, type=int)
+    stop = request.args.get("stop", default=None, type=int)
+    return current_app.response_class(stream_with_context(iter_snapshot(start, stop)),
+                                      mimetype="application/json")
+
+
 def get_src_tgt_mapping_from_graph(shown_recursive_ids=[], shown_clingraph=False):
     graph = get_graph()
 
@@ -230,9 +962,9 @@ def get_src_tgt_mapping_from_graph(shown_recursive_ids=[], shown_clingraph=False
                             "tgt": target.uuid,
                             "style": "solid"})
 
+    index = get_graph_index()
     for recursive_uuid in shown_recursive_ids:
-        # get node from graph where node attribute uuid is uuid
-        node = next(n for n in graph.nodes if n.uuid == recursive_uuid)
+        node = index.nodes[uuid_key(recursive_uuid)]
         for source, target in node.recursive.edges:
             to_be_added.append({"src": source.uuid,
                                 "tgt": target.uuid,
@@ -260,11 +992,21 @@ def get_src_tgt_mapping_from_graph(shown_recursive_ids=[], shown_clingraph=False
 
 
 def find_reason_by_uuid(symbolid, nodeid):
+    database = get_database()
+    hash = database.get_current_graph()
+    if database.has_normalized(hash):
+        reasonids = database.load_reason_uuids(hash, uuid_key(nodeid),
+                                               uuid_key(symbolid))
+        if reasonids is None:
+            abort(Response(f"No symbol with uuid {symbolid} in node {nodeid}.", 404))
+        return reasonids
     node = find_node_by_uuid(nodeid)
 
-    symbolstr = str(
-        getattr(next(filter(lambda x: x.uuid == symbolid, node.diff)),
-                "symbol", ""))
+    symbol = get_graph_index().diff_symbols.get(
+        (uuid_key(node.uuid), uuid_key(symbolid)))
+    if symbol is None:
+        abort(Response(f"No symbol with uuid {symbolid} in node {nodeid}.", 404))
+    symbolstr = str(getattr(symbol, "symbol", ""))
     reasonids = [
         getattr(r, "uuid", "")
         for r in node.reason.get(symbolstr, [])
@@ -278,6 +1020,8 @@ def get_possible_transformation_orders():
         if request.json is None:
             return jsonify({'error': 'Missing JSON in request'}), 400
         hash = request.json["hash"]
+        if not get_database().is_ready(hash):
+            return jsonify({'error': 'Sort is not ready yet'}), 409
         set_current_graph(hash)
         return "ok", 200
     elif request.method == "GET":
@@ -286,6 +1030,12 @@ def get_possible_transformation_orders():
     raise NotImplementedError
 
 
+@bp.route("/graph/sorts/status", methods=["GET"])
+def get_sort_status():
+    return jsonify([{"hash": hash, "ready": ready}
+                    for hash, ready in get_database().load_sort_status()])
+
+
 @bp.route("/graph/transformations", methods=["GET"])
 def get_all_transformations():
     response = get_database().get_current_sort()
@@ -310,29 +1060,25 @@ def get_edges():
 
 @bp.route("/graph/transformation/<uuid>", methods=["GET"])
 def get_rule(uuid):
-    graph = get_graph()
-    for _, _, edge in graph.edges(data=True):
-        transformation: Transformation = edge["transformation"]
-        if str(transformation.id) == str(uuid):
-            return jsonify(transformation)
-    abort(404)
+    transformation = get_graph_index().transformations_by_id.get(str(uuid))
+    if transformation is None:
+        abort(404)
+    return jsonify(transformation)
 
 
 @bp.route("/graph/model/<uuid>", methods=["GET"])
 def get_node(uuid):
-    graph = get_graph()
-    for node in graph.nodes():
-        if node.uuid == uuid:
-            return jsonify(node)
-    abort(400)
+    node = get_graph_index().nodes.get(uuid)
+    if node is None:
+        abort(400)
+    return negotiated_response(node)
 
 
 @bp.route("/graph/facts", methods=["GET"])
 def get_facts():
     graph = get_graph()
     facts = get_start_node_from_graph(graph)
-    r = jsonify(facts)
-    return r
+    return negotiated_response(facts)
 
 
 @bp.route("/graph", methods=["POST", "GET", "DELETE"])
@@ -343,6 +1089,7 @@ def entire_graph():
         data = request.json['data']
         hash = request.json['hash']
         sort = request.json['sort']
+        stop_background_sorts()
         save_graph(data, hash, sort)
         return jsonify({'message': 'ok'}), 200
     elif request.method == "GET":
@@ -358,6 +1105,20 @@ def save_graph(data: DiGraph, hash: str, sort: str):
     database = get_database()
     database.save(data, hash, sort)
 
+
+def set_pending_sorts(hashes: List[str]):
+    get_database().set_pending_sorts(hashes)
+
+
+def ensure_current_graph_is_ready(hash: str):
+    """
+    Switches to the graph of the given sort, if the current one is still
+    being computed.
+    """
+    database = get_database()
+    if not database.is_ready(database.get_current_graph()):
+        database.set_current_graph(hash)
+
 def save_clingraph(filename: str):
     database = get_database()
     database.save_clingraph(filename)
@@ -373,6 +1134,13 @@ def load_clingraph_names():
 
 def get_atoms_in_path_by_signature(uuid: str):
     signature_to_atom_mapping = defaultdict(set)
+    database = get_database()
+    hash = database.get_current_graph()
+    if database.has_normalized(hash):
+        for name, arity, symbol in database.load_node_symbols(hash, uuid_key(uuid)):
+            signature_to_atom_mapping[Signature(name, arity)].add(parse_term(symbol))
+        return [(s, signature_to_atom_mapping[s])
+                for s in signature_to_atom_mapping.keys()]
     node = find_node_by_uuid(uuid)
     for s in node.atoms:
         signature = Signature(s.symbol.name, len(s.symbol.arguments))
@@ -382,24 +1150,23 @@ def get_atoms_in_path_by_signature(uuid: str):
 
 
 def find_node_by_uuid(uuid: str) -> Node:
-    graph = get_graph()
-    matching_nodes = [x for x, _ in graph.nodes(data=True) if x.uuid == uuid]
-
-    if len(matching_nodes) != 1:
-        for node in graph.nodes():
-            if node.recursive is not False:
-                matching_nodes = [x for x, _ in node.recursive.nodes(data=True) if x.uuid == uuid]
-                if len(matching_nodes) == 1:
-                    return matching_nodes[0]
+    node = get_graph_index().find_node(uuid_key(uuid))
+    if node is None:
         abort(Response(f"No node with uuid {uuid}.", 404))
-    return matching_nodes[0]
+    return node
 
 
 def get_kind(uuid: str) -> str:
-    graph = get_graph()
+    database = get_database()
+    hash = database.get_current_graph()
+    if database.has_normalized(hash):
+        kind = database.load_node_kind(hash, uuid_key(uuid))
+        if kind is None:
+            abort(Response(f"No node with uuid {uuid}.", 404))
+        return kind
+    graph, index = database.load_with_index()
     node = find_node_by_uuid(uuid)
-    recursive = is_recursive(node, graph)
-    if recursive:
+    if uuid_key(node.uuid) not in index.nodes:
         return "Model"
     if len(graph.out_edges(node)) == 0:
         return "Stable Model"
@@ -415,7 +1182,7 @@ def model(uuid):
         abort(Response("Parameter 'key' required.", 400))
     kind = get_kind(uuid)
     path = get_atoms_in_path_by_signature(uuid)
-    return jsonify((kind, path))
+    return negotiated_response((kind, path))
 
 
 @bp.route("/detail/explain/<uuid>")
@@ -439,6 +1206,10 @@ def get_all_signatures(graph: nx.Graph):
 def search():
     if "q" in request.args.keys():
         query = request.args["q"]
+        database = get_database()
+        hash = database.get_current_graph()
+        if database.has_normalized(hash):
+            return search_normalized(database, hash, query)
         graph = get_graph()
         result = []
         signatures = get_all_signatures(graph)
@@ -454,6 +1225,20 @@ def search():
     return jsonify([])
 
 
+def search_normalized(database: GraphAccessor, hash: str, query: str,
+                      limit: int = 10) -> Response:
+    encoded = [
+        current_app.json.dumps(signature)
+        for signature in database.search_signatures(hash)
+    ]
+    if len(encoded) < limit:
+        encoded.extend(database.search_nodes(hash, query, limit - len(encoded)))
+    if len(encoded) < limit:
+        encoded.extend(
+            database.search_transformations(hash, query, limit - len(encoded)))
+    return json_list_response(encoded[:limit])
+
+
 @bp.route("/graph/clingraph/<uuid>", methods=["GET"])
 def get_image(uuid):
     # check if file with name uuid exists in static folder
@@ -1,5 +1,8 @@
+from hashlib import sha1
+from os import stat
 from os.path import join, dirname, abspath
-from typing import Set, List
+from threading import RLock
+from typing import Dict, Set, List, Optional, Tuple
 from uuid import UUID
 
 from ..shared.defaults import PROGRAM_STORAGE_PATH
@@ -7,31 +10,124 @@ from ..shared.event import Event, subscribe
 from ..shared.model import ClingoMethodCall
 
 
+class StoredProgram:
+    """
+    A program file kept in memory. Additions are appended to the chunks and
+    folded into the hash of the content, the text is joined when it is read.
+    """
+
+    def __init__(self, text: str = ""):
+        self.chunks: List[str] = [text]
+        self.text: Optional[str] = text
+        self.lines: Optional[Tuple[str, ...]] = None
+        self.hash = sha1(text.encode())
+        # size and modification time of the file when it was last written or read
+        self.stat: Optional[Tuple[int, int]] = None
+
+    def append(self, program: str):
+        self.chunks.append(program)
+        self.text = None
+        self.lines = None
+        self.hash.update(program.encode())
+
+    def get_text(self) -> str:
+        if self.text is None:
+            self.text = "".join(self.chunks)
+            self.chunks = [self.text]
+        return self.text
+
+    def get_lines(self) -> Tuple[str, ...]:
+        if self.lines is None:
+            self.lines = tuple(self.get_text().split("\n"))
+        return self.lines
+
+
+def file_stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        result = stat(path)
+    except FileNotFoundError:
+        return None
+    return result.st_size, result.st_mtime_ns
+
+
+# the stored programs by path, shared by all ProgramDatabases of the process
+programs: Dict[str, StoredProgram] = {}
+programs_lock = RLock()
+
+
 class ProgramDatabase:
+    """
+    The program of the replayed calls. It is kept in memory and persisted to
+    a file, which additions are appended to. Changes of the file by others are
+    noticed by its size and modification time, and make it be read again.
+    """
+
     def __init__(self, path=PROGRAM_STORAGE_PATH):
         self.path: str = join(dirname(abspath(__file__)), path)
 
-    def get_program(self):
-        prg = ""
-        try:
-            with open(self.path, "r", encoding="utf-8") as f:
-                prg = "".join(f.readlines())
-        except FileNotFoundError:
-            self.save_program("")
-        return prg
+    def load(self) -> StoredProgram:
+        with programs_lock:
+            stored = programs.get(self.path)
+            current = file_stat(self.path)
+            if current is None:
+                return self.save_program("")
+            if stored is None or stored.stat != current:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    stored = StoredProgram(f.read())
+                stored.stat = current
+                programs[self.path] = stored
+            return stored
+
+    def get_program(self) -> str:
+        with programs_lock:
+            return self.load().get_text()
+
+    def get_lines(self) -> Tuple[str, ...]:
+        """
+        Returns the lines of the program, split only after it changed. The
+        lines are used while encoding rules, so once the program is in memory
+        the file is not checked. Changes by others are noticed by the next
+        call of the other getters.
+        """
+        with programs_lock:
+            stored = programs.get(self.path)
+            if stored is None:
+                stored = self.load()
+            return stored.get_lines()
+
+    def get_hash(self) -> str:
+        """
+        Returns the sha1 hex digest of the program, without hashing it again.
+        """
+        with programs_lock:
+            return self.load().hash.hexdigest()
+
+    def get_program_and_hash(self) -> Tuple[str, str]:
+        """
+        Returns the program together with its hash, both of the same version.
+        """
+        with programs_lock:
+            stored = self.load()
+            return stored.get_text(), stored.hash.hexdigest()
 
     def add_to_program(self, program: str):
-        current = self.get_program()
-        current = current + program
-        self.save_program(current)
+        with programs_lock:
+            stored = self.load()
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(program)
+            stored.append(program)
+            stored.stat = file_stat(self.path)
 
-    def save_program(self, program: str):
-        with open(self.path, "w", encoding="utf-8") as f:
-            f.write(program)#.split("\n"))
+    def save_program(self, program: str) -> StoredProgram:
+        with programs_lock:
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(program)
+            stored = programs[self.path] = StoredProgram(program)
+            stored.stat = file_stat(self.path)
+            return stored
 
     def clear_program(self):
-        with open(self.path, "w", encoding="utf-8") as f:
-            f.write("")
+        self.save_program("")
 
 
 class CallCenter:
@@ -1,8 +1,14 @@
+import atexit
+
 from flask import Flask
 from werkzeug.utils import find_modules, import_string
 
 from flask_cors import CORS
 from viasp.shared.io import DataclassJSONProvider
+from viasp.shared.defaults import DEFAULT_PATH_WORKERS, DEFAULT_SORT_WORKERS, DEFAULT_GRAPH_FORMAT, \
+    WIRE_FORMAT_HEADER, PATH_POOL_EXTENSION
+from viasp.server.blueprints.dag_api import get_pool
+from viasp.asp.justify import make_path_pool
 
 
 def register_blueprints(app):
@@ -14,12 +20,27 @@ def register_blueprints(app):
     return None
 
 
-def create_app():
+def create_app(workers: int = DEFAULT_PATH_WORKERS):
     app = Flask('api',static_url_path='/static', static_folder='/static')
     app.json = DataclassJSONProvider(app)
     app.config['CORS_HEADERS'] = 'Content-Type'
+    # number of processes used to build the paths of the marked models
+    app.config['PATH_WORKERS'] = workers
+    if workers > 1:
+        # the processes live as long as the app, so they start only once
+        pool = make_path_pool(workers)
+        app.extensions[PATH_POOL_EXTENSION] = pool
+        atexit.register(pool.shutdown, wait=True)
+    # number of threads building the graphs of all but the first sort,
+    # 0 builds them before show returns
+    app.config['SORT_WORKERS'] = DEFAULT_SORT_WORKERS
+    # encoding of stored graphs, "binary" or "json"
+    app.config['GRAPH_FORMAT'] = DEFAULT_GRAPH_FORMAT
 
     register_blueprints(app)
-    CORS(app, resources={r"/*": {"origins": "*"}}, max_age=3600)
+    # open the graph storage and migrate its schema once, before any request
+    get_pool()
+    # the frontend reads the wire format header to decode interned responses
+    CORS(app, resources={r"/*": {"origins": "*"}}, max_age=3600, expose_headers=[WIRE_FORMAT_HEADER])
 
     return app
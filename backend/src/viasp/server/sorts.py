@@ -0,0 +1,46 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import RLock
+from typing import Callable, Dict, List, Optional
+
+
+class BackgroundSorts:
+    """
+    The sorts whose graphs show builds in threads, shared by the blueprints:
+    show starts them and every change of the graphs stops them first. The
+    lock is held while sorts are started or stopped.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.futures: Dict[str, Future] = {}
+        self.on_stop: Optional[Callable[[], None]] = None
+
+    def start(self, workers: int, on_stop: Optional[Callable[[], None]] = None) -> None:
+        """
+        Starts the threads of the sorts, on_stop is called once they are stopped.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.on_stop = on_stop
+
+    def submit(self, hash: str, fn: Callable, *args) -> None:
+        assert self.executor is not None, "Sorts are submitted after they are started."
+        self.futures[hash] = self.executor.submit(fn, *args)
+
+    def stop(self) -> List[str]:
+        """
+        Cancels the sorts that have not started yet and waits for the running
+        ones. Returns the hashes of the cancelled sorts.
+        """
+        cancelled = [hash for hash, future in self.futures.items() if future.cancel()]
+        self.futures = {}
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.on_stop is not None:
+            self.on_stop()
+            self.on_stop = None
+        return cancelled
+
+
+background_sorts = BackgroundSorts()
@@ -25,11 +25,12 @@ from viasp import clingoApiClient
 from viasp.shared.defaults import (DEFAULT_BACKEND_HOST, DEFAULT_BACKEND_PORT,
                                    DEFAULT_BACKEND_PROTOCOL, CLINGRAPH_PATH,
                                    GRAPH_PATH, PROGRAM_STORAGE_PATH,
-                                   STDIN_TMP_STORAGE_PATH, COLOR_PALETTE_PATH)
+                                   STDIN_TMP_STORAGE_PATH, COLOR_PALETTE_PATH,
+                                   DEFAULT_PATH_WORKERS)
 
 
 
-def run(host=DEFAULT_BACKEND_HOST, port=DEFAULT_BACKEND_PORT):
+def run(host=DEFAULT_BACKEND_HOST, port=DEFAULT_BACKEND_PORT, workers=DEFAULT_PATH_WORKERS):
     """ create the dash app, set layout and start the backend on host:port """
 
     # if running in binder, get proxy information
@@ -51,7 +52,8 @@ def run(host=DEFAULT_BACKEND_HOST, port=DEFAULT_BACKEND_PORT):
     else:
         backend_url = f"{DEFAULT_BACKEND_PROTOCOL}://{host}:{port}"
 
-    command = ["viasp_server", "--host", host, "--port", str(port)]
+    command = ["viasp_server", "--host", host, "--port", str(port),
+               "--workers", str(workers)]
 
     # if 'ipykernel_launcher.py' in sys.argv[0]:
     #     display_refresh_button()
@@ -95,7 +97,8 @@ def run(host=DEFAULT_BACKEND_HOST, port=DEFAULT_BACKEND_PORT):
         """
         if os.path.exists(CLINGRAPH_PATH):
             shutil.rmtree(CLINGRAPH_PATH)
-        for file in [GRAPH_PATH, PROGRAM_STORAGE_PATH, STDIN_TMP_STORAGE_PATH]:
+        for file in [GRAPH_PATH, f"{GRAPH_PATH}-wal", f"{GRAPH_PATH}-shm",
+                     PROGRAM_STORAGE_PATH, STDIN_TMP_STORAGE_PATH]:
             if os.path.exists(file):
                 os.remove(file)
 
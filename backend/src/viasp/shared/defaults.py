@@ -14,3 +14,17 @@ CLINGRAPH_PATH = os.path.join(STATIC_PATH, "clingraph")
 PROGRAM_STORAGE_PATH = SHARED_PATH / "prg.lp"
 STDIN_TMP_STORAGE_PATH = SHARED_PATH / "viasp_stdin_tmp.lp"
 COLOR_PALETTE_PATH = SERVER_PATH / "colorPalette.json"
+GRAPH_CACHE_SIZE = 8
+GRAPH_POOL_SIZE = 8
+GRAPH_POOL_CACHE_KIB = 65536
+DEFAULT_PATH_WORKERS = 1
+# key of the process pool building the paths in the extensions of the app
+PATH_POOL_EXTENSION = "viasp_path_pool"
+DEFAULT_SORT_WORKERS = 2
+# the number of sorts offered for a program; of programs with more sorts,
+# only the greedy sort and the first ones networkx enumerates are offered
+DEFAULT_MAX_SORTS = 64
+REIFY_CACHE_SIZE = 1024
+SHOW_EVENT_KEEPALIVE = 15
+DEFAULT_GRAPH_FORMAT = "binary"
+WIRE_FORMAT_HEADER = "X-Viasp-Format"
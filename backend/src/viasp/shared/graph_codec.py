@@ -0,0 +1,316 @@
+"""
+A compact binary encoding of graphs, used as an alternative to JSON when
+storing them.
+
+Every distinct string, symbol, symbol identifier and transformation is
+written once into a table and referenced by its index afterwards. Symbols
+are interned together with their arguments, uuids are stored as 16 bytes
+and integers as variable-length integers. Decoding yields the same objects
+as decoding the JSON encoding of the graph.
+
+Layout::
+
+    MAGIC
+    strings          count, (length, utf-8 bytes)*
+    symbols          count, (tag, payload)*
+    identifiers      count, (symbol, has_reason, uuid)*
+    transformations  count, (id, hash, rule count, rules*)*
+    graph            node count, nodes*, edge count, (source, target, transformation + 1)*
+
+Graphs with parts that cannot be encoded raise an UnsupportedGraphError.
+"""
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
+from uuid import UUID
+
+import clingo
+import networkx as nx
+from clingo import Symbol, SymbolType
+
+from .io import get_transformation_source
+from .model import Node, SymbolIdentifier, Transformation
+
+MAGIC = b"VIASPG\x01"
+
+NUMBER, STRING, FUNCTION, INFIMUM, SUPREMUM = range(5)
+
+_DOUBLE = struct.Struct("<d")
+
+
+class UnsupportedGraphError(TypeError):
+    """Raised for graphs with parts that the binary encoding cannot represent."""
+
+
+class Writer:
+    """
+    Collects the tables and the encoded graph.
+    """
+
+    def __init__(self):
+        self.strings: Dict[str, int] = {}
+        self.symbols: Dict[Symbol, int] = {}
+        self.identifiers: Dict[Tuple[Any, ...], int] = {}
+        self.transformations: Dict[Tuple[int, str], int] = {}
+        self.string_table = bytearray()
+        self.symbol_table = bytearray()
+        self.identifier_table = bytearray()
+        self.transformation_table = bytearray()
+        self.body = bytearray()
+
+    def string(self, value: str) -> int:
+        index = self.strings.get(value)
+        if index is None:
+            encoded = value.encode()
+            write_uint(self.string_table, len(encoded))
+            self.string_table += encoded
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def symbol(self, symbol: Symbol) -> int:
+        index = self.symbols.get(symbol)
+        if index is not None:
+            return index
+        if not isinstance(symbol, Symbol):
+            raise UnsupportedGraphError(f"Cannot encode {type(symbol)} as a symbol")
+        out = bytearray()
+        if symbol.type == SymbolType.Number:
+            out.append(NUMBER)
+            write_int(out, symbol.number)
+        elif symbol.type == SymbolType.String:
+            out.append(STRING)
+            write_uint(out, self.string(symbol.string))
+        elif symbol.type == SymbolType.Function:
+            arguments = [self.symbol(argument) for argument in symbol.arguments]
+            out.append(FUNCTION)
+            write_uint(out, self.string(symbol.name))
+            out.append(symbol.positive)
+            write_uint(out, len(arguments))
+            for argument in arguments:
+                write_uint(out, argument)
+        elif symbol.type == SymbolType.Infimum:
+            out.append(INFIMUM)
+        else:
+            out.append(SUPREMUM)
+        self.symbol_table += out
+        index = self.symbols[symbol] = len(self.symbols)
+        return index
+
+    def identifier(self, identifier: SymbolIdentifier) -> int:
+        if not isinstance(identifier, SymbolIdentifier):
+            raise UnsupportedGraphError(f"Cannot encode {type(identifier)} as a symbol identifier")
+        uuid = uuid_bytes(identifier.uuid)
+        key = (identifier.symbol, identifier.has_reason, uuid)
+        index = self.identifiers.get(key)
+        if index is None:
+            symbol = self.symbol(identifier.symbol)
+            write_uint(self.identifier_table, symbol)
+            self.identifier_table.append(bool(identifier.has_reason))
+            self.identifier_table += uuid
+            index = self.identifiers[key] = len(self.identifiers)
+        return index
+
+    def transformation(self, transformation: Transformation) -> int:
+        if not isinstance(transformation, Transformation):
+            raise UnsupportedGraphError(f"Cannot encode {type(transformation)} as a transformation")
+        key = (transformation.id, str(transformation.hash))
+        index = self.transformations.get(key)
+        if index is None:
+            rules = [self.string(rule) for rule in get_transformation_source(transformation)]
+            out = self.transformation_table
+            write_int(out, transformation.id)
+            write_uint(out, self.string(str(transformation.hash)))
+            write_uint(out, len(rules))
+            for rule in rules:
+                write_uint(out, rule)
+            index = self.transformations[key] = len(self.transformations)
+        return index
+
+    def graph(self, graph: nx.DiGraph) -> None:
+        if len(graph.graph) > 0:
+            raise UnsupportedGraphError("Cannot encode graph attributes")
+        out = self.body
+        positions: Dict[Node, int] = {}
+        write_uint(out, graph.number_of_nodes())
+        for position, node in enumerate(graph.nodes):
+            positions[node] = position
+            self.node(node)
+        write_uint(out, graph.number_of_edges())
+        for u, v, data in graph.edges(data=True):
+            if len(data.keys() - {"transformation"}) > 0:
+                raise UnsupportedGraphError(f"Cannot encode edge attributes {list(data)}")
+            write_uint(out, positions[u])
+            write_uint(out, positions[v])
+            transformation = data.get("transformation")
+            write_uint(out, 0 if transformation is None else self.transformation(transformation) + 1)
+
+    def node(self, node: Node) -> None:
+        if not isinstance(node, Node):
+            raise UnsupportedGraphError(f"Cannot encode {type(node)} as a node")
+        diff = [self.identifier(s) for s in node.diff]
+        atoms = [self.identifier(s) for s in node.atoms]
+        reason = [(self.string(str(key)),
+                   [0 if r is None else self.identifier(r) + 1 for r in reasons])
+                  for key, reasons in node.reason.items()]
+        out = self.body
+        out += uuid_bytes(node.uuid)
+        write_int(out, node.rule_nr)
+        out += _DOUBLE.pack(node.space_multiplier)
+        for identifiers in (diff, atoms):
+            write_uint(out, len(identifiers))
+            for identifier in identifiers:
+                write_uint(out, identifier)
+        write_uint(out, len(reason))
+        for key, reasons in reason:
+            write_uint(out, key)
+            write_uint(out, len(reasons))
+            for r in reasons:
+                write_uint(out, r)
+        if node.recursive is False:
+            out.append(0)
+        else:
+            out.append(1)
+            self.graph(node.recursive)
+
+    def getvalue(self) -> bytes:
+        result = bytearray(MAGIC)
+        for count, table in ((len(self.strings), self.string_table),
+                             (len(self.symbols), self.symbol_table),
+                             (len(self.identifiers), self.identifier_table),
+                             (len(self.transformations), self.transformation_table)):
+            write_uint(result, count)
+            result += table
+        result += self.body
+        return bytes(result)
+
+
+class Reader:
+    """
+    Reads the tables and decodes the graph.
+    """
+
+    def __init__(self, data: bytes):
+        if not data.startswith(MAGIC):
+            raise ValueError("Not an encoded graph")
+        self.data = memoryview(data)
+        self.offset = len(MAGIC)
+        # symbols and identifiers refer to earlier entries of the tables
+        self.strings: List[str] = [self.read_string() for _ in range(self.uint())]
+        self.symbols: List[Symbol] = []
+        for _ in range(self.uint()):
+            self.symbols.append(self.read_symbol())
+        self.identifiers: List[SymbolIdentifier] = [
+            self.read_identifier() for _ in range(self.uint())]
+        self.transformations: List[Transformation] = [
+            self.read_transformation() for _ in range(self.uint())]
+
+    def uint(self) -> int:
+        result, shift = 0, 0
+        data = self.data
+        while True:
+            byte = data[self.offset]
+            self.offset += 1
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def int(self) -> int:
+        value = self.uint()
+        return (value >> 1) ^ -(value & 1)
+
+    def byte(self) -> int:
+        self.offset += 1
+        return self.data[self.offset - 1]
+
+    def bytes(self, length: int) -> bytes:
+        self.offset += length
+        return bytes(self.data[self.offset - length:self.offset])
+
+    def read_string(self) -> str:
+        return self.bytes(self.uint()).decode()
+
+    def read_symbol(self) -> Symbol:
+        tag = self.byte()
+        if tag == NUMBER:
+            return clingo.Number(self.int())
+        if tag == STRING:
+            return clingo.String(self.strings[self.uint()])
+        if tag == FUNCTION:
+            name = self.strings[self.uint()]
+            positive = bool(self.byte())
+            arguments = [self.symbols[self.uint()] for _ in range(self.uint())]
+            return clingo.Function(name, arguments, positive)
+        if tag == INFIMUM:
+            return clingo.Infimum
+        if tag == SUPREMUM:
+            return clingo.Supremum
+        raise ValueError(f"Unknown symbol tag {tag}")
+
+    def read_identifier(self) -> SymbolIdentifier:
+        symbol = self.symbols[self.uint()]
+        has_reason = bool(self.byte())
+        return SymbolIdentifier(symbol, has_reason, self.bytes(16).hex())  # type: ignore
+
+    def read_transformation(self) -> Transformation:
+        id = self.int()
+        hash = self.strings[self.uint()]
+        rules = [self.strings[self.uint()] for _ in range(self.uint())]
+        return Transformation(id, rules, hash)  # type: ignore
+
+    def read_graph(self) -> nx.DiGraph:
+        graph = nx.DiGraph()
+        nodes = [self.read_node() for _ in range(self.uint())]
+        graph.add_nodes_from(nodes)
+        for _ in range(self.uint()):
+            u, v, transformation = self.uint(), self.uint(), self.uint()
+            if transformation == 0:
+                graph.add_edge(nodes[u], nodes[v])
+            else:
+                graph.add_edge(nodes[u], nodes[v],
+                               transformation=self.transformations[transformation - 1])
+        return graph
+
+    def read_identifiers(self) -> frozenset:
+        identifiers = self.identifiers
+        return frozenset(identifiers[self.uint()] for _ in range(self.uint()))
+
+    def read_node(self) -> Node:
+        uuid = self.bytes(16).hex()
+        rule_nr = self.int()
+        space_multiplier = _DOUBLE.unpack_from(self.data, self.offset)[0]
+        self.offset += _DOUBLE.size
+        diff = self.read_identifiers()
+        atoms = self.read_identifiers()
+        reason: Dict[str, List[Optional[SymbolIdentifier]]] = {}
+        for _ in range(self.uint()):
+            key = self.strings[self.uint()]
+            reason[key] = [None if r == 0 else self.identifiers[r - 1]
+                           for r in (self.uint() for _ in range(self.uint()))]
+        recursive: Union[bool, nx.DiGraph] = self.read_graph() if self.byte() else False
+        return Node(diff, rule_nr, atoms, reason, recursive, space_multiplier, uuid)  # type: ignore
+
+
+def write_uint(out: bytearray, value: int) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def write_int(out: bytearray, value: int) -> None:
+    write_uint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+
+
+def uuid_bytes(uuid: Union[UUID, str]) -> bytes:
+    return uuid.bytes if isinstance(uuid, UUID) else UUID(hex=uuid).bytes
+
+
+def encode_graph(graph: nx.DiGraph) -> bytes:
+    writer = Writer()
+    writer.graph(graph)
+    return writer.getvalue()
+
+
+def decode_graph(data: bytes) -> nx.DiGraph:
+    reader = Reader(data)
+    return reader.read_graph()
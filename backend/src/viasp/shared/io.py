@@ -5,7 +5,7 @@ from json import JSONDecoder, JSONEncoder
 # from enum import IntEnum
 from flask.json.provider import JSONProvider
 from dataclasses import is_dataclass
-from typing import Union, Collection, Iterable, Sequence, cast
+from typing import Any, Dict, List, Optional, Union, Collection, Iterable, Sequence, cast
 from pathlib import PosixPath
 from uuid import UUID
 import os
@@ -14,6 +14,7 @@ import importlib.util
 
 
 import inspect
+from functools import partial
 import base64
 import types
 
@@ -40,49 +41,77 @@ def model_to_json(model: Union[clingo_Model, Collection[clingo_Model]], *args, *
     return json.dumps(model, *args, cls=DataclassJSONEncoder, **kwargs)
 
 
-def object_hook(obj):
-    if '_type' not in obj:
+def decode_function(obj, symbols: Dict[Any, Symbol]) -> Symbol:
+    # the arguments come out of the same memo, so their ids identify them and
+    # the key is hashed without hashing symbols
+    arguments = obj.get("arguments", ())
+    positive = obj.get("positive", True)
+    key = (obj["name"], positive, *map(id, arguments))
+    symbol = symbols.get(key)
+    if symbol is None:
+        symbol = symbols[key] = clingo.Function(obj["name"], arguments, positive)
+    return symbol
+
+
+def decode_number(obj, symbols: Dict[Any, Symbol]) -> Symbol:
+    number = obj["number"]
+    symbol = symbols.get(number)
+    if symbol is None:
+        symbol = symbols[number] = clingo.Number(number)
+    return symbol
+
+
+def decode_string(obj, symbols: Dict[Any, Symbol]) -> Symbol:
+    string = obj["string"]
+    symbol = symbols.get(string)
+    if symbol is None:
+        symbol = symbols[string] = clingo.String(string)
+    return symbol
+
+
+def decode_node(obj, symbols) -> Node:
+    obj['atoms'] = frozenset(obj['atoms'])
+    obj['diff'] = frozenset(obj['diff'])
+    return Node(**obj)
+
+
+DECODERS = {
+    "Function": decode_function,
+    "Number": decode_number,
+    "String": decode_string,
+    "Infimum": lambda obj, symbols: clingo.Infimum,
+    "Supremum": lambda obj, symbols: clingo.Supremum,
+    "SymbolIdentifier": lambda obj, symbols: SymbolIdentifier(**obj),
+    "Node": decode_node,
+    "ClingraphNode": lambda obj, symbols: ClingraphNode(**obj),
+    "Transformation": lambda obj, symbols: Transformation(**obj),
+    "Signature": lambda obj, symbols: Signature(**obj),
+    "Graph": lambda obj, symbols: nx.node_link_graph(obj["_graph"]),
+    "StableModel": lambda obj, symbols: StableModel(**obj),
+    "ModelType": lambda obj, symbols: ModelType.StableModel,
+    "ClingoMethodCall": lambda obj, symbols: ClingoMethodCall(**obj),
+    "Transformer": lambda obj, symbols: reconstruct_transformer(obj),
+}
+
+
+def object_hook(obj, symbols: Optional[Dict[Any, Symbol]] = None):
+    t = obj.pop('_type', None)
+    if t is None:
         return obj
-    t = obj['_type']
-    del obj['_type']
-    if t == "Function":
-        return clingo.Function(**obj)
-    elif t == "Number":
-        return clingo.Number(**obj)
-    elif t == "String":
-        return clingo.String(**obj)
-    elif t == "Infimum":
-        return clingo.Infimum
-    elif t == "Supremum":
-        return clingo.Supremum
-    elif t == "Node":
-        obj['atoms'] = frozenset(obj['atoms'])
-        obj['diff'] = frozenset(obj['diff'])
-        return Node(**obj)
-    elif t == "ClingraphNode":
-        return ClingraphNode(**obj)
-    elif t == "Transformation":
-        return Transformation(**obj)
-    elif t == "Signature":
-        return Signature(**obj)
-    elif t == "Graph":
-        return nx.node_link_graph(obj["_graph"])
-    elif t == "StableModel":
-        return StableModel(**obj)
-    elif t == "ModelType":
-        return ModelType.StableModel
-    elif t == "ClingoMethodCall":
-        return ClingoMethodCall(**obj)
-    elif t == "SymbolIdentifier":
-        return SymbolIdentifier(**obj)
-    elif t == "Transformer":
-        return reconstruct_transformer(obj)
-    return obj
+    decoder = DECODERS.get(t)
+    if decoder is None:
+        return obj
+    return decoder(obj, {} if symbols is None else symbols)
 
 
 class DataclassJSONDecoder(JSONDecoder):
+    """
+    Decodes the objects written by DataclassJSONEncoder. Equal symbols
+    decoded by one decoder are created once.
+    """
+
     def __init__(self, *args, **kwargs):
-        JSONDecoder.__init__(self, object_hook=object_hook, *args, **kwargs)
+        JSONDecoder.__init__(self, object_hook=partial(object_hook, symbols={}), *args, **kwargs)
 
 
 def dataclass_to_dict(o):
@@ -107,7 +136,7 @@ def dataclass_to_dict(o):
     elif isinstance(o, Signature):
         return {"_type": "Signature", "name": o.name, "args": o.args}
     elif isinstance(o, Transformation):
-        return {"_type": "Transformation", "id": o.id, "rules": get_rules_from_input_program(o.rules), "hash": o.hash}
+        return {"_type": "Transformation", "id": o.id, "rules": get_transformation_source(o), "hash": o.hash}
     elif isinstance(o, StableModel):
         return {"_type": "StableModel", "cost": o.cost, "optimality_proven": o.optimality_proven, "type": o.type,
                 "atoms": o.atoms, "terms": o.terms, "shown": o.shown, "theory": o.theory}
@@ -136,6 +165,66 @@ class DataclassJSONEncoder(JSONEncoder):
         return super().default(o)
 
 
+class InternedJSONEncoder(DataclassJSONEncoder):
+    """
+    Encodes symbols as indices into a table of distinct symbols, which is
+    filled while encoding. Symbol identifiers keep their shape, with the
+    index in place of the symbol, other symbols become a ``SymbolRef``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.symbol_ids: Dict[Symbol, int] = {}
+        self.symbols: List[Symbol] = []
+
+    def intern(self, symbol: Symbol) -> int:
+        id = self.symbol_ids.get(symbol)
+        if id is None:
+            id = self.symbol_ids[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return id
+
+    def default(self, o):
+        if isinstance(o, SymbolIdentifier):
+            return {"_type": "SymbolIdentifier", "symbol": self.intern(o.symbol),
+                    "has_reason": o.has_reason, "uuid": o.uuid}
+        if isinstance(o, Symbol):
+            return {"_type": "SymbolRef", "ref": self.intern(o)}
+        return super().default(o)
+
+
+def dumps_interned(obj, **kwargs) -> str:
+    """
+    Encodes obj in the interned format, ``{"symbols": [...], "data": ...}``.
+    """
+    encoder = InternedJSONEncoder(**kwargs)
+    data = encoder.encode(obj)
+    symbols = json.dumps(encoder.symbols, cls=DataclassJSONEncoder, **kwargs)
+    return f'{{"symbols": {symbols}, "data": {data}}}'
+
+
+def loads_interned(s: Union[str, bytes]):
+    """
+    Decodes the interned format written by dumps_interned.
+    """
+    interned = json.loads(s)
+    symbols = [resolve_interned(symbol, []) for symbol in interned["symbols"]]
+    return resolve_interned(interned["data"], symbols)
+
+
+def resolve_interned(obj, symbols: List[Symbol]):
+    if isinstance(obj, list):
+        return [resolve_interned(o, symbols) for o in obj]
+    if not isinstance(obj, dict):
+        return obj
+    t = obj.get("_type")
+    if t == "SymbolRef":
+        return symbols[obj["ref"]]
+    if t == "SymbolIdentifier" and isinstance(obj["symbol"], int):
+        obj["symbol"] = symbols[obj["symbol"]]
+    return object_hook({key: resolve_interned(value, symbols) for key, value in obj.items()})
+
+
 def encode_object(o):
     if isinstance(o, clingo_Model):
         x = model_to_dict(o)
@@ -258,8 +347,7 @@ def symbol_to_dict(symbol: clingo.Symbol) -> dict:
 
 def get_rules_from_input_program(rules) -> Sequence[str]:
     rules_from_input_program: Sequence[str] = []
-    db = ProgramDatabase()
-    program = db.get_program().split("\n")
+    program = ProgramDatabase().get_lines()
     for rule in rules:
         if isinstance(rule, str):
             rules_from_input_program.append(rule)
@@ -268,6 +356,10 @@ def get_rules_from_input_program(rules) -> Sequence[str]:
         begin_colu = rule.location.begin.column
         end_line = rule.location.end.line
         end_colu = rule.location.end.column
+        if end_line > len(program):
+            # not a rule of the stored program
+            rules_from_input_program.append(str(rule))
+            continue
         r = ""
         if begin_line != end_line:
             r += program[begin_line - 1][begin_colu-1:] + "\n"
@@ -279,6 +371,13 @@ def get_rules_from_input_program(rules) -> Sequence[str]:
         rules_from_input_program.append(r)
     return rules_from_input_program
 
+
+def get_transformation_source(transformation: Transformation) -> Sequence[str]:
+    if len(transformation.source) == len(transformation.rules):
+        return transformation.source
+    return get_rules_from_input_program(transformation.rules)
+
+
 def reconstruct_transformer(obj: dict) -> TransformerTransport:
     # Reconstruct the class definition
     # Get the path to the module containing MyClass
@@ -1,10 +1,11 @@
+from collections.abc import Set as AbstractSet
 from copy import copy
 from dataclasses import dataclass, field
 from enum import Enum
 from inspect import Signature as inspect_Signature
-from typing import Any, Sequence, Dict, Union, FrozenSet, Collection, List, Tuple
+from typing import Any, Sequence, Dict, Union, FrozenSet, Collection, List, Tuple, Optional, Iterator
 from types import MappingProxyType
-from uuid import UUID, uuid4
+from uuid import UUID, uuid4, uuid5
 import networkx as nx
 
 from clingo import Symbol, ModelType
@@ -30,11 +31,79 @@ class SymbolIdentifier:
         return f"{{symbol: {str(self.symbol)}, uuid: {self.uuid}}}"
 
 
+class ChainedAtoms(AbstractSet):
+    """
+    The atoms of a node, stored as the atoms of its predecessor and the symbols
+    the node adds. Only the added symbols are kept per node, the inherited ones
+    are materialized when the set is read. They get a uuid derived from the
+    owning node, so that every node has identifiers of its own.
+    """
+    __slots__ = ("added", "owner", "parent", "_len", "_hash")
+
+    def __init__(self, added: FrozenSet[SymbolIdentifier], owner: UUID,
+                 parent: Optional["ChainedAtoms"] = None):
+        self.added = added
+        self.owner = owner
+        self.parent = parent
+        self._len = len(added) + (len(parent) if parent is not None else 0)
+        self._hash: Optional[int] = None
+
+    def links(self) -> Iterator["ChainedAtoms"]:
+        link: Optional[ChainedAtoms] = self
+        while link is not None:
+            yield link
+            link = link.parent
+
+    def symbols(self) -> FrozenSet[Symbol]:
+        return frozenset(s.symbol for link in self.links() for s in link.added)
+
+    def __iter__(self) -> Iterator[SymbolIdentifier]:
+        yield from self.added
+        for link in self.links():
+            if link is self:
+                continue
+            for s in link.added:
+                yield SymbolIdentifier(s.symbol, uuid=uuid5(self.owner, str(s.symbol)))
+
+    def __contains__(self, item) -> bool:
+        return any(item in link.added for link in self.links())
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __hash__(self):
+        # the same as the hash of a frozenset of the atoms
+        if self._hash is None:
+            self._hash = hash(self.symbols())
+        return self._hash
+
+    def __eq__(self, o):
+        if self is o:
+            return True
+        if not isinstance(o, AbstractSet):
+            return NotImplemented
+        if len(self) != len(o):
+            return False
+        if isinstance(o, ChainedAtoms):
+            if hash(self) != hash(o):
+                return False
+            pairs = zip(self.links(), o.links())
+            if all(a.added == b.added for a, b in pairs) and \
+                    len(list(self.links())) == len(list(o.links())):
+                return True
+            return self.symbols() == o.symbols()
+        return self.symbols() == frozenset(
+            s.symbol if isinstance(s, SymbolIdentifier) else s for s in o)
+
+    def __repr__(self):
+        return f"ChainedAtoms({{{', '.join(map(str, self))}}})"
+
+
 @dataclass()
 class Node:
     diff: FrozenSet[SymbolIdentifier] = field(hash=True)
     rule_nr: int = field(hash=True)
-    atoms: FrozenSet[SymbolIdentifier] = field(default_factory=frozenset, hash=True)
+    atoms: AbstractSet = field(default_factory=frozenset, hash=True)
     reason: Union[
         Dict[str, List[Symbol]],
         MappingProxyType[str, List[SymbolIdentifier]]] \
@@ -81,6 +150,8 @@ class Transformation:
     id: int = field(hash=True)
     rules: Tuple[Rule, ...] = field(default_factory=tuple, hash=True) # type: ignore
     hash: str = field(default="", hash=True)
+    # the text of the rules in the input program, empty if not known yet
+    source: Tuple[str, ...] = field(default=(), hash=False, compare=False, repr=False)
 
     def __post_init__(self):
         if isinstance(self.rules, AST):
@@ -1,6 +1,7 @@
 from itertools import tee
-from typing import Any, TypeVar, Iterable, Tuple, List
-from collections import defaultdict
+from threading import RLock
+from typing import Any, TypeVar, Iterable, Tuple, List, Dict, Generic, Hashable, Optional
+from collections import defaultdict, OrderedDict
 from types import MappingProxyType
 from hashlib import sha1
 from flask import current_app
@@ -74,4 +75,63 @@ def hash_transformation_rules(rules: Tuple[Any, ...]) -> str:
         rule_str = current_app.json.dumps(rule)
         rule_hash = sha1(rule_str.encode()).hexdigest()
         hash_object.update(rule_hash.encode())
-    return hash_object.hexdigest()
\ No newline at end of file
+    return hash_object.hexdigest()
+
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    A thread-safe, size-bounded mapping that evicts the least recently used entry.
+    Keeps hit and miss counters, so that the cache can be monitored.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[K, V]" = OrderedDict()
+        self._lock = RLock()
+
+    def get(self, key: K) -> Optional[V]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: K, value: V) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: K) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key: K) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def info(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._data),
+                "maxsize": self.maxsize
+            }
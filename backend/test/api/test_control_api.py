@@ -1,3 +1,12 @@
+import json
+from threading import Event, Timer
+
+from viasp.server.blueprints.api import show_cache
+from viasp.server.blueprints.dag_api import set_pending_sorts
+from viasp.server.database import ProgramDatabase
+from viasp.server.sorts import background_sorts
+
+
 def test_add_call_endpoint(client, clingo_call_run_sample):
     bad_value = {"foo": "bar"}
     res = client.post("/control/add_call", json=bad_value)
@@ -44,3 +53,172 @@ def test_show_endpoint(client, get_clingo_stable_models):
     res = client.get("/graph")
     assert len(list(res.json.nodes)) > 0
 
+
+def test_show_reuses_paths_of_marked_models(client, get_clingo_stable_models):
+    program = "a(1..2). {b(X)} :- a(X). c(X) :- b(X)."
+    db = ProgramDatabase()
+    db.clear_program()
+    db.add_to_program(program)
+    models = get_clingo_stable_models(program)
+    client.post("/control/models", json=models[:1])
+    assert client.post("/control/show").status_code == 200
+    first_paths = dict(show_cache.sorted_programs[0].paths)
+
+    client.post("/control/models", json=models[:2])
+    assert client.post("/control/show").status_code == 200
+    paths = show_cache.sorted_programs[0].paths
+    assert len(paths) == 2
+    assert all(paths[key] is path for key, path in first_paths.items())
+    incremental = client.get("/graph").json
+
+    show_cache.key = None
+    assert client.post("/control/show").status_code == 200
+    rebuilt = client.get("/graph").json
+    assert set(incremental.nodes) == set(rebuilt.nodes)
+    assert set(incremental.edges) == set(rebuilt.edges)
+
+    client.post("/control/models", json=models[1:2])
+    assert client.post("/control/show").status_code == 200
+    assert list(show_cache.sorted_programs[0].paths) == [key for key in paths if key not in first_paths]
+
+
+def test_show_builds_remaining_sorts_in_background(client, get_clingo_stable_models):
+    program = "a(1..2). {b(X)} :- a(X). c(X) :- a(X)."
+    db = ProgramDatabase()
+    db.clear_program()
+    db.add_to_program(program)
+    client.delete("/graph")
+    client.post("/control/models", json=get_clingo_stable_models(program))
+    client.application.config["SORT_WORKERS"] = 2
+    assert client.post("/control/show").status_code == 200
+    assert all(p.reified is not None for p in show_cache.sorted_programs), \
+        "Sorts should be reified before they are built in the background."
+    status = client.get("/graph/sorts/status").json
+    assert len(status) > 1
+    assert status[0]["ready"]
+    assert client.get("/graph").status_code == 200
+    background_sorts.stop()
+
+    status = client.get("/graph/sorts/status").json
+    assert all(s["ready"] for s in status)
+    assert set(client.get("/graph/sorts").json) == {s["hash"] for s in status}
+
+
+def test_deleting_the_graph_waits_for_background_sorts(client, get_clingo_stable_models):
+    program = "a(1..2). {b(X)} :- a(X). c(X) :- a(X). d(X) :- b(X), c(X)."
+    db = ProgramDatabase()
+    db.clear_program()
+    db.add_to_program(program)
+    client.delete("/graph")
+    show_cache.key = None
+    client.post("/control/models", json=get_clingo_stable_models(program))
+    client.application.config["SORT_WORKERS"] = 2
+    assert client.post("/control/show").status_code == 200
+    client.delete("/graph")
+    client.application.config["SORT_WORKERS"] = 0
+    assert background_sorts.executor is None
+    assert client.get("/graph/sorts/status").json == [], \
+        "No sort should be saved after the graphs were deleted."
+
+
+def test_pending_sorts_are_not_offered(client_with_a_graph):
+    client, _, _, _ = client_with_a_graph
+    current, *pending = client.get("/graph/sorts").json
+    with client.application.app_context():
+        set_pending_sorts(pending)
+    assert client.get("/graph/sorts").json == [current]
+    for hash in pending:
+        res = client.post("/graph/sorts", json={"hash": hash})
+        assert res.status_code == 409
+    assert [s["hash"] for s in client.get("/graph/sorts/status").json if not s["ready"]] == pending
+    client.delete("/graph")
+
+
+def test_sorts_cancelled_by_a_new_graph_are_no_longer_pending(client_with_a_graph):
+    client, _, serializable_graphs, _ = client_with_a_graph
+    current, *offered = client.get("/graph/sorts").json
+    # a sort without a graph yet, besides the stored sorts that are built again
+    pending = [*offered, "not built"]
+    with client.application.app_context():
+        set_pending_sorts(pending)
+    started, release = Event(), Event()
+
+    def build():
+        started.set()
+        release.wait(5)
+    background_sorts.start(1)
+    background_sorts.submit("running", build)
+    for hash in pending:
+        background_sorts.submit(hash, build)
+    assert started.wait(5)
+    Timer(0.1, release.set).start()
+    graph, hash, sort, _ = serializable_graphs[0]
+    assert client.post("/graph", json={"data": graph, "hash": hash, "sort": sort}).status_code == 200
+    assert background_sorts.executor is None
+    assert client.get("/graph/sorts/status").json == []
+    assert set(client.get("/graph/sorts").json) == {current, *offered}
+    client.delete("/graph")
+
+
+def test_async_show_reports_progress(client, get_clingo_stable_models):
+    program = "a(1..2). {b(X)} :- a(X). c(X) :- a(X)."
+    db = ProgramDatabase()
+    db.clear_program()
+    db.add_to_program(program)
+    client.delete("/graph")
+    show_cache.key = None
+    models = get_clingo_stable_models(program)
+    client.post("/control/models", json=models)
+    client.application.config["SORT_WORKERS"] = 2
+    res = client.post("/control/show?async=true")
+    assert res.status_code == 202
+    job = res.json["job"]
+
+    events = client.get(f"/control/show/{job}/events")
+    assert events.mimetype == "text/event-stream"
+    progress = [json.loads(line[len("data: "):])
+                for line in events.get_data(as_text=True).splitlines()
+                if line.startswith("data: ")]
+    assert progress[-1]["status"] == "done"
+    assert progress[-1] == client.get(f"/control/show/{job}").json
+    stages = progress[-1]["stages"]
+    sorts = progress[-1]["sorts"]
+    assert len(sorts) > 1 and all(s["ready"] for s in sorts)
+    assert stages["save"] == {"done": len(sorts), "total": len(sorts)}
+    assert stages["grounding"] == {"done": len(sorts) * len(models), "total": len(sorts) * len(models)}
+    assert stages["paths"] == stages["grounding"]
+    assert stages["reasons"] == {"done": len(sorts), "total": len(sorts)}
+    assert client.get("/graph").status_code == 200
+    background_sorts.stop()
+    client.application.config["SORT_WORKERS"] = 0
+    assert client.get("/control/show/unknown").status_code == 404
+
+
+def test_equal_nodes_of_all_sorts_share_uuids(client, get_clingo_stable_models):
+    program = "a(1..2). {b(X)} :- a(X). c(X) :- a(X). d(X) :- b(X), c(X)."
+    db = ProgramDatabase()
+    db.clear_program()
+    db.add_to_program(program)
+    client.delete("/graph")
+    show_cache.key = None
+    client.post("/control/models", json=get_clingo_stable_models(program))
+    assert client.post("/control/show").status_code == 200
+
+    graphs = []
+    for hash in client.get("/graph/sorts").json:
+        assert client.post("/graph/sorts", json={"hash": hash}).status_code == 200
+        graphs.append(client.get("/graph").json)
+    assert len(graphs) > 1
+    first, *others = graphs
+    for g in others:
+        shared = [node for node in g.nodes if node in first.nodes]
+        assert len(shared) > 0
+        for node in shared:
+            pattern = next(n for n in first.nodes if n == node)
+            assert node.uuid == pattern.uuid
+            assert {s.uuid for s in node.diff} == {s.uuid for s in pattern.diff}
+        derived = {s.uuid for node in g.nodes for s in node.diff}
+        for node in g.nodes:
+            for reasons in node.reason.values():
+                assert all(r.uuid in derived for r in reasons)
+    client.delete("/graph")
@@ -1,7 +1,15 @@
+from uuid import uuid4
+
+import igraph
+import networkx as nx
 import pytest
+from clingo import Function, Number
 from networkx import node_link_data
 
-from viasp.shared.model import Node, Transformation
+from viasp.shared.io import loads_interned
+from viasp.shared.model import Node, Signature, SymbolIdentifier, Transformation
+from viasp.server.blueprints import dag_api
+from viasp.server.blueprints.dag_api import get_database, get_horizontal_positions, nx_to_igraph
 
 
 @pytest.fixture(scope="function", autouse=True)
@@ -117,3 +125,172 @@ def test_get_transformations(client_with_a_graph):
     assert res.status_code == 200
     assert type(res.json) == list
     assert len(res.json) == 2
+
+
+def test_graph_cache_is_invalidated_on_save(client, single_node_graph):
+    client.delete("graph/clear")
+    hash = "0123"
+    res = client.post("graph", json={"data": node_link_data(single_node_graph), "hash": hash, "sort": ""})
+    assert res.status_code == 200
+    uuid = list(single_node_graph.nodes)[0].uuid
+    assert client.get(f"graph/model/{uuid.hex}").status_code == 200
+    hits = client.get("graph/cache").json["graphs"]["hits"]
+    assert client.get(f"graph/model/{uuid.hex}").status_code == 200
+    assert client.get("graph/cache").json["graphs"]["hits"] == hits + 1
+
+    other = nx.DiGraph()
+    other_uuid = uuid4()
+    other.add_node(Node(frozenset(), 1, frozenset(), uuid=other_uuid))
+    res = client.post("graph", json={"data": node_link_data(other), "hash": hash, "sort": ""})
+    assert res.status_code == 200
+    assert client.get(f"graph/model/{other_uuid.hex}").status_code == 200
+    assert client.get(f"graph/model/{uuid.hex}").status_code == 400
+
+
+def test_get_unknown_transformation(client_with_a_graph):
+    client, _, _, _ = client_with_a_graph
+    res = client.get(f"/graph/transformation/1000")
+    assert res.status_code == 404
+
+
+def test_get_reasons_of_symbol(client_with_a_graph):
+    client, _, _, _ = client_with_a_graph
+    graph = client.get("/graph").json
+    found_reason = False
+    for node in graph.nodes:
+        for symbol in node.diff:
+            res = client.post("/graph/reason",
+                              json={"sourceid": symbol.uuid, "nodeid": node.uuid})
+            assert res.status_code == 200
+            expected = [getattr(r, "uuid", "") for r in node.reason.get(str(symbol.symbol), [])]
+            assert [edge["tgt"] for edge in res.json] == expected
+            found_reason = found_reason or len(expected) > 0
+    assert found_reason
+    res = client.post("/graph/reason", json={"sourceid": "unknown", "nodeid": node.uuid})
+    assert res.status_code == 404
+
+
+def test_normalized_storage_matches_json_fallback(client_with_a_graph):
+    client, analyzer, _, _ = client_with_a_graph
+    nodes = client.get("/graph").json.nodes
+
+    def collect():
+        transformations = next(analyzer.get_sorted_program())
+        children = [client.get(f"graph/children/{t.hash}").json for t in transformations]
+        children_ids = [client.get(f"graph/children/{t.hash}?ids_only=True").json
+                        for t in transformations]
+        details = [client.get(f"detail/{node.uuid}").json for node in nodes]
+        details = [(kind, sorted((str(s), sorted(map(str, atoms))) for s, atoms in path))
+                   for kind, path in details]
+        reasons = [client.post("/graph/reason", json={"sourceid": symbol.uuid, "nodeid": node.uuid}).json
+                   for node in nodes for symbol in node.diff]
+        queries = [client.get("query", query_string={"q": q}).json
+                   for q in ["a(1)", "b(X)", "j(", "j(X,  Y)", "5.\nj("]]
+        queries = [(sorted(str(r) for r in result if isinstance(r, Signature)),
+                    [r for r in result if not isinstance(r, Signature)])
+                   for result in queries]
+        snapshot = client.get("graph/snapshot").json
+        return children, children_ids, details, reasons, queries, snapshot
+
+    normalized = collect()
+    with client.application.app_context():
+        database = get_database()
+        database.delete_normalized()
+        database.conn.commit()
+        assert not database.has_normalized(database.get_current_graph())
+    assert collect() == normalized
+    # rules are matched one by one, not across the rules of a transformation
+    assert normalized[4][-1][1] == []
+
+
+def test_children_are_precomputed_in_layout_order(client_with_a_graph):
+    client, analyzer, _, _ = client_with_a_graph
+    transformations = next(analyzer.get_sorted_program())
+    layouts = client.get("graph/cache").json["layouts"]
+    children = [client.get(f"graph/children/{t.hash}?ids_only=True").json for t in transformations]
+    assert client.get("graph/cache").json["layouts"] == layouts
+    with client.application.app_context():
+        database = get_database()
+        hash = database.get_current_graph()
+        positions = get_horizontal_positions(database, hash)
+        for t, uuids in zip(transformations, children):
+            assert uuids == database.load_children_uuids(hash, str(t.hash))
+            assert [positions[u] for u in uuids] == sorted(positions[u] for u in uuids)
+
+
+def test_snapshot_matches_single_requests(client_with_a_graph):
+    client, _, _, _ = client_with_a_graph
+    transformations = client.get("graph/transformations").json
+    snapshot = client.get("graph/snapshot").json
+    assert snapshot["transformations"] == transformations
+    assert snapshot["children"] == [client.get(f"graph/children/{t.hash}").json for t in transformations]
+    assert snapshot["facts"] == client.get("graph/facts").json
+    assert snapshot["edges"] == client.get("graph/edges").json
+
+    page = client.get("graph/snapshot?start=1&stop=2").json
+    assert page["transformations"] == transformations[1:2]
+    assert page["children"] == snapshot["children"][1:2]
+    targets = {node.uuid for node in page["children"][0]}
+    assert page["edges"] == [edge for edge in snapshot["edges"] if edge["tgt"] in targets]
+
+
+def test_interned_responses_decode_to_the_plain_ones(client_with_a_graph):
+    client, analyzer, _, _ = client_with_a_graph
+    interned = {"X-Viasp-Format": "interned"}
+    nodes = client.get("/graph").json.nodes
+    urls = ["graph/facts"]
+    urls += [f"graph/children/{t.hash}" for t in next(analyzer.get_sorted_program())]
+    urls += [f"graph/model/{node.uuid}" for node in nodes]
+    urls += [f"detail/{node.uuid}" for node in nodes]
+    for url in urls:
+        plain = client.get(url)
+        assert "X-Viasp-Format" not in plain.headers
+        res = client.get(url, headers=interned)
+        assert res.status_code == 200
+        assert res.headers["X-Viasp-Format"] == "interned"
+        assert "X-Viasp-Format" in res.headers["Vary"]
+        decoded = loads_interned(res.data)
+        if url.startswith("detail"):
+            decoded = (decoded[0], [[s, sorted(atoms)] for s, atoms in decoded[1]])
+            expected = (plain.json[0], [[s, sorted(atoms)] for s, atoms in plain.json[1]])
+            assert decoded == expected
+        else:
+            assert decoded == plain.json
+
+
+def test_interned_responses_carry_every_symbol_once(client_with_a_graph):
+    client, analyzer, _, _ = client_with_a_graph
+    for t in next(analyzer.get_sorted_program()):
+        res = client.get(f"graph/children/{t.hash}", headers={"X-Viasp-Format": "interned"})
+        symbols = res.json["symbols"]
+        assert len(symbols) == len(set(map(str, symbols)))
+        assert len(res.data) <= len(client.get(f"graph/children/{t.hash}").data)
+
+
+def test_interned_children_are_smaller_when_atoms_repeat(client, monkeypatch):
+    graph = nx.DiGraph()
+    facts = [SymbolIdentifier(Function("a", [Number(i)])) for i in range(50)]
+    fact_node = Node(frozenset(facts), -1, frozenset(facts))
+    transformation = Transformation(0, (), hash="children")
+    for i in range(10):
+        diff = frozenset([SymbolIdentifier(Function("b", [Number(i)]))])
+        graph.add_edge(fact_node, Node(diff, 0, frozenset(facts) | diff), transformation=transformation)
+    with client.application.app_context():
+        database = get_database()
+        database.save(graph, "repeated", client.application.json.dumps([transformation]))
+        database.set_current_graph("repeated")
+        assert database.has_normalized("repeated")
+    # the interned response is built from the stored children, not the whole graph
+    monkeypatch.setattr(dag_api, "get_graph_index", None)
+
+    plain = client.get("graph/children/children")
+    interned = client.get("graph/children/children", headers={"X-Viasp-Format": "interned"})
+    assert interned.status_code == 200
+    assert loads_interned(interned.data) == plain.json
+    assert len(interned.data) < 0.75 * len(plain.data)
+
+
+def test_sparse_igraph_matches_adjacency_matrix():
+    graph = nx.gn_graph(30, seed=1)
+    expected = igraph.Graph.Adjacency((nx.to_numpy_array(graph) > 0).tolist())
+    assert sorted(nx_to_igraph(graph).get_edgelist()) == sorted(expected.get_edgelist())
@@ -21,12 +21,28 @@ from viasp.shared.model import ClingoMethodCall, Node, StableModel, SymbolIdenti
 from viasp.server.database import ProgramDatabase
 from viasp.shared.defaults import CLINGRAPH_PATH, GRAPH_PATH, PROGRAM_STORAGE_PATH, STDIN_TMP_STORAGE_PATH
 
+def pytest_configure(config):
+    config.addinivalue_line("markers", "benchmark: times an implementation against the one it replaced")
+
+
+def pytest_collection_modifyitems(config, items):
+    # benchmarks are slow and only run when selected with -m benchmark
+    if "benchmark" in config.getoption("markexpr"):
+        return
+    skip = pytest.mark.skip(reason="benchmarks run with -m benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip)
+
+
 def create_app_with_registered_blueprints(*bps) -> Flask:
     app = Flask(__name__)
     for bp in bps:
         app.register_blueprint(bp)
 
     app.json = DataclassJSONProvider(app)
+    # build all sorts before show returns, so tests see complete graphs
+    app.config["SORT_WORKERS"] = 0
     return app
 
 
@@ -229,7 +245,8 @@ def cleanup(request):
         import shutil
         if os.path.exists(CLINGRAPH_PATH):
             shutil.rmtree(CLINGRAPH_PATH)
-        for file in [GRAPH_PATH, PROGRAM_STORAGE_PATH, STDIN_TMP_STORAGE_PATH]:
+        for file in [GRAPH_PATH, f"{GRAPH_PATH}-wal", f"{GRAPH_PATH}-shm",
+                     PROGRAM_STORAGE_PATH, STDIN_TMP_STORAGE_PATH]:
             if os.path.exists(file):
                 os.remove(file)
 
@@ -1,5 +1,6 @@
 from clingo import Control
 from viasp.asp.justify import save_model
+from viasp.asp.reify import reify_list
 from clingo.ast import parse_string, AST, Transformer as ClingoTransformer
 
 
@@ -37,6 +38,14 @@ def get_stable_models_for_program(program):
             saved_models.append(save_model(model))
     return saved_models
 
+def reify_sorted_program(analyzer, sorted_program):
+    return reify_list(sorted_program,
+                      h=analyzer.get_conflict_free_h(),
+                      h_showTerm=analyzer.get_conflict_free_h_showTerm(),
+                      model=analyzer.get_conflict_free_model(),
+                      get_conflict_free_variable=analyzer.get_conflict_free_variable,
+                      conflict_free_showTerm=analyzer.get_conflict_free_showTerm())
+
 def parse_program_to_ast(prg: str) -> AST:
     program_base = "#program base."
     parsed = []
@@ -0,0 +1,305 @@
+"""Benchmarks of the graph construction against the implementations they replaced.
+
+The benchmarks only run when they are selected, with
+``pytest -s -m benchmark test/test_benchmarks.py``, which prints the timings.
+The other tests check that the implementations give the same results.
+"""
+import json
+import random
+from time import perf_counter
+from typing import Dict, FrozenSet, List, Sequence, Set, Tuple
+
+import clingo
+import networkx as nx
+import pytest
+from clingo.ast import AST, parse_string
+from flask import current_app
+
+from viasp.asp.justify import build_graph
+from viasp.asp.reify import ProgramAnalyzer
+from viasp.asp.utils import get_rule_positions, rank_topological_sorts, \
+    condense_dependencies, is_constraint
+from viasp.server.blueprints.dag_api import ConnectionPool, GraphAccessor
+from viasp.server.database import ProgramDatabase
+from viasp.shared.graph_codec import encode_graph, decode_graph
+from viasp.shared.model import Node, SymbolIdentifier, Transformation
+
+from helper import get_stable_models_for_program, reify_sorted_program
+
+
+def generate_rules(n: int) -> List[AST]:
+    rules: List[AST] = []
+    parse_string(" ".join(f"p{i}(X) :- q{i}(X), r(X)." for i in range(n)),
+                 rules.append)
+    return rules[1:]
+
+
+def timed(f, *args):
+    start = perf_counter()
+    result = f(*args)
+    return result, perf_counter() - start
+
+
+def rank_topological_sorts_by_index(all_sorts: List, rules: Sequence[AST]) -> List:
+    """The ranking before rule positions were precomputed."""
+    ranked_sorts = []
+    for sort in all_sorts:
+        rank = 0
+        sort_rules = [rule for frznst in sort for rule in frznst]
+        for i in range(len(sort_rules)):
+            rank -= (rules.index(sort_rules[i]) + 1) * (i + 1)
+        ranked_sorts.append((sort, rank))
+    ranked_sorts.sort(key=lambda x: x[1])
+    return [x[0] for x in ranked_sorts]
+
+
+def compare_rankings(n: int):
+    rules = generate_rules(n)
+    rng = random.Random(n)
+    all_sorts = []
+    for _ in range(5):
+        sort = [frozenset([rule]) for rule in rules]
+        rng.shuffle(sort)
+        all_sorts.append(sort)
+    all_sorts.append([frozenset([rule]) for rule in rules])
+
+    expected, before = timed(rank_topological_sorts_by_index, all_sorts, rules)
+    positions, precompute = timed(get_rule_positions, rules)
+    result, after = timed(rank_topological_sorts, all_sorts, rules, positions)
+    assert result == expected
+    return len(all_sorts), before, precompute, after
+
+
+def test_ranking_by_rule_positions_equals_ranking_by_index():
+    compare_rankings(50)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n", [200, 1000])
+def test_benchmark_rank_topological_sorts(n):
+    sorts, before, precompute, after = compare_rankings(n)
+    print(f"\nranking {sorts} sorts of {n} rules: "
+          f"{before:.4f}s before, {precompute:.4f}s + {after:.4f}s after")
+
+
+def make_dependency_graph(head_dependencies: Dict[Tuple[str, int], Set[AST]],
+                          body_dependencies: Dict[Tuple[str, int], Set[AST]]) -> nx.DiGraph:
+    """The dependency graph of the rules, with one node per rule."""
+    g = nx.DiGraph()
+    for deps in head_dependencies.values():
+        for dep in deps:
+            g.add_node(frozenset([dep]))
+    for deps in body_dependencies.values():
+        for dep in deps:
+            g.add_node(frozenset([dep]))
+    for head_signature, rules_with_head in head_dependencies.items():
+        dependent_rules = body_dependencies.get(head_signature, [])
+        for parent_rule in rules_with_head:
+            for dependent_rule in dependent_rules:
+                g.add_edge(frozenset([parent_rule]), frozenset([dependent_rule]))
+    return g
+
+
+def merge_nodes(nodes: frozenset) -> FrozenSet[AST]:
+    old = set()
+    for x in nodes:
+        old.update(x)
+    return frozenset(old)
+
+
+def merge_constraints(g: nx.Graph) -> nx.Graph:
+    mapping = {}
+    constraints = frozenset([
+        ruleset for ruleset in g.nodes for rule in ruleset
+        if is_constraint(rule)
+    ])
+    if constraints:
+        merge_node = merge_nodes(constraints)
+        mapping = {c: merge_node for c in constraints}
+    return nx.relabel_nodes(g, mapping)
+
+
+def merge_cycles(g: nx.Graph) -> Tuple[nx.Graph, FrozenSet[AST]]:
+    mapping: Dict[AST, AST] = {}
+    merge_node: FrozenSet[AST] = frozenset()
+    where_recursion_happens = set()
+    for cycle in nx.algorithms.components.strongly_connected_components(g):
+        merge_node = merge_nodes(cycle)
+        mapping.update({old_node: merge_node for old_node in cycle})
+    for k, v in mapping.items():
+        if k != v:
+            where_recursion_happens.add(merge_node)
+    return nx.relabel_nodes(g, mapping), frozenset(where_recursion_happens)
+
+
+def remove_loops(g: nx.Graph) -> Tuple[nx.Graph, FrozenSet[AST]]:
+    remove_edges: List[Tuple[AST, AST]] = []
+    where_recursion_happens: Set[AST] = set()
+    for edge in g.edges:
+        u, v = edge
+        if u == v:
+            remove_edges.append(edge)
+            where_recursion_happens.add(u)
+    for edge in remove_edges:
+        g.remove_edge(*edge)
+    return g, frozenset(where_recursion_happens)
+
+
+def condense_with_networkx(analyzer: ProgramAnalyzer):
+    """The dependency graph pipeline before the integer-indexed condensation."""
+    deps = make_dependency_graph(analyzer.dependants, analyzer.conditions)
+    deps = merge_constraints(deps)
+    deps, _ = merge_cycles(deps)
+    deps, recursive = remove_loops(deps)
+    return deps, recursive
+
+
+def compare_dependency_graphs(n: int):
+    # few broad predicates, produced and consumed by many rules
+    program = " ".join(f"p{i % 40}(X) :- p{(i * 7 + 3) % 40}(X), q{i}(X)." for i in range(n))
+    program += " " + " ".join(f"r{i}(X) :- p{i % 40}(X), s{i}(X)." for i in range(n // 2))
+    program += " :- r1(X), r2(X). :- r3(X)."
+    analyzer = ProgramAnalyzer()
+    analyzer.add_program(program)
+
+    (expected, expected_recursive), before = timed(condense_with_networkx, analyzer)
+    (result, recursive), after = timed(condense_dependencies,
+                                       analyzer.dependants, analyzer.conditions)
+    assert list(result.nodes) == list(expected.nodes)
+    assert list(result.edges) == list(expected.edges)
+    assert recursive == expected_recursive
+    return len(analyzer.rules), before, after
+
+
+def test_condensed_dependencies_equal_the_networkx_pipeline(app_context):
+    compare_dependency_graphs(200)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n", [2000])
+def test_benchmark_dependency_graph(app_context, n):
+    rules, before, after = compare_dependency_graphs(n)
+    print(f"\ndependency graph of {rules} rules: "
+          f"{before:.4f}s before, {after:.4f}s after")
+
+
+def build_benchmark_graph(load_analyzer, program: str) -> nx.DiGraph:
+    analyzer = load_analyzer(program)
+    sorted_program = next(analyzer.get_sorted_program())
+    reified = reify_sorted_program(analyzer, sorted_program)
+    return build_graph(get_stable_models_for_program(program), reified, sorted_program,
+                       analyzer, analyzer.check_positive_recursion())
+
+
+@pytest.mark.benchmark
+def test_benchmark_graph_codec(load_analyzer):
+    program = "a(1..40). b(X) :- a(X). c(X,X+1) :- b(X). d(X) :- c(X,Y). {e(1..3)}. f(X) :- e(X), d(X)."
+    graph = build_benchmark_graph(load_analyzer, program)
+
+    as_json, json_encoding = timed(lambda: current_app.json.dumps(nx.node_link_data(graph)))
+    _, json_decoding = timed(lambda: nx.node_link_graph(current_app.json.loads(as_json)))
+    as_binary, binary_encoding = timed(encode_graph, graph)
+    _, binary_decoding = timed(decode_graph, as_binary)
+    print(f"\ngraph of {graph.number_of_nodes()} nodes: "
+          f"json {len(as_json)} bytes, {json_encoding:.4f}s + {json_decoding:.4f}s, "
+          f"binary {len(as_binary)} bytes, {binary_encoding:.4f}s + {binary_decoding:.4f}s")
+
+
+def object_hook_by_comparison(obj):
+    """The object hook before the dispatch table, restricted to graphs."""
+    if '_type' not in obj:
+        return obj
+    t = obj['_type']
+    del obj['_type']
+    if t == "Function":
+        return clingo.Function(**obj)
+    elif t == "Number":
+        return clingo.Number(**obj)
+    elif t == "String":
+        return clingo.String(**obj)
+    elif t == "Infimum":
+        return clingo.Infimum
+    elif t == "Supremum":
+        return clingo.Supremum
+    elif t == "Node":
+        obj['atoms'] = frozenset(obj['atoms'])
+        obj['diff'] = frozenset(obj['diff'])
+        return Node(**obj)
+    elif t == "Transformation":
+        return Transformation(**obj)
+    elif t == "SymbolIdentifier":
+        return SymbolIdentifier(**obj)
+    return obj
+
+
+def compare_json_decoding(load_analyzer, monkeypatch, tmp_path, n: int):
+    program = f"a(1..{n}). b(X,f(X,g(X))) :- a(X). c(X) :- b(X,Y). {{e(1..4)}}. d(X,Y) :- c(X), e(Y)."
+    graph = build_benchmark_graph(load_analyzer, program)
+    accessor = GraphAccessor(ConnectionPool(str(tmp_path / "viasp_graph_storage.db")))
+    with monkeypatch.context() as m:
+        m.setitem(current_app.config, "GRAPH_FORMAT", "json")
+        accessor.save(graph, "graph")
+    data, _ = accessor.load_data("graph")
+    accessor.close()
+
+    expected, before = timed(lambda: json.loads(data, object_hook=object_hook_by_comparison))
+    result, after = timed(current_app.json.loads, data)
+    _, parsing = timed(json.loads, data)
+    assert result == expected
+    return data, graph.number_of_nodes(), before, after, parsing
+
+
+def test_json_decoding_equals_decoding_by_comparison(load_analyzer, monkeypatch, tmp_path):
+    compare_json_decoding(load_analyzer, monkeypatch, tmp_path, 10)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n", [150])
+def test_benchmark_json_decoding(load_analyzer, monkeypatch, tmp_path, n):
+    data, nodes, before, after, parsing = compare_json_decoding(load_analyzer, monkeypatch, tmp_path, n)
+    megabytes = len(data) / 2**20
+    print(f"\ndecoding {megabytes:.1f} MB of {nodes} nodes: "
+          f"{megabytes / before:.1f} MB/s before, {megabytes / after:.1f} MB/s after, "
+          f"{megabytes / parsing:.1f} MB/s without objects")
+
+
+def add_to_program_by_rewriting(path: str, program: str):
+    """Adding to the program before it was kept in memory."""
+    with open(path, "r", encoding="utf-8") as f:
+        current = "".join(f.readlines())
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(current + program)
+
+
+def compare_program_additions(tmp_path, n: int):
+    adds = [f"p({i}) :- q({i}), not r({i}).\n" for i in range(n)]
+    path = str(tmp_path / "prg.lp")
+
+    def rewriting():
+        ProgramDatabase(path).clear_program()
+        for program in adds:
+            add_to_program_by_rewriting(path, program)
+
+    def appending():
+        ProgramDatabase(path).clear_program()
+        for program in adds:
+            ProgramDatabase(path).add_to_program(program)
+        return ProgramDatabase(path).get_program()
+
+    _, before = timed(rewriting)
+    result, after = timed(appending)
+    assert result == "".join(adds)
+    with open(path, "r", encoding="utf-8") as f:
+        assert f.read() == result
+    return before, after
+
+
+def test_appended_program_equals_the_additions(tmp_path):
+    compare_program_additions(tmp_path, 50)
+
+
+@pytest.mark.benchmark
+@pytest.mark.parametrize("n", [3000])
+def test_benchmark_program_additions(tmp_path, n):
+    before, after = compare_program_additions(tmp_path, n)
+    print(f"\nreplaying {n} additions: {before:.4f}s before, {after:.4f}s after")
@@ -1,4 +1,8 @@
-from viasp.server.database import CallCenter
+from hashlib import sha1
+
+from viasp.server.blueprints.dag_api import ConnectionPool
+from viasp.server import database
+from viasp.server.database import CallCenter, ProgramDatabase
 
 
 def test_add_a_call_to_database(clingo_call_run_sample):
@@ -14,3 +18,72 @@ def test_add_a_call_to_database(clingo_call_run_sample):
     assert len(db.calls) == 4, "Database should contain 4 after adding 4."
     assert len(db.get_all()) == 4, "Database should contain 4 after adding 4."
     assert len(db.get_pending()) == 3, "Database should contain 3 pending after adding 4 and consuming one."
+
+
+def test_graph_connection_pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / "graphs.db"), size=1)
+    connection = pool.acquire()
+    assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    tables = {r[0] for r in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert {"graphs", "current_graph", "nodes", "edges"} <= tables
+    overflow = pool.acquire()
+    assert overflow is not connection, "An exhausted pool should open a new connection."
+    pool.release(connection)
+    pool.release(overflow)
+    assert pool.acquire() is connection, "Idle connections should be reused."
+    pool.close()
+
+
+def test_program_lines_are_read_again_after_writes(tmp_path):
+    db = ProgramDatabase(str(tmp_path / "prg.lp"))
+    db.save_program("a.\nb.")
+    lines = db.get_lines()
+    assert lines == ("a.", "b.")
+    assert db.get_lines() is lines, "Unchanged programs should not be read again."
+    ProgramDatabase(db.path).add_to_program("\nc.")
+    assert db.get_lines() == ("a.", "b.", "c.")
+    db.clear_program()
+    assert db.get_lines() == ("",)
+
+
+def test_program_is_appended_to_the_file(tmp_path):
+    path = tmp_path / "prg.lp"
+    db = ProgramDatabase(str(path))
+    db.clear_program()
+    assert db.get_hash() == sha1(b"").hexdigest()
+    for i in range(3):
+        db.add_to_program(f"a({i}).\n")
+    program = "a(0).\na(1).\na(2).\n"
+    assert path.read_text() == program
+    assert db.get_program() == program
+    assert db.get_hash() == sha1(program.encode()).hexdigest()
+
+
+def test_program_changed_by_others_is_read_again(tmp_path):
+    path = tmp_path / "prg.lp"
+    db = ProgramDatabase(str(path))
+    db.save_program("a.")
+    path.write_text("b :- c.")
+    assert db.get_program() == "b :- c."
+    assert db.get_hash() == sha1(b"b :- c.").hexdigest()
+    path.unlink()
+    assert db.get_program() == ""
+    assert path.exists()
+
+
+def test_program_and_hash_are_of_the_same_version(tmp_path):
+    db = ProgramDatabase(str(tmp_path / "prg.lp"))
+    db.save_program("a.")
+    assert db.get_program_and_hash() == ("a.", sha1(b"a.").hexdigest())
+    db.add_to_program("\nb.")
+    assert db.get_program_and_hash() == ("a.\nb.", sha1(b"a.\nb.").hexdigest())
+
+
+def test_program_lines_do_not_touch_the_file(tmp_path, monkeypatch):
+    db = ProgramDatabase(str(tmp_path / "prg.lp"))
+    db.save_program("a.\nb.")
+
+    def fail(path):
+        raise AssertionError("The file should not be checked for cached lines.")
+    monkeypatch.setattr(database, "file_stat", fail)
+    assert db.get_lines() == ("a.", "b.")
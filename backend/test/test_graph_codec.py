@@ -0,0 +1,83 @@
+import sqlite3
+
+import networkx as nx
+import pytest
+from clingo import Function, Number, String, Tuple_, Infimum, Supremum
+from flask import current_app
+
+from viasp.server.blueprints.dag_api import ConnectionPool, GraphAccessor
+from viasp.shared.graph_codec import encode_graph, decode_graph
+from viasp.shared.model import Node, SymbolIdentifier, Transformation
+
+
+def dumps(graph: nx.DiGraph) -> str:
+    return current_app.json.dumps(nx.node_link_data(graph))
+
+
+@pytest.mark.parametrize("program", ["program_simple", "program_multiple_sorts", "program_recursive"])
+def test_graph_is_decoded_as_from_json(request, program, get_sort_program_and_get_graph):
+    graph_info, _ = get_sort_program_and_get_graph(request.getfixturevalue(program))
+    graph = nx.node_link_graph(graph_info[0])
+    via_json = nx.node_link_graph(current_app.json.loads(dumps(graph)))
+    via_binary = decode_graph(encode_graph(graph))
+    assert dumps(via_binary) == dumps(via_json)
+    assert dumps(decode_graph(encode_graph(via_binary))) == dumps(via_json)
+
+
+def test_all_kinds_of_symbols_are_encoded(app_context):
+    symbols = [Number(0), Number(-5), Number(2**31 - 1), Number(-2**31),
+               String("ä \"quoted\" \n"), Function("f", [Tuple_([Number(1), String("x")])]),
+               Function("g", [Function("h", [], False)], False), Tuple_([]), Infimum, Supremum]
+    facts = Node(frozenset(map(SymbolIdentifier, symbols)), 0)
+    facts.atoms = facts.diff
+    derived = SymbolIdentifier(Function("a", [Number(-1)]), has_reason=True)
+    node = Node(frozenset([derived]), 1, facts.diff | {derived},
+                reason={str(derived.symbol): [next(iter(facts.diff)), None]},
+                space_multiplier=0.3)
+    graph = nx.DiGraph()
+    graph.add_edge(facts, node, transformation=Transformation(1, ("a(-1) :- f((1,\"x\")).", )))
+
+    via_binary = decode_graph(encode_graph(graph))
+    assert dumps(via_binary) == dumps(nx.node_link_graph(current_app.json.loads(dumps(graph))))
+    decoded_facts, decoded_node = via_binary.nodes
+    assert {s.symbol for s in decoded_facts.diff} == set(symbols)
+    assert decoded_node.reason[str(derived.symbol)][1] is None
+    assert decoded_node.space_multiplier == 0.3
+
+
+def test_graphs_the_codec_cannot_represent_are_stored_as_json(app_context, tmp_path, capsys):
+    accessor = GraphAccessor(ConnectionPool(str(tmp_path / "graphs.db")))
+    current_app.config["GRAPH_FORMAT"] = "binary"
+    nodes = nx.DiGraph()
+    nodes.add_edge(Node(frozenset(), 0), Node(frozenset(), 1), transformation=Transformation(1, ()))
+    strings = nx.DiGraph()
+    strings.add_edge("a", "b")
+    accessor.save(nodes, "nodes")
+    assert "[WARNING]" not in capsys.readouterr().out
+    accessor.save(strings, "strings")
+    assert "[WARNING]" in capsys.readouterr().out, "Falling back to JSON should be logged."
+    formats = dict(accessor.cursor.execute("SELECT hash, format FROM graphs").fetchall())
+    assert formats == {"nodes": "binary", "strings": "json"}
+    assert [n.rule_nr for n in nx.node_link_graph(accessor.load_json("nodes")).nodes] == [0, 1]
+    assert list(nx.node_link_graph(accessor.load_json("strings")).edges) == [("a", "b")]
+
+    current_app.config["GRAPH_FORMAT"] = "json"
+    accessor.save(nodes, "nodes")
+    assert accessor.cursor.execute("SELECT format FROM graphs WHERE hash = 'nodes'").fetchone()[0] == "json"
+    current_app.config.pop("GRAPH_FORMAT")
+    accessor.close()
+
+
+def test_graphs_stored_before_the_format_column_are_json(tmp_path):
+    path = str(tmp_path / "graphs.db")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE graphs (hash TEXT PRIMARY KEY, data TEXT NOT NULL, sort BLOB NOT NULL)")
+    connection.execute("INSERT INTO graphs VALUES ('old', '{}', '')")
+    connection.commit()
+    connection.close()
+
+    pool = ConnectionPool(path)
+    connection = pool.acquire()
+    assert connection.execute("SELECT format FROM graphs WHERE hash = 'old'").fetchone()[0] == "json"
+    pool.release(connection)
+    pool.close()
@@ -1,17 +1,23 @@
+from time import sleep
 from typing import List
+from uuid import uuid5
 
 import networkx as nx
+import pytest
+from clingo import Function as ClingoFunction
 from clingo.ast import AST, Function, Location, Position
 
 from viasp.asp.justify import make_reason_path_from_facts_to_stable_model, \
-    get_h_symbols_from_model
+    get_h_symbols_from_model, get_h_symbols_from_models, build_paths, make_path_pool, \
+    make_fact_node, make_transformation_mapping, assemble_graph
+from viasp.asp.utils import identify_reasons, index_nodes
 from viasp.shared.util import pairwise
-from viasp.asp.reify import transform
+from viasp.asp.reify import ProgramAnalyzer, transform
 from viasp.shared.model import Node, Transformation, SymbolIdentifier
 from viasp.shared.util import get_start_node_from_graph, get_end_node_from_path
 
 
-from helper import get_stable_models_for_program, parse_program_to_ast
+from helper import get_stable_models_for_program, parse_program_to_ast, reify_sorted_program
 
 
 def test_justification_creates_a_graph_with_a_single_path(get_sort_program_and_get_graph):
@@ -171,6 +177,149 @@ def test_atoms_are_propagated_correctly_through_diffs(app_context):
         assert len(src.atoms) == len(tgt.atoms) - len(tgt.diff)
 
 
+def test_h_symbols_of_all_models_are_found_in_one_grounding(load_analyzer):
+    program = "a(1..3). d(2). {b(X)} :- a(X). c(X) :- b(X), not d(X). e :- c(X), X > 1. #show c/1. #show X+1 : b(X)."
+    analyzer = load_analyzer(program)
+    models = get_stable_models_for_program(program)
+    for sorted_program in analyzer.get_sorted_program():
+        reified = reify_sorted_program(analyzer, sorted_program)
+        args = (reified, analyzer.get_facts(), analyzer.get_constants(),
+                analyzer.get_conflict_free_h(), analyzer.get_conflict_free_h_showTerm())
+        batched = get_h_symbols_from_models(models, *args)
+        assert len(batched) == len(models)
+        for model, h_symbols in zip(models, batched):
+            assert sorted(h_symbols) == sorted(get_h_symbols_from_model(model, *args))
+
+
+@pytest.mark.parametrize("program, reason", [
+    ("a(1..3). b(X) :- a(X). c :- #count{X: b(X)} > 1.", ["b(3)"]),
+    ("a(1..3). b(X) :- a(X). c :- b(X) : a(X), X < 3.", ["a(2)", "b(2)"]),
+])
+def test_reasons_of_all_models_do_not_depend_on_the_hash_seed(load_analyzer, program, reason):
+    # c has several reasons, the one kept follows the order of the ground atoms
+    analyzer = load_analyzer(program)
+    models = get_stable_models_for_program(program)
+    for sorted_program in analyzer.get_sorted_program():
+        paths = build_paths(models, reify_sorted_program(analyzer, sorted_program),
+                            make_transformation_mapping(sorted_program),
+                            make_fact_node(analyzer), analyzer,
+                            analyzer.check_positive_recursion())
+        node = next(n for path in paths for n in path.nodes if "c" in n.reason)
+        assert sorted(map(str, node.reason["c"])) == reason
+
+
+def test_stable_models_without_a_model_of_the_transformed_program_warn(capsys):
+    assert get_h_symbols_from_models([["b."]], [":- b."], [], []) == [[]]
+    assert "[WARNING]" in capsys.readouterr().out
+
+
+def describe_path(path: nx.DiGraph) -> List[tuple]:
+    def describe(node: Node) -> tuple:
+        recursive = [describe(n) for n in nx.topological_sort(node.recursive)] \
+            if isinstance(node.recursive, nx.DiGraph) else node.recursive
+        return (node.rule_nr, sorted(str(s.symbol) for s in node.diff),
+                sorted(str(s.symbol) for s in node.atoms),
+                sorted((k, list(map(str, v))) for k, v in node.reason.items()), recursive)
+    return [(describe(u), describe(v), data["transformation"].id)
+            for u, v, data in path.edges(data=True)]
+
+
+def test_paths_are_built_in_worker_processes(load_analyzer):
+    # every recursive symbol has a single reason, so the paths are the same on every run
+    program = "a(1..3). {b(X)} :- a(X). c(X) :- b(X). e(1,2). e(2,3). e(3,4). r(X) :- c(X). r(Y) :- r(X), e(X, Y)."
+    analyzer = load_analyzer(program)
+    models = get_stable_models_for_program(program)
+    recursion_rules = analyzer.check_positive_recursion()
+    for sorted_program in analyzer.get_sorted_program():
+        reified = reify_sorted_program(analyzer, sorted_program)
+        mapping = make_transformation_mapping(sorted_program)
+        fact_node = make_fact_node(analyzer)
+        args = (models, reified, mapping, fact_node, ProgramAnalyzer.from_names(analyzer.names),
+                recursion_rules)
+        in_place = build_paths(*args, workers=1)
+        with make_path_pool(2) as pool:
+            in_workers = build_paths(*args, workers=2, executor=pool)
+        assert any(isinstance(n.recursive, nx.DiGraph) for path in in_place for n in path.nodes)
+        assert [describe_path(p) for p in in_workers] == [describe_path(p) for p in in_place]
+        for path in in_workers:
+            node = next(n for n in path.nodes if n.rule_nr == -1)
+            assert node is fact_node
+            for u, v in path.edges:
+                assert {s.symbol for s in u.atoms} <= {s.symbol for s in v.atoms}
+                assert all(s.uuid == uuid5(v.uuid, str(s.symbol)) for s in v.atoms if s not in v.diff)
+                if isinstance(v.recursive, nx.DiGraph):
+                    shared = {id(s) for s in v.diff}
+                    assert all(id(s) in shared for n in v.recursive.nodes for s in n.diff)
+
+
+def test_paths_of_programs_with_constants_are_built_in_worker_processes(load_analyzer):
+    program = "#const n = 2. a(1..n). {b(X)} :- a(X). c(X) :- b(X), X < n."
+    analyzer = load_analyzer(program)
+    models = get_stable_models_for_program(program)
+    for sorted_program in analyzer.get_sorted_program():
+        args = (models, reify_sorted_program(analyzer, sorted_program),
+                make_transformation_mapping(sorted_program), make_fact_node(analyzer),
+                analyzer, analyzer.check_positive_recursion())
+        in_place = build_paths(*args, workers=1)
+        with make_path_pool(2) as pool:
+            in_workers = build_paths(*args, workers=2, executor=pool)
+        assert [describe_path(p) for p in in_workers] == [describe_path(p) for p in in_place]
+
+
+def test_path_pool_cancels_pending_work_on_shutdown():
+    pool = make_path_pool(1)
+    futures = [pool.submit(sleep, 0.5) for _ in range(10)]
+    pool.shutdown(wait=True)
+    assert futures[0].done() and not futures[0].cancelled()
+    assert futures[-1].cancelled()
+
+
+def test_harmonized_graphs_copy_the_symbols_of_equal_nodes(load_analyzer):
+    program = "a(1..2). {b(X)} :- a(X). c(X) :- a(X). d(X) :- b(X), c(X)."
+    analyzer = load_analyzer(program)
+    models = get_stable_models_for_program(program)
+    recursion_rules = analyzer.check_positive_recursion()
+    graphs: List[nx.DiGraph] = []
+    pattern_nodes = None
+    for sorted_program in analyzer.get_sorted_program():
+        reified = reify_sorted_program(analyzer, sorted_program)
+        paths = build_paths(models, reified, make_transformation_mapping(sorted_program),
+                            make_fact_node(analyzer), analyzer, recursion_rules)
+        graphs.append(assemble_graph(paths, analyzer, pattern_nodes))
+        if pattern_nodes is None:
+            pattern_nodes = index_nodes(graphs[0])
+            first_symbols = {id(s): s.has_reason for node in graphs[0].nodes for s in node.diff}
+    first, *others = graphs
+    assert len(others) > 0
+    assert {id(s): s.has_reason for node in first.nodes for s in node.diff} == first_symbols, \
+        "Harmonizing other graphs should not change the symbols of the pattern."
+    for g in others:
+        equal = [node for node in g.nodes if node in pattern_nodes]
+        assert len(equal) > 0
+        for node in equal:
+            pattern = pattern_nodes[node]
+            assert node.uuid == pattern.uuid
+            assert {s.uuid for s in node.diff} == {s.uuid for s in pattern.diff}
+            assert {s.uuid for s in node.atoms} == {s.uuid for s in pattern.atoms}
+            assert all(id(s) not in first_symbols for s in node.diff)
+
+
+def test_reified_program_is_grounded_without_parsing_it_again(load_analyzer):
+    program = "#const n=3. a(1..n). d(2). 1{b(X) : a(X)}2. c(X) :- b(X), not d(X). e :- #count{X : c(X)} > 1. #show c/1. #show X+1 : b(X)."
+    analyzer = load_analyzer(program)
+    models = get_stable_models_for_program(program)
+    for sorted_program in analyzer.get_sorted_program():
+        reified = reify_sorted_program(analyzer, sorted_program)
+        as_text = ["".join(map(str, reified))]
+        args = (analyzer.get_facts(), analyzer.get_constants(),
+                analyzer.get_conflict_free_h(), analyzer.get_conflict_free_h_showTerm())
+        for model in models:
+            # rules the builder rejects raise, so these are grounded from the ASTs
+            from_ast = get_h_symbols_from_model(model, reified, *args)
+            assert len(from_ast) > 0
+            assert sorted(from_ast) == sorted(get_h_symbols_from_model(model, as_text, *args))
+
+
 def test_multiple_sortings_yield_input_order_first(load_analyzer):
     # uses all sorted programs
     program= """
@@ -207,3 +356,41 @@ def test_multiple_sortings_yield_input_order_first_2(load_analyzer):
     assert sorted_programs[1][1] == Transformation(1, (parse_program_to_ast("c :- a."),))
     assert sorted_programs[1][2] == Transformation(2, (parse_program_to_ast("c :- b."),))
 
+
+def test_sortings_of_many_independent_rules_are_bounded(app_context):
+    # 30 independent rules have 30! topological sorts
+    rules = [f"b{i} :- a{i}." for i in range(30)]
+    program = " ".join(f"a{i}." for i in range(30)) + " " + " ".join(rules)
+    analyzer = ProgramAnalyzer(max_sorts=5)
+    analyzer.add_program(program)
+    sorted_programs = list(analyzer.get_sorted_program())
+    assert len(sorted_programs) == 5
+    assert len({tuple(t.hash for t in sorted_program) for sorted_program in sorted_programs}) == 5
+    # the best sort keeps the input order
+    assert [str(rule) for t in sorted_programs[0] for rule in t.rules] == rules
+
+
+def test_bounded_sortings_keep_ranking_of_few_sorts(load_analyzer):
+    program = "1 {a; b} 1. c :- a. c :- b. d :- c."
+    analyzer = load_analyzer(program)
+    all_sorts = list(analyzer.get_sorted_program())
+    bounded = ProgramAnalyzer(max_sorts=len(all_sorts))
+    bounded.add_program(program)
+    assert list(bounded.get_sorted_program()) == all_sorts
+
+
+def test_reasons_are_identified_on_long_paths():
+    symbols = [ClingoFunction(f"p{i}") for i in range(2000)]
+    nodes = [Node(frozenset([SymbolIdentifier(symbols[0])]), 0)]
+    for i in range(1, len(symbols)):
+        nodes.append(Node(frozenset([SymbolIdentifier(symbols[i])]), i,
+                          reason={str(symbols[i]): [symbols[i - 1], symbols[0]]}))
+    path = nx.DiGraph()
+    for a, b in pairwise(nodes):
+        path.add_edge(a, b)
+    identify_reasons(path)
+    for previous, node in pairwise(nodes):
+        (derived,) = node.diff
+        assert derived.has_reason
+        assert node.reason[str(derived.symbol)] == [next(iter(previous.diff)), next(iter(nodes[0].diff))]
+        assert node.reason[str(derived.symbol)][0].uuid == next(iter(previous.diff)).uuid
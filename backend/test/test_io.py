@@ -5,6 +5,7 @@ from flask import current_app
 import clingo.ast
 from clingo import Control, ModelType
 
+from viasp.server.database import ProgramDatabase
 from viasp.shared.io import clingo_model_to_stable_model
 from viasp.shared.model import StableModel, ClingoMethodCall, Signature, Transformation, TransformationError, \
     FailedReason
@@ -61,6 +62,21 @@ def test_transformation(app_context):
     assert serialized
 
 
+def test_transformations_are_encoded_without_reading_the_program(get_sort_program_and_get_graph, monkeypatch):
+    program = "c(1). c(2).\nb(X) :-\n    c(X).\na(X) :- b(X)."
+    graph_info, _ = get_sort_program_and_get_graph(program)
+    graph = nx.node_link_graph(graph_info[0])
+    expected = current_app.json.dumps(node_link_data(graph))
+
+    def read_program(self):
+        raise AssertionError("The program should not be read when encoding.")
+    monkeypatch.setattr(ProgramDatabase, "get_program", read_program)
+    monkeypatch.setattr(ProgramDatabase, "get_lines", read_program)
+    assert current_app.json.dumps(node_link_data(graph)) == expected
+    rules = {rule for _, _, t in graph.edges(data="transformation") for rule in t.source}
+    assert "b(X) :-\n    c(X)." in rules
+
+
 def test_transformation_error(app_context):
     sample_data = []
     clingo.ast.parse_string("a.", lambda x: sample_data.append(x))
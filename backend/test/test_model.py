@@ -1,6 +1,11 @@
-from clingo import Control
+import json
+from dataclasses import replace
 
-from viasp.shared.io import model_to_json
+from clingo import Control, Function, Number
+
+from viasp.asp.utils import insert_atoms_into_nodes
+from viasp.shared.io import model_to_json, DataclassJSONEncoder
+from viasp.shared.model import Node, SymbolIdentifier, ChainedAtoms
 
 
 def test_clingo_model_is_serializable():
@@ -12,3 +17,25 @@ def test_clingo_model_is_serializable():
         for model in handle:
             serialized_models.append(model_to_json(model))
     assert serialized_models
+
+
+def test_atoms_of_a_path_are_chained():
+    facts = Node(frozenset([SymbolIdentifier(Function("a", [Number(1)]))]), 0)
+    b = Node(frozenset([SymbolIdentifier(Function("b", [Number(1)]))]), 1)
+    c = Node(frozenset([SymbolIdentifier(Function("c", [Number(1)])),
+                        SymbolIdentifier(Function("a", [Number(1)]))]), 2)
+    insert_atoms_into_nodes([facts, b, c])
+    assert isinstance(c.atoms, ChainedAtoms)
+    assert c.atoms.added == frozenset([Function("c", [Number(1)])])
+    assert c.atoms.parent is b.atoms
+
+    materialized = frozenset(c.atoms)
+    assert c.atoms == materialized and materialized == c.atoms
+    assert hash(c.atoms) == hash(materialized)
+    assert len(c.atoms) == 3
+    assert Function("b", [Number(1)]) in c.atoms
+    assert {s.uuid for s in c.atoms}.isdisjoint({s.uuid for s in b.atoms})
+    assert {s.uuid for s in c.atoms} == {s.uuid for s in c.atoms}
+    assert replace(c, atoms=materialized) == c
+    assert json.loads(json.dumps(c, cls=DataclassJSONEncoder))["atoms"] == \
+        json.loads(json.dumps(replace(c, atoms=materialized), cls=DataclassJSONEncoder))["atoms"]
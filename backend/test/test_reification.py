@@ -6,7 +6,8 @@ import pytest
 
 from viasp.asp.ast_types import (SUPPORTED_TYPES, UNSUPPORTED_TYPES,
                                  make_unknown_AST_enum_types)
-from viasp.asp.reify import ProgramAnalyzer, transform
+from viasp.asp.reify import ProgramAnalyzer, ProgramReifier, transform, reify, reify_cache
+from viasp.shared.model import Transformation
 
 
 def assertProgramEqual(actual, expected, message=None):
@@ -219,6 +220,20 @@ def test_data_type_is_correct(get_sort_program):
     assert data_type == AST, f"{a_rule} should be an ASTType, not {data_type}"
 
 
+def test_reification_is_reused_at_other_positions(app_context):
+    rules = parse_program_to_ast("b(X) :- a(X), not c(X). #show d(X) : b(X). :- b(1). e(1..2) :- b(X).")[1:]
+    kwargs = dict(h="h_", h_showTerm="h_showTerm_", model="model_", conflict_free_showTerm="showTerm_",
+                  get_conflict_free_variable=lambda: "Y")
+    first = reify(Transformation(3, tuple(rules)), **kwargs)
+    hits = reify_cache.info()["hits"]
+    moved = reify(Transformation(5, tuple(rules)), **kwargs)
+    assert reify_cache.info()["hits"] == hits + 1
+    visitor = ProgramReifier(5, **kwargs)
+    expected = [reified for rule in rules for reified in visitor.visit(rule)]
+    assert [str(rule) for rule in moved] == [str(rule) for rule in expected]
+    assert [str(rule) for rule in reify(Transformation(3, tuple(rules)), **kwargs)] == [str(rule) for rule in first]
+
+
 def get_reasons(prg, model):
     ctl = Control()
     ctl.add("base", [], prg)
@@ -1,5 +1,5 @@
 import React from 'react';
-import {make_atoms_string} from "../utils/index";
+import {make_atoms_string, decodeInterned, INTERNED_HEADERS} from "../utils/index";
 import './detail.css';
 import PropTypes from "prop-types";
 import {showError, useMessages} from '../contexts/UserMessages';
@@ -57,14 +57,14 @@ DetailForSignature.propTypes =
     }
 
 function loadDataForDetail(backendURL, uuid) {
-    return fetch(`${backendURL('detail')}/${uuid}`)
+    return fetch(`${backendURL('detail')}/${uuid}`, {headers: INTERNED_HEADERS})
         .then((r) => {
             if (!r.ok) {
                 throw new Error(
                     `${r.status} ${r.statusText}`
                 );
             }
-            return r.json();
+            return decodeInterned(r);
         });
 }
 
@@ -4,8 +4,10 @@ import {useSettings} from "./Settings";
 import PropTypes from "prop-types";
 import { computeSortHash, make_default_nodes, make_default_clingraph_nodes } from "../utils/index";
 
-function fetchTransformations(backendURL) {
-    return fetch(`${backendURL("graph/transformations")}`).then(r => {
+const SORT_STATUS_INTERVAL = 1000;
+
+function fetchSnapshot(backendURL) {
+    return fetch(`${backendURL("graph/snapshot")}`).then(r => {
         if (r.ok) {
             return r.json()
         }
@@ -24,26 +26,16 @@ function fetchSorts(backendURL) {
     });
 }
 
-function loadFacts(backendURL) {
-    return fetch(`${backendURL('graph/facts')}`).then((r) => {
-        if (!r.ok) {
-            throw new Error(`${r.status} ${r.statusText}`);
+function fetchSortStatus(backendURL) {
+    return fetch(`${backendURL("graph/sorts/status")}`).then(r => {
+        if (r.ok) {
+            return r.json()
         }
-        return r.json();
-    });
-}
-
+        throw new Error(r.statusText);
 
-function loadNodeData(hash, backendURL) {
-    return fetch(`${backendURL('graph/children')}/${hash}`).then((r) => {
-        if (!r.ok) {
-            throw new Error(`${r.status} ${r.statusText}`);
-        }
-        return r.json();
     });
 }
 
-
 function loadClingraphChildren(backendURL) {
     return fetch(`${backendURL('clingraph/children')}`).then((r) => {
         if (!r.ok) {
@@ -292,44 +284,60 @@ const TransformationProvider = ({children}) => {
 
     React.useEffect(() => {
         let mounted = true;
+        const addedSorts = new Set();
+        // sorts that are still computed in the backend are added once ready
+        const addReadySorts = () => {
+            fetchSortStatus(backendUrlRef.current)
+                .then(status => {
+                    if (!mounted) {
+                        return;
+                    }
+                    status
+                        .filter((s) => s.ready && !addedSorts.has(s.hash))
+                        .forEach((s) => {
+                            addedSorts.add(s.hash);
+                            dispatch(addSort(s.hash));
+                        });
+                    if (status.some((s) => !s.ready)) {
+                        setTimeout(addReadySorts, SORT_STATUS_INTERVAL);
+                    }
+                })
+                .catch(error => {
+                    messageDispatchRef.current(showError(`Failed to get dependency sorts: ${error}`))
+                });
+        };
         fetchSorts(backendUrlRef.current).catch(error => {
             messageDispatchRef.current(showError(`Failed to get dependency sorts: ${error}`))
         })
             .then(items => {
                 if (mounted) {
-                    items.map((s) => dispatch(addSort(s)))
+                    items.forEach((s) => {
+                        addedSorts.add(s);
+                        dispatch(addSort(s));
+                    });
+                    addReadySorts();
                 }
             })
             return () => { mounted = false };
         }, []);
         
-    const loadtransformationNodesMap = React.useCallback((items) => {
+    const loadtransformationNodesMap = React.useCallback((snapshot) => {
         dispatch(clearNodes());
         dispatch(clearClingraphGraphics());
-        const transformations = items.map((t) => ({id: t.id, hash: t.hash}));
-        const promises = transformations.map(t =>
-            loadNodeData(t.hash, backendUrlRef.current));
-
+        const transformationNodesMap = snapshot.transformations.reduce(
+            (map, t, i) => {
+                map[t.id] = snapshot.children[i];
+                return map;
+            },
+            {}
+        );
         // load facts
-        promises.push(loadFacts(backendUrlRef.current));
-        transformations.push({id: -1});
-        // load clingraph
-        promises.push(loadClingraphChildren(backendUrlRef.current));
-            
-        // Wait for all promises to resolve
-        Promise.all(promises)
-            .then((allItems) => {
-                const nodesRes = allItems.slice(0, allItems.length -1)
-                const clingraphNodes = allItems[allItems.length - 1]
+        transformationNodesMap[-1] = snapshot.facts;
+        dispatch(setNodes(transformationNodesMap));
 
-                const transformationNodesMap = nodesRes.reduce(
-                    (map, items, i) => {
-                        map[transformations[i].id] = items;
-                        return map;
-                    },
-                    {}
-                );
-                dispatch(setNodes(transformationNodesMap));
+        // load clingraph
+        loadClingraphChildren(backendUrlRef.current)
+            .then((clingraphNodes) => {
                 dispatch(setClingraphGraphics(clingraphNodes));
             })
             .catch((error) => {
@@ -342,17 +350,17 @@ const TransformationProvider = ({children}) => {
     React.useEffect(() => {
         let mounted = true;
         if (state.currentSort !== '') {
-            fetchTransformations(backendUrlRef.current)
+            fetchSnapshot(backendUrlRef.current)
                 .catch((error) => {
                     messageDispatchRef.current(
                         showError(`Failed to get transformations: ${error}`)
                     );
                 })
-                .then((items) => {
-                    if (mounted) {
+                .then((snapshot) => {
+                    if (mounted && snapshot) {
                         dispatch(clearTransformations());
-                        dispatch(addTransformationSet(items));
-                        loadtransformationNodesMap(items);
+                        dispatch(addTransformationSet(snapshot.transformations));
+                        loadtransformationNodesMap(snapshot);
                     }
                 });
         }
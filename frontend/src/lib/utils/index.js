@@ -19,6 +19,40 @@ export function make_atoms_string(atoms) {
     }
 }
 
+export const WIRE_FORMAT_HEADER = "X-Viasp-Format";
+export const INTERNED_HEADERS = {[WIRE_FORMAT_HEADER]: "interned"};
+
+function resolveSymbols(value, symbols) {
+    if (Array.isArray(value)) {
+        return value.map((v) => resolveSymbols(v, symbols));
+    }
+    if (value === null || typeof value !== "object") {
+        return value;
+    }
+    if (value._type === "SymbolRef") {
+        return symbols[value.ref];
+    }
+    const resolved = {};
+    for (const [key, v] of Object.entries(value)) {
+        resolved[key] = resolveSymbols(v, symbols);
+    }
+    if (value._type === "SymbolIdentifier" && typeof value.symbol === "number") {
+        resolved.symbol = symbols[value.symbol];
+    }
+    return resolved;
+}
+
+export function decodeInterned(response) {
+    // Responses to requests with INTERNED_HEADERS refer to a table of symbols,
+    // servers that do not support it answer in the plain format
+    return response.json().then((body) => {
+        if (response.headers.get(WIRE_FORMAT_HEADER) !== "interned") {
+            return body;
+        }
+        return resolveSymbols(body.data, body.symbols);
+    });
+}
+
 export function make_rules_string(rule) {
     // TODO: This is pretty bad. Adjust types for this.
     return rule.join(" ")